@@ -2,6 +2,7 @@ from airflow import DAG
 from airflow.operators.python import PythonOperator
 from datetime import datetime, timedelta
 import os
+import time
 import requests
 
 API_URL = os.getenv("API_URL", "http://backend:8000")
@@ -9,17 +10,44 @@ API_TOKEN = os.getenv("API_TOKEN")
 
 HEADERS = {"x-api-token": API_TOKEN}
 
+# The API runs both steps as background jobs; the tasks poll until they finish
+JOB_POLL_SECONDS = int(os.getenv("JOB_POLL_SECONDS", "15"))
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", "7200"))
+
+def run_job(path, description):
+    """
+    Starts a job via POST path and waits until it succeeds; raises if it fails.
+    """
+    response = requests.post(f"{API_URL}{path}", headers=HEADERS, timeout=30)
+    if response.status_code not in (200, 202):
+        raise Exception(f"Failed to start {description}: {response.text}")
+    job_id = response.json()["job_id"]
+    print(f"Started {description} job {job_id}")
+
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    printed = None
+    while time.monotonic() < deadline:
+        time.sleep(JOB_POLL_SECONDS)
+        response = requests.get(f"{API_URL}/jobs/{job_id}", headers=HEADERS, timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get {description} job status: {response.text}")
+        job = response.json()
+        if job["status"] == "succeeded":
+            print(job["result"])
+            return job["result"]
+        if job["status"] == "failed":
+            print("\n".join(job["progress"]))
+            raise Exception(f"{description} failed: {job['error']}")
+        if job["progress"] and job["progress"][-1] != printed:
+            printed = job["progress"][-1]
+            print(printed)
+    raise Exception(f"{description} job {job_id} did not finish within {JOB_TIMEOUT_SECONDS}s")
+
 def call_update_data():
-    response = requests.post(f"{API_URL}/update-data", headers=HEADERS)
-    if response.status_code != 200:
-        raise Exception(f"Failed to update data: {response.text}")
-    print(response.json())
+    run_job("/update-data", "data update")
 
 def call_reindex():
-    response = requests.post(f"{API_URL}/reindex", headers=HEADERS)
-    if response.status_code != 200:
-        raise Exception(f"Failed to reindex: {response.text}")
-    print(response.json())
+    run_job("/reindex", "reindex")
 
 default_args = {
     "owner": "airflow",
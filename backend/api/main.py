@@ -1,18 +1,60 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from api.src.chatbot import get_fact_check_response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from api.src.chatbot import (
+    get_fact_check_response, get_fact_check_responses, stream_fact_check_response, BATCH_MAX_QUERIES
+)
+from api.src.index_manager import index_manager
+from api.src.embedding_cache import query_embedding_cache
+from api.src.answer_cache import answer_cache
 from api.src.data_collect import data_collect
 from api.src.build_index import build_index
+from api.src.attribute_index import SearchFilter
+from api.src.jobs import job_runner, JobConflict
+from api.src.request_coalescing import Overloaded, llm_gate
+from api.src.metrics import registry, request_timings
+from datetime import date
 from dotenv import load_dotenv
+import json
+import time
 import os
 
 load_dotenv()
 
 token_header = os.getenv("API_TOKEN_HEADER", "x-api-token")
+# Requests sending this header get a Server-Timing header with their per-stage breakdown
+timing_header = os.getenv("TIMING_REQUEST_HEADER", "x-timing")
+
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "Request latency by route and status.", ("method", "route", "status")
+)
+
+# ---- Background Jobs ----
+def load_new_index(job, published_version):
+    # The index is built in the worker; this process only has to load it
+    index_manager.refresh()
+    return {"published_version": published_version, "index_version": index_manager.version}
+
+job_runner.register("update-data", data_collect)
+job_runner.register("reindex", build_index, on_success=load_new_index)
+
+# ---- Index Lifecycle ----
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the index once per process; requests are served from memory after this.
+    try:
+        index_manager.refresh()
+    except Exception as e:
+        print(f"⚠️ Could not load FAISS index at startup: {e}")
+    index_manager.start_polling()
+    yield
+    index_manager.stop_polling()
+    job_runner.shutdown()
 
 # ---- FastAPI App Setup ----
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # ---- CORS (for dev: allow all origins) ----
 app.add_middleware(
@@ -23,56 +65,214 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---- Instrumentation ----
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    timings = {} if request.headers.get(timing_header) else None
+    token = request_timings.set(timings)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    elapsed = time.perf_counter() - started
+
+    # Route templates, not raw paths, so /jobs/{job_id} stays one series
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        elapsed, method=request.method, route=route.path if route else "unmatched", status=response.status_code
+    )
+    if timings is not None:
+        # Streamed responses only include the stages finished before the first byte
+        stages = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+        response.headers["Server-Timing"] = ", ".join(stages + [f"total;dur={elapsed * 1000:.1f}"])
+    return response
+
 # ---- Pydantic Models ----
-class QueryRequest(BaseModel):
-    query: str
+class SearchOptions(BaseModel):
     source_threshold: float
+    # Search effort for approximate indexes (IVF / HNSW); None uses the server defaults
+    nprobe: int | None = None
+    ef_search: int | None = None
+    # Optional filters, applied during the search: only chunks with one of these
+    # verdicts and/or published within [published_from, published_to] are used
+    verdicts: list[str] | None = None
+    published_from: date | None = None
+    published_to: date | None = None
+
+    def search_filter(self):
+        return SearchFilter(self.verdicts, self.published_from, self.published_to)
+
+class QueryRequest(SearchOptions):
+    query: str
+
+class BatchQueryRequest(SearchOptions):
+    queries: list[str]
 
 class QueryResponse(BaseModel):
     answer: str
     sources: list[str]
     scores: list[float]
+    # Tokens this request used (prompt, completion, context sent); None when answered from the cache
+    usage: dict[str, int] | None = None
+
+def to_query_response(result) -> QueryResponse:
+    return QueryResponse(
+        answer=result["answer"],
+        sources=[f"{src['title']} ({src['url']})" for src in result["sources"]],
+        scores=result["scores"],
+        usage=result.get("usage")
+    )
+
+def too_many_requests(error: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+def job_conflict(error: JobConflict) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(error), headers={"Location": f"/jobs/{error.job.id}"})
 
 # ---- Endpoint ----
 @app.post("/ask", response_model=QueryResponse)
 def ask_question(request: QueryRequest):
     try:
-        result = get_fact_check_response(request.query, threshold=request.source_threshold)
+        result = get_fact_check_response(
+            request.query,
+            threshold=request.source_threshold,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            search_filter=request.search_filter()
+        )
+
+        return to_query_response(result)
 
-        return QueryResponse(
-            answer=result["answer"],
-            sources=[f"{src['title']} ({src['url']})" for src in result["sources"]],
-            scores=result["scores"]
+    except Overloaded as e:
+        raise too_many_requests(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask/batch", response_model=list[QueryResponse])
+async def ask_questions(request: BatchQueryRequest):
+    """
+    Checks a list of claims at once; results come back in the same order.
+    All claims share one embedding request and one index search.
+    """
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    if not request.queries:
+        return []
+    try:
+        results = await get_fact_check_responses(
+            request.queries,
+            threshold=request.source_threshold,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            search_filter=request.search_filter()
         )
+        return [to_query_response(result) for result in results]
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    """
+    Server-Sent Events version of /ask: a "sources" event is sent as soon as retrieval
+    finishes, followed by one "token" event per LLM token and a final "done" event.
+    """
+    # Once the stream has started the status can't change: reject while we still can
+    try:
+        llm_gate.admit()
+    except Overloaded as e:
+        raise too_many_requests(e)
+
+    async def event_stream():
+        try:
+            async for item in stream_fact_check_response(
+                request.query,
+                threshold=request.source_threshold,
+                nprobe=request.nprobe,
+                ef_search=request.ef_search,
+                search_filter=request.search_filter()
+            ):
+                event = item.pop("event")
+                if event == "sources":
+                    # Same shape as QueryResponse; chunk text stays server-side
+                    item = {
+                        "sources": [f"{src['title']} ({src['url']})" for src in item["sources"]],
+                        "scores": item["scores"],
+                        "index_version": item["index_version"]
+                    }
+                yield format_sse(event, item)
+        except Exception as e:
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/index-version")
+def index_version():
+    return {
+        "version": index_manager.version,
+        "loaded_at": index_manager.loaded_at.isoformat() if index_manager.loaded_at else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache-stats")
+def cache_stats():
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "answers": answer_cache.stats()
+    }
     
 
-@app.post("/update-data")
-def update_data(request: Request):
+@app.post("/update-data", status_code=202)
+def update_data(request: Request, backfill_pages: int | None = None, reparse: bool = False):
     # incoming_token = request.headers.get(token_header)
     # print("Incoming token")
     # print(incoming_token)
     # if incoming_token != os.getenv("API_TOKEN"):
     #     raise HTTPException(status_code=403, detail="Forbidden: Invalid token")
-    
+
+    # Runs in a background worker; poll /jobs/{job_id} for progress
+    # reparse re-extracts the cached pages instead of scraping
     try:
-        data_collect()
-        return {"status": "success", "message": "Data collection completed."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Data collection failed: {e}")
-    
-@app.post("/reindex")
-def reindex(request: Request):
+        job = job_runner.submit("update-data", backfill_pages=backfill_pages, reparse=reparse)
+    except JobConflict as e:
+        raise job_conflict(e)
+    return job.to_dict(progress_lines=0)
+
+@app.post("/reindex", status_code=202)
+def reindex(request: Request, rebuild: bool = False):
     # incoming_token = request.headers.get(token_header)
     # print("Incoming token")
     # print(incoming_token)
     # if incoming_token != os.getenv("API_TOKEN"):
     #     raise HTTPException(status_code=403, detail="Forbidden: Invalid token")
-    
+
+    # Runs in a background worker; the new index is loaded here once it is published
     try:
-        build_index()
-        return {"status": "success", "message": "Reindexing completed."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Reindexing failed: {e}")
\ No newline at end of file
+        job = job_runner.submit("reindex", rebuild=rebuild)
+    except JobConflict as e:
+        raise job_conflict(e)
+    return job.to_dict(progress_lines=0)
+
+@app.get("/jobs")
+def list_jobs():
+    return [job.to_dict(progress_lines=0) for job in job_runner.list()]
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job.to_dict()
@@ -0,0 +1,204 @@
+from collections import OrderedDict, Counter, deque
+from api.src.embedding_cache import normalize_query
+from api.src.metrics import cache_requests
+import os
+import json
+import threading
+import numpy as np
+
+# Minimum cosine similarity between two queries for them to share an answer. Off by
+# default: claims differing only in a number or a negation ("60 concelhos" vs "70
+# concelhos", "é" vs "não é") embed almost identically but need different verdicts,
+# so by default only the same normalized question is answered from the cache
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY")) if os.getenv("ANSWER_CACHE_SIMILARITY") else None
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+
+# Recent queries, used to pre-warm the cache after a reindex
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH")
+QUERY_LOG_SIZE = int(os.getenv("QUERY_LOG_SIZE", "1000"))
+# Most frequent logged queries answered again after each reindex. Off by default:
+# every one is an LLM call. Warming runs at most ANSWER_CACHE_WARM_CONCURRENCY calls
+# at a time, yields to queued user requests and is never turned away with 429.
+ANSWER_CACHE_WARM_QUERIES = int(os.getenv("ANSWER_CACHE_WARM_QUERIES", "0"))
+ANSWER_CACHE_WARM_CONCURRENCY = int(os.getenv("ANSWER_CACHE_WARM_CONCURRENCY", "1"))
+
+
+def unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Scope:
+    """
+    Entries that may answer each other: same index version and same retrieval options
+    (source threshold, k, search effort, filter).
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # normalized query -> (unit vector, result)
+        self._matrix = None
+        self._keys = None
+
+    def matrix(self):
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key][0] for key in self._keys])
+        return self._keys, self._matrix
+
+    def invalidate(self):
+        self._matrix = None
+        self._keys = None
+
+
+class SemanticAnswerCache:
+    """
+    Maps queries to finished answers. A lookup hits on the same normalized query in
+    the same scope or, when similarity is set, on a cached query of that scope whose
+    embedding has cosine similarity >= similarity with the new one.
+    """
+
+    def __init__(self, similarity=ANSWER_CACHE_SIMILARITY, max_entries=ANSWER_CACHE_SIZE):
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self._scopes = {}
+        self._lru = OrderedDict()  # (scope key, normalized query) -> None, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, query, vector, index_version, options):
+        """
+        options: hashable tuple of everything besides the query the answer depends on.
+        """
+        scope_key = (index_version, options)
+        normalized = normalize_query(query)
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if scope is None or not scope.entries:
+                self.misses += 1
+                cache_requests.inc(cache="answers", result="miss")
+                return None
+
+            entry = scope.entries.get(normalized)
+            if entry is None and self.similarity is None:
+                self.misses += 1
+                cache_requests.inc(cache="answers", result="miss")
+                return None
+            if entry is None:
+                keys, matrix = scope.matrix()
+                similarities = matrix @ unit_vector(vector)
+                best = int(np.argmax(similarities))
+                if similarities[best] < self.similarity:
+                    self.misses += 1
+                    cache_requests.inc(cache="answers", result="miss")
+                    return None
+                normalized = keys[best]
+                entry = scope.entries[normalized]
+
+            self._lru.move_to_end((scope_key, normalized))
+            self.hits += 1
+            cache_requests.inc(cache="answers", result="hit")
+            return dict(entry[1], cached=True)
+
+    def store(self, query, vector, index_version, options, result):
+        scope_key = (index_version, options)
+        normalized = normalize_query(query)
+        with self._lock:
+            scope = self._scopes.setdefault(scope_key, _Scope())
+            scope.entries[normalized] = (unit_vector(vector), result)
+            scope.invalidate()
+            self._lru[(scope_key, normalized)] = None
+            self._lru.move_to_end((scope_key, normalized))
+
+            while len(self._lru) > self.max_entries:
+                (old_scope_key, old_query), _ = self._lru.popitem(last=False)
+                old_scope = self._scopes[old_scope_key]
+                del old_scope.entries[old_query]
+                old_scope.invalidate()
+                if not old_scope.entries:
+                    del self._scopes[old_scope_key]
+
+    def retain_version(self, index_version):
+        """
+        Drops every entry computed against another index version.
+        """
+        with self._lock:
+            for scope_key in [key for key in self._scopes if key[0] != index_version]:
+                del self._scopes[scope_key]
+            self._lru = OrderedDict(
+                (key, None) for key in self._lru if key[0][0] == index_version
+            )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "similarity": self.similarity,
+            }
+
+
+def as_key(value):
+    """
+    JSON lists back to the tuples they were written from, at any depth.
+    """
+    return tuple(as_key(item) for item in value) if isinstance(value, list) else value
+
+
+class QueryLog:
+    """
+    Bounded log of recent (query, options) pairs, options being the answer options
+    (threshold, k, search effort, filter) the query was asked with, optionally
+    mirrored to a JSONL file so it survives restarts.
+    """
+
+    def __init__(self, path=QUERY_LOG_PATH, max_entries=QUERY_LOG_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._lines_written = 0
+
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                        self._entries.append((item["query"], as_key(item["options"])))
+                        self._lines_written += 1
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+
+    def record(self, query, options):
+        with self._lock:
+            self._entries.append((query, options))
+            if not self.path:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Rewrite the file once it holds twice what we keep, so it stays bounded
+            if self._lines_written >= 2 * self.max_entries:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    for q, o in self._entries:
+                        f.write(json.dumps({"query": q, "options": o}, ensure_ascii=False) + "\n")
+                self._lines_written = len(self._entries)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"query": query, "options": options}, ensure_ascii=False) + "\n")
+                self._lines_written += 1
+
+    def most_common(self, limit=ANSWER_CACHE_WARM_QUERIES):
+        """
+        The limit most frequent (normalized query, options) pairs.
+        """
+        with self._lock:
+            counts = Counter((normalize_query(q), o) for q, o in self._entries)
+        return [item for item, _ in counts.most_common(limit)]
+
+
+answer_cache = SemanticAnswerCache()
+query_log = QueryLog()
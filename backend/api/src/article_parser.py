@@ -0,0 +1,201 @@
+from bs4 import BeautifulSoup
+from datetime import datetime
+import os
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Article page parsing, kept free of heavy imports so scraper worker processes start
+# quickly. The lxml backend streams the page once through a parser target and keeps
+# only the fields we store; BeautifulSoup's html.parser is the fallback, and both
+# produce the same article from well-formed pages. Badly nested markup is repaired
+# differently: lxml closes an open <p> when another <p> or a block element starts,
+# as browsers do, where html.parser nests them (see tests/test_article_parser.py).
+HTML_PARSERS = ("lxml", "html.parser")
+HTML_PARSER = os.getenv("SCRAPE_HTML_PARSER", "lxml" if etree is not None else "html.parser")
+
+CONTENT_CLASS = "elementor-widget-theme-post-content"
+VERDICT_CLASS = "fact-check-result"
+DATE_CLASS = "custom-post-date-time"
+# BeautifulSoup leaves the strings inside these tags out of get_text(), at any depth
+NON_TEXT_TAGS = {"script", "style", "template", "rt", "rp"}
+
+PT_MONTHS = {
+    "janeiro": "01",
+    "fevereiro": "02",
+    "março": "03",
+    "abril": "04",
+    "maio": "05",
+    "junho": "06",
+    "julho": "07",
+    "agosto": "08",
+    "setembro": "09",
+    "outubro": "10",
+    "novembro": "11",
+    "dezembro": "12"
+}
+
+
+def parse_portuguese_datetime(text):
+    """
+    Converts '26 de Maio de 2025 às 11:00' into datetime object.
+    """
+    try:
+        parts = text.lower().split(" de ")
+        day = parts[0].strip()
+        month = PT_MONTHS[parts[1].strip()]
+        year_time = parts[2].split(" às ")
+        year = year_time[0].strip()
+        time_str = year_time[1].strip()
+        datetime_str = f"{day}.{month}.{year} {time_str}"
+        return datetime.strptime(datetime_str, "%d.%m.%Y %H:%M")
+    except Exception as e:
+        print(f"⚠️ Failed to parse date '{text}': {e}")
+        return datetime.now()
+
+
+def build_article(article_url, title, verdict, paragraphs, published_text):
+    published = parse_portuguese_datetime(published_text) if published_text is not None else datetime.now()
+    return {
+        'url': article_url,
+        'title': title if title is not None else "No title",
+        'verdict': verdict if verdict is not None else "Unknown",
+        'content': "\n\n".join(paragraphs),
+        'published': published.isoformat()
+    }
+
+
+def parse_article_soup(html, article_url):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    title_tag = soup.find('h1')
+    title = title_tag.get_text(strip=True) if title_tag else None
+
+    content_div = soup.find('div', class_=CONTENT_CLASS)
+    paragraphs = content_div.find_all('p') if content_div else []
+
+    verdict_container = soup.find('div', class_=VERDICT_CLASS)
+    verdict_tag = verdict_container.find('span') if verdict_container else None
+    verdict = verdict_tag.get_text(strip=True) if verdict_tag else None
+
+    # Get publication time from custom class
+    pub_tag = soup.find(class_=DATE_CLASS)
+    published = pub_tag.get_text(strip=True) if pub_tag else None
+
+    return build_article(article_url, title, verdict, [p.get_text(strip=True) for p in paragraphs], published)
+
+
+class ArticleTarget:
+    """
+    lxml parser target that picks the article fields out of the parse events as
+    they stream by, without building a tree: the first <h1>, the <p>s of the first
+    content div, the first <span> of the first verdict div and the first date
+    element. Text is joined like get_text(strip=True): each text node stripped,
+    empty ones dropped.
+    """
+
+    def __init__(self):
+        self.title = None
+        self.verdict = None
+        self.published = None
+        self.paragraphs = []
+        self._content_seen = False
+        self._verdict_seen = False
+        self._in_content = 0
+        self._in_verdict = 0
+        self._tags = []
+        self._non_text = 0
+        # Per open element, the captures to stop when it ends
+        self._stack = []
+        self._active = []
+        self._pending = []
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = "".join(self._pending).strip()
+        self._pending = []
+        if text and self._active and not self._non_text:
+            for capture in self._active:
+                capture.append(text)
+
+    def _capture(self, opened):
+        capture = []
+        self._active.append(capture)
+        opened.append(("capture", capture))
+        return capture
+
+    def start(self, tag, attrib):
+        self._flush()
+        opened = []
+        classes = attrib.get("class", "").split()
+
+        if tag == "h1" and self.title is None:
+            self.title = self._capture(opened)
+        if tag == "div" and CONTENT_CLASS in classes and not self._content_seen:
+            self._content_seen = True
+            self._in_content += 1
+            opened.append(("content", None))
+        elif tag == "p" and self._in_content:
+            self.paragraphs.append(self._capture(opened))
+        if tag == "div" and VERDICT_CLASS in classes and not self._verdict_seen:
+            self._verdict_seen = True
+            self._in_verdict += 1
+            opened.append(("verdict", None))
+        elif tag == "span" and self._in_verdict and self.verdict is None:
+            self.verdict = self._capture(opened)
+        if DATE_CLASS in classes and self.published is None:
+            self.published = self._capture(opened)
+
+        if tag in NON_TEXT_TAGS:
+            self._non_text += 1
+        self._tags.append(tag)
+        self._stack.append(opened)
+
+    def end(self, tag):
+        self._flush()
+        if not self._stack:
+            return
+        if self._tags.pop() in NON_TEXT_TAGS:
+            self._non_text -= 1
+        for kind, capture in self._stack.pop():
+            if kind == "content":
+                self._in_content -= 1
+            elif kind == "verdict":
+                self._in_verdict -= 1
+            else:
+                self._active = [active for active in self._active if active is not capture]
+
+    def data(self, text):
+        self._pending.append(text)
+
+    def comment(self, text):
+        # Ends the text node before it, as it does for BeautifulSoup
+        self._flush()
+
+    def pi(self, target, data=None):
+        self._flush()
+
+    def close(self):
+        self._flush()
+
+        def joined(capture):
+            return "".join(capture) if capture is not None else None
+
+        return joined(self.title), joined(self.verdict), [joined(p) for p in self.paragraphs], joined(self.published)
+
+
+def parse_article_lxml(html, article_url):
+    target = ArticleTarget()
+    parser = etree.HTMLParser(target=target)
+    parser.feed(html)
+    title, verdict, paragraphs, published = parser.close()
+    return build_article(article_url, title, verdict, paragraphs, published)
+
+
+def parse_article_html(html, article_url, parser=HTML_PARSER):
+    if parser == "lxml" and etree is not None:
+        return parse_article_lxml(html, article_url)
+    return parse_article_soup(html, article_url)
@@ -0,0 +1,331 @@
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+from api.src.metrics import instrument_s3
+import os
+import json
+import uuid
+import boto3
+import hashlib
+
+# Articles are written in batches as immutable JSONL segments under data/segments/.
+# data/url_index.json maps every stored URL to the segment holding its latest copy.
+S3_BUCKET = os.getenv("S3_BUCKET", "your-s3-bucket-name")
+S3_PREFIX = "data"
+S3_LEGACY_ARTICLES_KEY = f"{S3_PREFIX}/articles.json"
+S3_SEGMENTS_PREFIX = f"{S3_PREFIX}/segments/"
+S3_URL_INDEX_KEY = f"{S3_PREFIX}/url_index.json"
+# One manifest per written segment, listing the articles it added or changed.
+# build_index consumes and deletes them.
+S3_MANIFESTS_PREFIX = f"{S3_PREFIX}/manifests/"
+
+# Articles buffered before a segment is written
+SEGMENT_FLUSH_SIZE = int(os.getenv("ARTICLE_SEGMENT_FLUSH_SIZE", "100"))
+# Compaction kicks in once there are more segments than this
+COMPACT_SEGMENT_COUNT = int(os.getenv("ARTICLE_COMPACT_SEGMENT_COUNT", "50"))
+# Articles per segment written by compaction
+COMPACTED_SEGMENT_SIZE = int(os.getenv("ARTICLE_COMPACTED_SEGMENT_SIZE", "5000"))
+
+# How many times a conditional url_index.json write is retried after losing a race
+URL_INDEX_MAX_RETRIES = 5
+
+s3 = instrument_s3(boto3.client("s3"))
+
+
+def is_precondition_failure(error):
+    return error.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+
+def article_id(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+
+def content_hash(article):
+    """
+    Hash of the fields that end up in the index, used to detect edited articles.
+    """
+    payload = json.dumps(
+        [article["title"], article["verdict"], article["content"], article.get("published")],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def index_entry(article, segment):
+    return {"segment": segment, "id": article_id(article["url"]), "hash": content_hash(article)}
+
+
+def new_object_key(prefix, label, extension):
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return f"{prefix}{stamp}-{label}-{uuid.uuid4().hex[:8]}{extension}"
+
+
+def new_segment_key(label="segment"):
+    return new_object_key(S3_SEGMENTS_PREFIX, label, ".jsonl")
+
+
+def load_url_index():
+    """
+    Returns (url index, etag). The etag is None when the index doesn't exist yet.
+    """
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=S3_URL_INDEX_KEY)
+        return json.loads(obj["Body"].read().decode("utf-8")), obj.get("ETag")
+    except s3.exceptions.NoSuchKey:
+        pass
+
+    # First run against a corpus that still lives in the legacy articles.json
+    index = {}
+    for article in iter_legacy_articles():
+        index[article["url"]] = index_entry(article, S3_LEGACY_ARTICLES_KEY)
+    return index, None
+
+
+def save_url_index(index, etag):
+    """
+    Conditional write: fails with a precondition error if another writer
+    updated the index since it was read with this etag.
+    """
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    response = s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=S3_URL_INDEX_KEY,
+        Body=json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        **condition
+    )
+    return response.get("ETag")
+
+
+def update_url_index(changes=None, merge=None):
+    """
+    Merges changes ({url: entry}) into url_index.json, retrying on concurrent updates.
+    Changes that depend on the current entries come from merge(index) instead, which
+    is called again on every version of the index a retry loads.
+    """
+    for attempt in range(URL_INDEX_MAX_RETRIES):
+        index, etag = load_url_index()
+        index.update(merge(index) if merge else changes)
+        try:
+            save_url_index(index, etag)
+            return index
+        except ClientError as e:
+            if not is_precondition_failure(e) or attempt == URL_INDEX_MAX_RETRIES - 1:
+                raise
+            print("🔁 url_index.json changed concurrently, retrying merge...")
+    return index
+
+
+def write_segment(articles, key=None):
+    key = key or new_segment_key()
+    body = "\n".join(json.dumps(article, ensure_ascii=False, separators=(",", ":")) for article in articles)
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=(body + "\n").encode("utf-8"))
+    return key
+
+
+def list_keys(prefix, extension):
+    keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(extension):
+                keys.append(obj["Key"])
+    # Keys start with a UTC timestamp, so this is write order
+    return sorted(keys)
+
+
+def list_segment_keys():
+    return list_keys(S3_SEGMENTS_PREFIX, ".jsonl")
+
+
+def write_manifest(segment, changes):
+    """
+    changes: list of (article, "added" | "changed") stored in segment.
+    """
+    manifest = {
+        "segment": segment,
+        "articles": [
+            {"url": article["url"], "change": change, **index_entry(article, segment)}
+            for article, change in changes
+        ]
+    }
+    key = new_object_key(S3_MANIFESTS_PREFIX, "delta", ".json")
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+    return key
+
+
+def list_manifest_keys():
+    return list_keys(S3_MANIFESTS_PREFIX, ".json")
+
+
+def load_manifest(key):
+    obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+    return json.loads(obj["Body"].read().decode("utf-8"))
+
+
+def delete_keys(keys):
+    keys = list(keys)
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=S3_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]]}
+        )
+
+
+def iter_segment(key):
+    obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+    for line in obj["Body"].iter_lines():
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_legacy_articles():
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=S3_LEGACY_ARTICLES_KEY)
+    except s3.exceptions.NoSuchKey:
+        return
+    try:
+        yield from json.loads(obj["Body"].read().decode("utf-8"))
+    except json.JSONDecodeError:
+        print("Warning: legacy articles.json was malformed. Ignoring it.")
+
+
+def iter_articles():
+    """
+    Streams every stored article, one segment at a time, oldest first.
+    A URL stored more than once is yielded once, from its latest segment.
+    """
+    index, _ = load_url_index()
+    for article in iter_legacy_articles():
+        if index.get(article["url"], {}).get("segment") == S3_LEGACY_ARTICLES_KEY:
+            yield article
+    for key in list_segment_keys():
+        for article in iter_segment(key):
+            if index.get(article["url"], {}).get("segment") == key:
+                yield article
+
+
+def iter_articles_by_url(urls):
+    """
+    Streams the current copy of each of urls, reading only the segments that hold them.
+    """
+    index, _ = load_url_index()
+    by_segment = {}
+    for url in urls:
+        entry = index.get(url)
+        if entry:
+            by_segment.setdefault(entry["segment"], set()).add(url)
+
+    for segment in sorted(by_segment):
+        wanted = by_segment[segment]
+        articles = iter_legacy_articles() if segment == S3_LEGACY_ARTICLES_KEY else iter_segment(segment)
+        for article in articles:
+            if article["url"] in wanted:
+                wanted.discard(article["url"])
+                yield article
+
+
+class SegmentWriter:
+    """
+    Buffers new or edited articles and writes them as one segment per
+    SEGMENT_FLUSH_SIZE articles, each with a delta manifest for build_index.
+
+        with SegmentWriter() as writer:
+            writer.add(article)
+    """
+
+    def __init__(self, flush_size=SEGMENT_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self.url_index, _ = load_url_index()
+        self._buffer = []
+        self._buffered_urls = set()
+        self.saved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def contains(self, url):
+        return url in self.url_index or url in self._buffered_urls
+
+    def add(self, article):
+        """
+        Queues article unless an identical copy is already stored.
+        Returns "added", "changed" or None for a duplicate.
+        """
+        url = article["url"]
+        if url in self._buffered_urls:
+            print(f"⚠️ Skipped duplicate: {url}")
+            return None
+
+        existing = self.url_index.get(url)
+        if existing is None:
+            change = "added"
+        elif existing.get("hash") != content_hash(article):
+            change = "changed"
+        else:
+            print(f"⚠️ Skipped duplicate: {url}")
+            return None
+
+        self._buffer.append((article, change))
+        self._buffered_urls.add(url)
+        print(f"✅ Queued ({change}): {article['title']}")
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+        return change
+
+    def flush(self):
+        if not self._buffer:
+            return
+        articles = [article for article, _ in self._buffer]
+        key = write_segment(articles)
+        self.url_index = update_url_index({article["url"]: index_entry(article, key) for article in articles})
+        # Written last: a manifest only ever points at data that is already visible
+        write_manifest(key, self._buffer)
+        self.saved += len(self._buffer)
+        print(f"💾 Wrote {len(self._buffer)} articles to {key}")
+        self._buffer = []
+        self._buffered_urls = set()
+
+
+def compact_segments(min_segments=COMPACT_SEGMENT_COUNT, segment_size=COMPACTED_SEGMENT_SIZE):
+    """
+    Rewrites the current segments (and legacy articles.json) into fewer, larger
+    segments holding only the latest copy of each URL. Segments written while
+    compaction runs are left alone.
+    """
+    keys = list_segment_keys()
+    if len(keys) < min_segments:
+        return False
+
+    print(f"🧹 Compacting {len(keys)} article segments...")
+    latest = {}
+    for article in iter_legacy_articles():
+        latest[article["url"]] = article
+    for key in keys:
+        for article in iter_segment(key):
+            latest[article["url"]] = article
+
+    articles = list(latest.values())
+    changes = {}
+    for start in range(0, len(articles), segment_size):
+        batch = articles[start:start + segment_size]
+        new_key = write_segment(batch, new_segment_key("compacted"))
+        for article in batch:
+            changes[article["url"]] = index_entry(article, new_key)
+
+    removed = set(keys) | {S3_LEGACY_ARTICLES_KEY}
+
+    def merge(index):
+        # URLs rewritten concurrently into a newer segment keep pointing there
+        return {
+            url: entry for url, entry in changes.items()
+            if index.get(url, {}).get("segment") in removed or url not in index
+        }
+
+    update_url_index(merge=merge)
+
+    delete_keys(keys)
+    s3.delete_object(Bucket=S3_BUCKET, Key=S3_LEGACY_ARTICLES_KEY)
+    print(f"✅ Compacted into {len(range(0, len(articles), segment_size))} segments ({len(articles)} articles).")
+    return True
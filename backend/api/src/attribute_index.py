@@ -0,0 +1,159 @@
+from datetime import date, datetime
+from api.src.lexical_index import fold
+import os
+import json
+import numpy as np
+import faiss
+
+# Per-chunk attributes that queries can filter on, stored column-wise in
+# attributes.npy next to index.faiss (memory-mapped by readers, sorted by row id).
+# IndexWriter keeps the rows in the docstore's attributes table and exports the
+# file on save. Verdicts are stored as codes into the "verdicts" list in docstore meta.
+ATTRIBUTES_FILE = "attributes.npy"
+ATTRIBUTE_DTYPE = np.dtype([("row_id", "<i8"), ("published", "<i4"), ("verdict", "<i2"), ("article", "<u8")])
+ATTRIBUTES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attributes (
+    row_id INTEGER PRIMARY KEY,
+    verdict TEXT,
+    published INTEGER,
+    article_id TEXT
+);
+"""
+# published is days since 1970-01-01; chunks indexed before dates were recorded have none
+UNKNOWN_DATE = -1
+
+# Filters matching at most this many chunks are answered by an exact scan of just
+# those chunks instead of a filtered index search
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", "2048"))
+
+
+def to_days(value):
+    if not value:
+        return UNKNOWN_DATE
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - date(1970, 1, 1)).days
+
+
+def article_number(article_id):
+    # article ids are 16 hex digits, i.e. exactly 64 bits
+    return int(article_id, 16) if article_id else 0
+
+
+def chunk_attributes(row_id, metadata):
+    """
+    Row of the attributes table for a chunk with the given metadata.
+    """
+    try:
+        published = to_days(metadata.get("published"))
+    except ValueError:
+        published = UNKNOWN_DATE
+    return int(row_id), metadata.get("verdict"), published, metadata.get("article_id")
+
+
+def export_attributes(conn, path):
+    """
+    Writes the attributes table to path as a columnar array and returns the verdict vocabulary.
+    """
+    rows = conn.execute("SELECT row_id, verdict, published, article_id FROM attributes ORDER BY row_id").fetchall()
+    verdicts = sorted({fold(verdict) for _, verdict, _, _ in rows if verdict})
+    codes = {verdict: code for code, verdict in enumerate(verdicts)}
+
+    table = np.zeros(len(rows), dtype=ATTRIBUTE_DTYPE)
+    for i, (row_id, verdict, published, aid) in enumerate(rows):
+        table[i] = (row_id, UNKNOWN_DATE if published is None else published,
+                    codes[fold(verdict)] if verdict else -1, article_number(aid))
+    np.save(path, table)
+    return verdicts
+
+
+class SearchFilter:
+    """
+    Restricts a search to chunks with one of verdicts, published within
+    [published_from, published_to] (dates or ISO strings) and/or from one of
+    article_ids. Unset fields don't filter.
+    """
+
+    def __init__(self, verdicts=None, published_from=None, published_to=None, article_ids=None):
+        self.verdicts = {fold(verdict) for verdict in verdicts} if verdicts else None
+        self.published_from = to_days(published_from) if published_from else None
+        self.published_to = to_days(published_to) if published_to else None
+        self.article_ids = {article_number(aid) for aid in article_ids} if article_ids else None
+
+    def is_empty(self):
+        return (
+            self.verdicts is None and self.published_from is None
+            and self.published_to is None and self.article_ids is None
+        )
+
+    def key(self):
+        """
+        Hashable value equal for filters that select the same chunks.
+        """
+        return (
+            tuple(sorted(self.verdicts)) if self.verdicts is not None else None,
+            self.published_from, self.published_to,
+            tuple(sorted(self.article_ids)) if self.article_ids is not None else None
+        )
+
+    @classmethod
+    def from_key(cls, key):
+        """
+        The filter a key() was taken from, e.g. to replay a logged query.
+        """
+        verdicts, published_from, published_to, article_ids = key
+        search_filter = cls()
+        search_filter.verdicts = set(verdicts) if verdicts is not None else None
+        search_filter.published_from = published_from
+        search_filter.published_to = published_to
+        search_filter.article_ids = set(article_ids) if article_ids is not None else None
+        return search_filter
+
+
+class AttributeIndex:
+    """
+    Read side: turns a SearchFilter into the matching row ids with a few vectorised
+    comparisons over the columns, then into a faiss ID selector.
+    """
+
+    def __init__(self, path, verdicts):
+        self.table = np.load(path, mmap_mode="r")
+        self.verdicts = {verdict: code for code, verdict in enumerate(verdicts)}
+
+    def mask(self, search_filter):
+        table = self.table
+        mask = np.ones(len(table), dtype=bool)
+        if search_filter.verdicts is not None:
+            codes = [self.verdicts[v] for v in search_filter.verdicts if v in self.verdicts]
+            mask &= np.isin(table["verdict"], codes)
+        if search_filter.published_from is not None:
+            mask &= table["published"] >= search_filter.published_from
+        if search_filter.published_to is not None:
+            mask &= (table["published"] <= search_filter.published_to) & (table["published"] != UNKNOWN_DATE)
+        if search_filter.article_ids is not None:
+            mask &= np.isin(table["article"], np.fromiter(search_filter.article_ids, dtype=np.uint64))
+        return mask
+
+    def row_ids(self, search_filter):
+        return np.asarray(self.table["row_id"][self.mask(search_filter)])
+
+    def selector(self, row_ids):
+        """
+        Bitmap over row ids: membership checks during the search are a single bit test.
+        """
+        size = int(self.table["row_id"][-1]) + 1 if len(self.table) else 1
+        bits = np.zeros(size, dtype=bool)
+        bits[row_ids] = True
+        packed = np.packbits(bits, bitorder="little")
+        # faiss takes the bitmap's length in bytes (it covers ids < 8 * len(packed))
+        selector = faiss.IDSelectorBitmap(len(packed), faiss.swig_ptr(packed))
+        # faiss only keeps a pointer to the bitmap
+        selector.referenced_objects = [packed]
+        return selector
+
+
+def load_verdicts(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'verdicts'").fetchone()
+    return json.loads(row[0]) if row else []
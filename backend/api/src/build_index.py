@@ -1,20 +1,37 @@
 import json
 import os
+import argparse
 import tempfile
 import boto3
-from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from api.src.index_format import (
+    IndexWriter, INDEX_TYPE, INDEX_TYPES, INDEX_QUANTIZATION, QUANTIZATIONS, INDEX_RERANK, VECTORS_FILE
+)
+from api.src.index_store import (
+    load_index_manifest, load_index_metadata, download_index_metadata, fetch_index, fetch_index_files, publish_index
+)
+from api.src.sharded_index import (
+    ShardedIndexWriter, INDEX_SHARD_PERIOD, SHARD_PERIODS, SHARDS_FILE, SHARDS_DIR, copy_rows, shard_files,
+    shard_vectors_key
+)
+from api.src.near_duplicates import CHUNK_DEDUP
+from api.src.chunker import ChunkStream
+from api.src.chunk_embeddings import BatchedCachedEmbeddings, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY
+from api.src.metrics import instrument_s3, timed, record_stage
+from api.src.article_store import (
+    iter_articles, iter_articles_by_url, load_url_index, list_manifest_keys, load_manifest,
+    delete_keys, article_id, content_hash
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
-s3 = boto3.client("s3")
+s3 = instrument_s3(boto3.client("s3"))
 S3_BUCKET = os.getenv("S3_BUCKET", "your-bucket-name")
-S3_ARTICLES_KEY = "data/articles.json"
 S3_INDEX_KEY_PREFIX = "index/"
-S3_URLS_KEY = f"{S3_INDEX_KEY_PREFIX}indexed_urls.json"
+S3_URLS_KEY = f"{S3_INDEX_KEY_PREFIX}indexed_urls.json"  # legacy, superseded by indexed_articles.json
+S3_INDEXED_ARTICLES_KEY = f"{S3_INDEX_KEY_PREFIX}indexed_articles.json"  # legacy, now published with each version
 
 def load_from_s3(key):
     try:
@@ -33,89 +50,362 @@ def save_to_s3(data, key):
         Body=json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
     )
 
+def article_to_document(item):
+    metadata = {
+        "source": item["url"],
+        "title": item["title"],
+        "verdict": item["verdict"],
+        "published": item.get("published"),
+        "article_id": article_id(item["url"])
+    }
+    return Document(
+        page_content=item["content"],
+        metadata=metadata
+    )
+
 def load_documents():
-    raw_docs = load_from_s3(S3_ARTICLES_KEY)
-    documents = []
-    for item in raw_docs:
-        metadata = {
-            "source": item["url"],
-            "title": item["title"],
-            "verdict": item["verdict"]
+    """
+    Streams articles from the segment store instead of parsing one big JSON document.
+    """
+    for item in iter_articles():
+        yield article_to_document(item)
+
+def prepare_articles(articles):
+    """
+    (article id, Document, indexed_articles entry without its chunk count) for each
+    article, read lazily.
+    """
+    for item in articles:
+        yield article_id(item["url"]), article_to_document(item), {"url": item["url"], "hash": content_hash(item)}
+
+def split_articles(articles, dedup=CHUNK_DEDUP):
+    """
+    Splits articles into chunks with deterministic ids ("<article id>-<n>"), so the
+    chunks of an article can be found again when its content changes. With dedup,
+    chunks repeating an earlier chunk of the same article, or of an earlier article,
+    are left out (their ids are simply never used).
+    Returns (chunks, chunk ids, {article id: indexed_articles entry}).
+    """
+    return ChunkStream(prepare_articles(articles), workers=0, dedup=dedup).collect()
+
+def load_delta():
+    """
+    Returns (manifest keys, {article id: manifest entry}) for everything ingested
+    since the last build. Later manifests win if an article changed twice.
+    """
+    keys = list_manifest_keys()
+    delta = {}
+    for key in keys:
+        for entry in load_manifest(key)["articles"]:
+            delta[entry["id"]] = entry
+    return keys, delta
+
+def migrate_legacy_index(indexed_urls):
+    """
+    Builds indexed_articles entries for an index built before chunk ids existed, and
+    the delta of stored articles it is missing. Legacy entries have "chunks": None:
+    their chunks are found by URL if the article ever changes.
+    """
+    url_index, _ = load_url_index()
+    indexed_articles = {}
+    delta = {}
+    for url, entry in url_index.items():
+        aid = entry.get("id") or article_id(url)
+        if url in indexed_urls:
+            indexed_articles[aid] = {"url": url, "hash": entry.get("hash"), "chunks": None}
+        else:
+            delta[aid] = {"url": url, "change": "added", **entry}
+    return indexed_articles, delta
+
+def stale_chunk_ids(writer, indexed_articles, article_ids):
+    """
+    Chunk ids in the index that belong to previous versions of article_ids.
+    """
+    stale = []
+    legacy_urls = set()
+    for aid in article_ids:
+        entry = indexed_articles.get(aid)
+        if entry is None:
+            continue
+        if entry["chunks"] is None:
+            legacy_urls.add(entry["url"])
+        else:
+            stale.extend(f"{aid}-{n}" for n in range(entry["chunks"]))
+
+    if legacy_urls:
+        # Chunks indexed with random ids can only be found by their source URL
+        stale.extend(writer.chunk_ids_for_sources(legacy_urls))
+
+    return stale
+
+def download_legacy_index(local_path):
+    """
+    Downloads an index published in the flat layout used before versioned snapshots.
+    """
+    os.makedirs(local_path, exist_ok=True)
+    for fname in ("index.faiss", "index.pkl"):
+        s3.download_file(S3_BUCKET, f"{S3_INDEX_KEY_PREFIX}{fname}", os.path.join(local_path, fname))
+
+def load_shard_layout(index_manifest, tmpdir):
+    """
+    shards.json of a published version, or None if the version isn't sharded.
+    """
+    if SHARDS_FILE not in index_manifest.get("files", {}):
+        return None
+    fetch_index_files(index_manifest, [SHARDS_FILE], tmpdir)
+    with open(os.path.join(tmpdir, SHARDS_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+def shard_opener(index_manifest, tmpdir):
+    """
+    open_shard callback for ShardedIndexWriter: downloads a single shard of the
+    published version, with its vectors when they were kept as build metadata.
+    """
+    previous_path = os.path.join(tmpdir, "previous")
+
+    def open_shard(name):
+        fetch_index_files(index_manifest, shard_files(index_manifest, name), previous_path)
+        vectors_path = download_index_metadata(
+            index_manifest, shard_vectors_key(name), os.path.join(tmpdir, f"{name}-{VECTORS_FILE}")
+        )
+        return os.path.join(previous_path, SHARDS_DIR, name), vectors_path
+
+    return open_shard
+
+def create_writer(path, shard_period, index_type, quantization):
+    if shard_period == "none":
+        return IndexWriter.create(path, index_type=index_type, quantization=quantization)
+    return ShardedIndexWriter(path, shard_period, index_type, quantization)
+
+def open_previous_index(index_manifest, layout, tmpdir, path, embeddings, index_type, quantization):
+    """
+    IndexWriters over every chunk of the published index, opened under path.
+    """
+    if layout is not None:
+        open_shard = shard_opener(index_manifest, tmpdir)
+        writers = []
+        for name in sorted(layout["shards"]):
+            source_path, vectors_path = open_shard(name)
+            writers.append(IndexWriter.open(
+                source_path, os.path.join(path, name), None, index_type, quantization, vectors_path
+            ))
+        return writers
+
+    vectors_path = None
+    if index_manifest:
+        # The cached version is shared with the API; the writer works on a copy
+        source_path = fetch_index(index_manifest)
+        vectors_path = download_index_metadata(index_manifest, VECTORS_FILE, os.path.join(tmpdir, VECTORS_FILE))
+    else:
+        source_path = os.path.join(tmpdir, "legacy")
+        download_legacy_index(source_path)
+    return [IndexWriter.open(source_path, path, embeddings, index_type, quantization, vectors_path)]
+
+def dependent_articles(indexed_articles, article_ids):
+    """
+    Indexed articles, besides article_ids, with chunks dropped for repeating one of
+    article_ids: they are split again with them, so text a changed article no
+    longer carries comes back from the articles that were skipping it.
+    """
+    article_ids = set(article_ids)
+    return {
+        aid: entry for aid, entry in indexed_articles.items()
+        if aid not in article_ids and article_ids.intersection(entry.get("dropped", {}).values())
+    }
+
+def build_index(rebuild=False, index_type=INDEX_TYPE, quantization=INDEX_QUANTIZATION, rerank=INDEX_RERANK,
+                shard_period=INDEX_SHARD_PERIOD):
+    """
+    Indexes only what changed since the last run, as listed in the ingestion
+    manifests, or every stored article when rebuild is set.
+    The published index is converted if its type, quantization or shard period
+    differ from the requested ones. A sharded index only downloads and re-uploads
+    the shards holding changed articles. With rerank, a quantized index ships with its full vectors so
+    the API can re-rank candidates exactly.
+    Returns the published version, or None when there was nothing to do.
+    """
+    manifest_keys, delta = load_delta()
+    index_manifest, index_etag = load_index_manifest()
+    if rebuild:
+        indexed_articles = {}
+    elif index_manifest:
+        indexed_articles = load_index_metadata(index_manifest, "indexed_articles.json") or {}
+    else:
+        indexed_articles = load_from_s3(S3_INDEXED_ARTICLES_KEY) or {}
+    full_build = rebuild
+    retype = bool(index_manifest) and (
+        index_manifest.get("index_type", "flat") != index_type
+        or index_manifest.get("quantization", "none") != quantization
+        or bool(index_manifest.get("rerank")) != (rerank and quantization != "none")
+    )
+    relayout = bool(index_manifest) and index_manifest.get("shard_period", "none") != shard_period
+
+    if not indexed_articles and not rebuild:
+        indexed_urls = set(load_from_s3(S3_URLS_KEY))
+        if indexed_urls:
+            print("🔧 Migrating legacy indexed_urls.json to indexed_articles.json...")
+            indexed_articles, missing = migrate_legacy_index(indexed_urls)
+            delta = {**missing, **delta}
+        else:
+            full_build = True
+
+    if full_build:
+        articles = iter_articles()
+    else:
+        # Drop articles whose indexed copy is already current
+        pending = {
+            aid: entry for aid, entry in delta.items()
+            if indexed_articles.get(aid, {}).get("hash") != entry.get("hash")
         }
-        documents.append(Document(
-            page_content=item["content"],
-            metadata=metadata
-        ))
-    return documents
-
-def upload_faiss_index(local_path, s3_prefix):
-    for root, _, files in os.walk(local_path):
-        for fname in files:
-            full_path = os.path.join(root, fname)
-            rel_path = os.path.relpath(full_path, local_path)
-            s3_key = os.path.join(s3_prefix, rel_path)
-            s3.upload_file(full_path, S3_BUCKET, s3_key)
-
-def download_faiss_index(local_path, s3_prefix):
-    paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=S3_BUCKET, Prefix=s3_prefix)
-    for page in pages:
-        for obj in page.get('Contents', []):
-            s3_key = obj['Key']
-            rel_path = os.path.relpath(s3_key, s3_prefix)
-            full_path = os.path.join(local_path, rel_path)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            s3.download_file(S3_BUCKET, s3_key, full_path)
-
-def build_index():
-    docs = load_documents()
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    split_docs = splitter.split_documents(docs)
-    embeddings = OpenAIEmbeddings()
-
-    indexed_urls = set(load_from_s3(S3_URLS_KEY))
-    all_new_chunks = []
-    new_urls = set()
-
-    for doc in split_docs:
-        url = doc.metadata.get("source")
-        if url and url not in indexed_urls:
-            all_new_chunks.append(doc)
-            new_urls.add(url)
+        if not pending and not retype and not relayout:
+            print("ℹ️ No new documents to add.")
+            delete_keys(manifest_keys)
+            return None
+        dependents = dependent_articles(indexed_articles, pending)
+        if dependents:
+            print(f"♻️ Re-splitting {len(dependents)} articles that skipped chunks of the changed ones.")
+        articles = iter_articles_by_url(entry["url"] for entry in {**pending, **dependents}.values())
+
+    # Chunks go to the embedding stage in batches as they are split
+    stream = ChunkStream(prepare_articles(articles), batch_size=EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY)
+    if full_build:
+        batches = stream
+        entries = {}
+    else:
+        # The changed articles are split up front: their entries decide which shards
+        # to open and which stored chunks they replace
+        with timed("build_split"):
+            batch = stream.collect()
+        batches = [batch]
+        entries = batch[2]
+
+    # Chunks embedded by any earlier build are served from the local store
+    embeddings = BatchedCachedEmbeddings(OpenAIEmbeddings(chunk_size=EMBEDDING_BATCH_SIZE))
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        index_path = os.path.join(tmpdir, "faiss")
-
-        index_exists = False
-        try:
-            download_faiss_index(index_path, S3_INDEX_KEY_PREFIX)
-            index_exists = True
-        except Exception as e:
-            print(f"ℹ️ No existing FAISS index found in S3: {e}")
-
-        index_file = os.path.join(index_path, "index.faiss")
-        pkl_file = os.path.join(index_path, "index.pkl")
-        index_exists = os.path.exists(index_file) and os.path.exists(pkl_file)
-
-        if index_exists:
-            print("🔁 Existing index found. Merging new documents...")
-            db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-
-            if all_new_chunks:
-                db.add_documents(all_new_chunks)
-                db.save_local(index_path)
-                upload_faiss_index(index_path, S3_INDEX_KEY_PREFIX)
-                save_to_s3(sorted(indexed_urls.union(new_urls)), S3_URLS_KEY)
-                print(f"✅ Added {len(new_urls)} new source URLs.")
+        index_path = os.path.join(tmpdir, "index")
+
+        layout = None
+        if full_build:
+            print("📦 Building a new index from all stored articles...")
+            writer = create_writer(index_path, shard_period, index_type, quantization)
+        else:
+            layout = load_shard_layout(index_manifest, tmpdir) if index_manifest else None
+            if layout is not None and layout["period"] == shard_period:
+                writer = ShardedIndexWriter(
+                    index_path, shard_period, index_type, quantization, layout, shard_opener(index_manifest, tmpdir)
+                )
+                # Changing the index type rewrites every shard; otherwise only the shards
+                # of the changed articles (and those new chunks go to) are downloaded
+                writer.open_shards(layout["shards"] if retype else [
+                    indexed_articles[aid].get("shard") for aid in entries if aid in indexed_articles
+                ])
+                print(
+                    f"🔁 Existing index found. Merging {len(entries)} new or changed articles "
+                    f"({len(writer.writers)}/{len(layout['shards'])} shards opened)..."
+                )
             else:
-                print("ℹ️ No new documents to add.")
+                print(f"🔁 Existing index found. Merging {len(entries)} new or changed articles...")
+                if layout is None and shard_period == "none":
+                    writer, = open_previous_index(
+                        index_manifest, layout, tmpdir, index_path, embeddings, index_type, quantization
+                    )
+                else:
+                    # The layout changed: the stored chunks and vectors are redistributed
+                    print(f"🧩 Re-sharding the index by {shard_period}...")
+                    sources = open_previous_index(
+                        index_manifest, layout, tmpdir, os.path.join(tmpdir, "previous-index"), embeddings,
+                        index_type, quantization
+                    )
+                    layout = None
+                    writer = create_writer(index_path, shard_period, index_type, quantization)
+                    for source in sources:
+                        copy_rows(source, writer)
+                        source.conn.close()
+
+            removed = writer.remove(stale_chunk_ids(writer, indexed_articles, entries))
+            if removed:
+                print(f"🗑️ Removed {removed} outdated chunks.")
+
+        for chunks, chunk_ids, batch_entries in batches:
+            if chunks:
+                vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+                writer.add(chunk_ids, chunks, vectors)
+            entries.update(batch_entries)
+        if full_build:
+            record_stage("build_split", stream.wait_seconds)
+        print(f"🔪 Chunking: {stream.summary()}")
+        if stream.duplicates:
+            print(
+                f"✂️ Skipped {stream.duplicates} near-duplicate chunks "
+                f"({stream.cross_duplicates} repeating other articles)."
+            )
+        if full_build and not stream.chunk_count:
+            print("ℹ️ No articles to index yet.")
+            return None
+
+        with timed("build_save"):
+            written = writer.save()
+
+        indexed_articles.update(entries)
+        if shard_period != "none":
+            for aid, name in writer.article_shards.items():
+                if aid in indexed_articles:
+                    indexed_articles[aid]["shard"] = name
+        state_path = os.path.join(tmpdir, "indexed_articles.json")
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(indexed_articles, f, ensure_ascii=False)
+        metadata = {"indexed_articles.json": state_path}
+
+        # Full vectors only go to the API when it re-ranks quantized results;
+        # otherwise they stay with the build metadata for the next rebuild
+        ship_vectors = rerank and quantization != "none"
+        reuse = None
+        if shard_period == "none":
+            if not ship_vectors:
+                metadata[VECTORS_FILE] = os.path.join(tmpdir, "published-" + VECTORS_FILE)
+                os.replace(os.path.join(index_path, VECTORS_FILE), metadata[VECTORS_FILE])
         else:
-            print("📦 No existing index. Creating new one...")
-            db = FAISS.from_documents(all_new_chunks, embeddings)
-            db.save_local(index_path)
-            upload_faiss_index(index_path, S3_INDEX_KEY_PREFIX)
-            save_to_s3(sorted(new_urls), S3_URLS_KEY)
-            print(f"✅ Index created with {len(new_urls)} source URLs.")
+            if not ship_vectors:
+                for name, shard_path in writer.shard_dirs().items():
+                    metadata[shard_vectors_key(name)] = os.path.join(tmpdir, f"published-{name}-{VECTORS_FILE}")
+                    os.replace(os.path.join(shard_path, VECTORS_FILE), metadata[shard_vectors_key(name)])
+            # Shards this build didn't open are published as they are
+            untouched = [name for name in writer.shards if name not in written] if layout is not None else []
+            reuse = {"files": {}, "metadata": {}}
+            for name in untouched:
+                reuse["files"].update(shard_files(index_manifest, name))
+                vectors_entry = index_manifest.get("metadata", {}).get(shard_vectors_key(name))
+                if vectors_entry is not None:
+                    reuse["metadata"][shard_vectors_key(name)] = vectors_entry
+
+        # indexed_articles.json is published with the snapshot, so both always match
+        with timed("build_publish"):
+            version = publish_index(
+                index_path,
+                metadata=metadata,
+                previous_etag=index_etag,
+                reuse=reuse,
+                articles=len(indexed_articles),
+                index_type=index_type,
+                quantization=quantization,
+                rerank=ship_vectors,
+                shard_period=shard_period
+            )
+
+    delete_keys(manifest_keys)
+    print(f"✅ Indexed {len(entries)} articles ({stream.chunk_count} chunks). Published version {version}.")
+    return version
 
 if __name__ == "__main__":
-    build_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Index new Polígrafo articles into FAISS.")
+    parser.add_argument("--rebuild", action="store_true", help="re-index every stored article")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE, help="FAISS index type to publish")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=INDEX_QUANTIZATION, help="vector compression")
+    parser.add_argument("--rerank", action="store_true", default=INDEX_RERANK, help="ship full vectors to re-rank quantized results")
+    parser.add_argument("--shard-period", choices=SHARD_PERIODS, default=INDEX_SHARD_PERIOD, help="split the index by publication period")
+    args = parser.parse_args()
+    build_index(
+        rebuild=args.rebuild, index_type=args.index_type, quantization=args.quantization, rerank=args.rerank,
+        shard_period=args.shard_period
+    )
\ No newline at end of file
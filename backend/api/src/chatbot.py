@@ -1,64 +1,48 @@
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 from langchain.chains import RetrievalQA
-from langchain.chains.qa_with_sources import load_qa_with_sources_chain
 from langchain_openai import ChatOpenAI
+from api.src.index_manager import index_manager
+from api.src.answer_cache import answer_cache, query_log, ANSWER_CACHE_WARM_QUERIES, ANSWER_CACHE_WARM_CONCURRENCY
+from api.src.lexical_index import HYBRID_SEARCH
+from api.src.attribute_index import SearchFilter
+from api.src.context_builder import build_context, CONTEXT_MAX_CHUNKS
+from api.src.request_coalescing import ask_flights, llm_gate
+from api.src.embedding_cache import normalize_query
+from api.src.metrics import (
+    timed, record_stage, retrieved_documents, threshold_filtered_documents, diversity_filtered_documents,
+    UsageCollector
+)
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import threading
+import asyncio
+import time
 import os
-import boto3
-import tempfile
-import shutil
 
 load_dotenv()
 
-INDEX_PATH = "shared/index/"
-
-S3_BUCKET = os.getenv("S3_BUCKET")
-S3_PREFIX = "index/"  # The folder in S3 where index files are stored
-
-def download_index_from_s3():
-    s3 = boto3.client('s3')
-    temp_dir = tempfile.mkdtemp()
-    
-    paginator = s3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_PREFIX):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-            filename = os.path.join(temp_dir, os.path.basename(key))
-            s3.download_file(S3_BUCKET, key, filename)
-
-    print("Got S3 BUCKET!!")
-    print(temp_dir)
-
-    return temp_dir
+# Largest /ask/batch request, and how many of its LLM calls run at the same time
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+# Chunks one article may fill of the k retrieved slots (0: no limit). Searches fetch
+# DIVERSITY_OVERFETCH * k candidates so the slots can go to other articles.
+MAX_CHUNKS_PER_ARTICLE = int(os.getenv("MAX_CHUNKS_PER_ARTICLE", "1"))
+DIVERSITY_OVERFETCH = int(os.getenv("DIVERSITY_OVERFETCH", "4"))
 
 def load_chain():
-    embeddings = OpenAIEmbeddings()
-    index_dir = download_index_from_s3()
-
-    db = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
-    retriever = db.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+    snapshot = index_manager.current()
 
     llm = ChatOpenAI(temperature=0, model_name="gpt-4.1-nano")
 
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
-        retriever=retriever,
+        retriever=snapshot.retriever,
         return_source_documents=True
     )
     return qa_chain
 
 def load_chain_with_sources():
-    embeddings = OpenAIEmbeddings()
-    index_dir = download_index_from_s3()
-
-    db = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
-    retriever = db.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-
-    llm = ChatOpenAI(temperature=0, model_name="gpt-4.1-nano")
-
-    chain = load_qa_with_sources_chain(llm, chain_type="stuff")
-    return chain, retriever
+    snapshot = index_manager.current()
+    return snapshot.chain, snapshot.retriever
 
 def chatbot_call():
     print("🗳️  Polígrafo Fact-Check Chatbot (type 'exit' to quit)\n")
@@ -109,12 +93,7 @@ def chatbot_call_with_sources():
 
         print("-" * 50)
 
-def get_fact_check_response(prompt: str, threshold: float = None, k: int = 3) -> dict:
-    chain, retriever = load_chain_with_sources()
-
-    # Perform similarity search with scores
-    results_with_scores = retriever.vectorstore.similarity_search_with_score(prompt, k=k)
-
+def filter_by_threshold(results_with_scores, threshold: float = None) -> list:
     filtered_results = []
     for doc, score in results_with_scores:
         if threshold is None or score <= threshold:
@@ -124,9 +103,83 @@ def get_fact_check_response(prompt: str, threshold: float = None, k: int = 3) ->
     if not filtered_results and results_with_scores:
         filtered_results = [results_with_scores[0]]
 
-    docs = [doc for doc, _ in filtered_results]
-    result = chain.invoke({"input_documents": docs, "question": prompt})
-
+    threshold_filtered_documents.inc(len(results_with_scores) - len(filtered_results))
+    return filtered_results
+
+def diversify(results_with_scores, k: int, per_article: int = MAX_CHUNKS_PER_ARTICLE) -> list:
+    """
+    The first k results, in order, skipping chunks of articles that already have per_article.
+    """
+    if per_article <= 0:
+        return results_with_scores[:k]
+    selected = []
+    taken = {}
+    skipped = 0
+    for doc, score in results_with_scores:
+        if len(selected) == k:
+            break
+        article = doc.metadata.get("article_id") or doc.metadata.get("source")
+        if taken.get(article, 0) >= per_article:
+            skipped += 1
+            continue
+        taken[article] = taken.get(article, 0) + 1
+        selected.append((doc, score))
+    diversity_filtered_documents.inc(skipped)
+    return selected
+
+def candidate_count(k: int) -> int:
+    return k * DIVERSITY_OVERFETCH if MAX_CHUNKS_PER_ARTICLE > 0 else k
+
+def retrieve(snapshot, prompt: str, query_vector, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS,
+             nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None) -> list:
+    """
+    Chunks to answer from, as (doc, score) pairs. Keyword and vector matches are fused
+    when the index has a keyword index, so exact names and numbers aren't missed;
+    threshold holds for keyword matches too.
+    search_filter is applied during the search, so up to k matching chunks come back.
+    At most MAX_CHUNKS_PER_ARTICLE of them come from the same article.
+    """
+    index = snapshot.index
+    with timed("retrieve"):
+        if HYBRID_SEARCH and index.has_lexical:
+            results = diversify(index.hybrid_search(
+                prompt, query_vector, candidate_count(k), max_distance=threshold, nprobe=nprobe,
+                ef_search=ef_search, search_filter=search_filter
+            ), k)
+        else:
+            results = filter_by_threshold(diversify(index.search_by_vector(
+                query_vector, candidate_count(k), nprobe=nprobe, ef_search=ef_search, search_filter=search_filter
+            ), k), threshold)
+    retrieved_documents.inc(len(results))
+    return results
+
+def retrieve_many(snapshot, prompts: list, query_vectors, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS,
+                  nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None) -> list:
+    """
+    retrieve for a batch of prompts, with a single matrix search over the index.
+    """
+    index = snapshot.index
+    with timed("retrieve_batch"):
+        if HYBRID_SEARCH and index.has_lexical:
+            results = [
+                diversify(results_with_scores, k)
+                for results_with_scores in index.hybrid_search_many(
+                    prompts, query_vectors, candidate_count(k), max_distance=threshold, nprobe=nprobe,
+                    ef_search=ef_search, search_filter=search_filter
+                )
+            ]
+        else:
+            results = [
+                filter_by_threshold(diversify(results_with_scores, k), threshold)
+                for results_with_scores in index.search_by_vectors(
+                    query_vectors, candidate_count(k), nprobe=nprobe, ef_search=ef_search,
+                    search_filter=search_filter
+                )
+            ]
+    retrieved_documents.inc(sum(len(filtered_results) for filtered_results in results))
+    return results
+
+def collect_sources(filtered_results) -> dict:
     sources = []
     chunks = []
     verdicts = []
@@ -144,17 +197,243 @@ def get_fact_check_response(prompt: str, threshold: float = None, k: int = 3) ->
             sources.append({"title": title, "url": url})
             chunks.append(doc.page_content.strip())
             verdicts.append(verdict)
-            scores.append(score)
+            scores.append(float(score))
             seen.add(identifier)
 
     return {
-        "answer": result["output_text"],
         "sources": sources,
         "chunks": chunks,
         "verdicts": verdicts,
         "scores": scores
     }
 
+def usage_report(usage, context_tokens, context) -> dict:
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "context_tokens": context_tokens,
+        "context_chunks": len(context)
+    }
+
+def answer_options(threshold: float = None, k: int = CONTEXT_MAX_CHUNKS, nprobe: int = None, ef_search: int = None,
+                   search_filter: SearchFilter = None) -> tuple:
+    """
+    Everything besides the question an answer depends on, as a cache key.
+    """
+    filter_key = search_filter.key() if search_filter is not None and not search_filter.is_empty() else None
+    return (threshold, k, nprobe, ef_search, filter_key)
+
+def get_fact_check_response(prompt: str, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS, log_query: bool = True,
+                            nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None) -> dict:
+    """
+    Answers prompt from the current index. Identical questions asked while one is
+    being answered (same normalized text, options and index version) share its answer.
+    Raises Overloaded when the LLM queue is full.
+    """
+    # Hold on to one snapshot so a concurrent hot-swap can't mix index versions
+    snapshot = index_manager.current()
+    options = answer_options(threshold, k, nprobe, ef_search, search_filter)
+    if log_query:
+        query_log.record(prompt, options)
+
+    key = (normalize_query(prompt), snapshot.version, options)
+    response, shared = ask_flights.do(
+        key, lambda: answer_question(snapshot, prompt, threshold, k, nprobe, ef_search, search_filter)
+    )
+    if shared:
+        # The tokens were spent by the request that made the call
+        return {name: value for name, value in response.items() if name != "usage"}
+    return response
+
+def answer_question(snapshot, prompt: str, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS,
+                    nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None,
+                    reject: bool = True) -> dict:
+    # nprobe (IVF) and ef_search (HNSW) override the index's default search effort.
+    # Without reject, waits for an LLM slot however long the queue is instead of raising Overloaded.
+    options = answer_options(threshold, k, nprobe, ef_search, search_filter)
+    chain = snapshot.chain
+
+    with timed("embed_query"):
+        query_vector = snapshot.embeddings.embed_query(prompt)
+    cached = answer_cache.lookup(prompt, query_vector, snapshot.version, options)
+    if cached is not None:
+        return cached
+    # Turn the request away before searching if it couldn't get an LLM slot anyway
+    if reject:
+        llm_gate.admit()
+
+    # Perform similarity search with scores
+    filtered_results = retrieve(snapshot, prompt, query_vector, threshold, k, nprobe, ef_search, search_filter)
+    # Only the chunks close to the best match go into the prompt, trimmed to the token budget
+    with timed("context"):
+        context, context_tokens = build_context(prompt, filtered_results)
+
+    docs = [doc for doc, _ in context]
+    usage = UsageCollector()
+    with llm_gate.slot(reject), timed("llm"):
+        result = chain.invoke({"input_documents": docs, "question": prompt}, config={"callbacks": [usage]})
+
+    response = {
+        "answer": result["output_text"],
+        **collect_sources(context),
+        "index_version": snapshot.version
+    }
+    answer_cache.store(prompt, query_vector, snapshot.version, options, response)
+    # Usage is per request: cached answers cost no tokens, so it isn't cached with them
+    return {**response, "usage": usage_report(usage, context_tokens, context)}
+
+async def stream_fact_check_response(prompt: str, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS,
+                                     nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None):
+    """
+    Async variant of get_fact_check_response that yields events as they become available:
+    one "sources" event right after retrieval, a "token" event per LLM token and a final "done"
+    (with the request's token usage, unless the answer came from the cache).
+    """
+    snapshot = index_manager.current()
+    chain = snapshot.chain
+    options = answer_options(threshold, k, nprobe, ef_search, search_filter)
+    query_log.record(prompt, options)
+
+    with timed("embed_query"):
+        query_vector = await snapshot.embeddings.aembed_query(prompt)
+    cached = answer_cache.lookup(prompt, query_vector, snapshot.version, options)
+    if cached is not None:
+        yield {"event": "sources", **cached}
+        yield {"event": "token", "text": cached["answer"]}
+        yield {"event": "done", "answer": cached["answer"]}
+        return
+
+    filtered_results = await asyncio.to_thread(
+        retrieve, snapshot, prompt, query_vector, threshold, k, nprobe, ef_search, search_filter
+    )
+    with timed("context"):
+        context, context_tokens = build_context(prompt, filtered_results)
+    sources = collect_sources(context)
+
+    yield {
+        "event": "sources",
+        **sources,
+        "index_version": snapshot.version
+    }
+
+    docs = [doc for doc, _ in context]
+    usage = UsageCollector()
+    answer = []
+    async with llm_gate.async_slot():
+        started = time.perf_counter()
+        async for event in chain.astream_events(
+            {"input_documents": docs, "question": prompt}, version="v2", config={"callbacks": [usage]}
+        ):
+            if event["event"] != "on_chat_model_stream":
+                continue
+            token = event["data"]["chunk"].content
+            if token:
+                if not answer:
+                    record_stage("llm_first_token", time.perf_counter() - started)
+                answer.append(token)
+                yield {"event": "token", "text": token}
+        record_stage("llm", time.perf_counter() - started)
+
+    answer_text = "".join(answer)
+    answer_cache.store(prompt, query_vector, snapshot.version, options, {
+        "answer": answer_text,
+        **sources,
+        "index_version": snapshot.version
+    })
+    yield {"event": "done", "answer": answer_text, "usage": usage_report(usage, context_tokens, context)}
+
+async def get_fact_check_responses(prompts: list, threshold: float = None, k: int = CONTEXT_MAX_CHUNKS,
+                                   nprobe: int = None, ef_search: int = None, search_filter: SearchFilter = None,
+                                   concurrency: int = BATCH_LLM_CONCURRENCY) -> list:
+    """
+    get_fact_check_response for a list of claims, in order. The claims are embedded in
+    one request and searched with one matrix search; the LLM answers run concurrently,
+    at most concurrency at a time. Cached answers skip both retrieval and the LLM.
+    """
+    snapshot = index_manager.current()
+    chain = snapshot.chain
+    options = answer_options(threshold, k, nprobe, ef_search, search_filter)
+    for prompt in prompts:
+        query_log.record(prompt, options)
+
+    with timed("embed_query"):
+        query_vectors = await snapshot.embeddings.aembed_queries(prompts)
+    responses = [
+        answer_cache.lookup(prompt, vector, snapshot.version, options)
+        for prompt, vector in zip(prompts, query_vectors)
+    ]
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if not pending:
+        return responses
+
+    retrieved = await asyncio.to_thread(
+        retrieve_many, snapshot, [prompts[i] for i in pending], [query_vectors[i] for i in pending],
+        threshold, k, nprobe, ef_search, search_filter
+    )
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(i, filtered_results):
+        context, context_tokens = build_context(prompts[i], filtered_results)
+        docs = [doc for doc, _ in context]
+        usage = UsageCollector()
+        # Batches wait for LLM slots rather than being turned away
+        async with semaphore, llm_gate.async_slot(reject=False):
+            with timed("llm"):
+                result = await chain.ainvoke(
+                    {"input_documents": docs, "question": prompts[i]}, config={"callbacks": [usage]}
+                )
+        response = {
+            "answer": result["output_text"],
+            **collect_sources(context),
+            "index_version": snapshot.version
+        }
+        answer_cache.store(prompts[i], query_vectors[i], snapshot.version, options, response)
+        responses[i] = {**response, "usage": usage_report(usage, context_tokens, context)}
+
+    await asyncio.gather(*(answer(i, filtered_results) for i, filtered_results in zip(pending, retrieved)))
+    return responses
+
+def warm_answer_cache(snapshot, limit: int = ANSWER_CACHE_WARM_QUERIES,
+                      concurrency: int = ANSWER_CACHE_WARM_CONCURRENCY) -> int:
+    """
+    Replays the most frequent recent queries, with the options they were asked with,
+    against snapshot so popular claims are answered from the cache right after a
+    reindex. Runs below user traffic: at most concurrency LLM calls at a time, each
+    started only when no user request is queued for an LLM slot, and never rejected.
+    Stops early if the index is swapped again.
+    """
+    def warm(query, options):
+        while llm_gate.waiting and index_manager.version == snapshot.version:
+            time.sleep(0.1)
+        if index_manager.version != snapshot.version:
+            return False
+        threshold, k, nprobe, ef_search, filter_key = options
+        search_filter = SearchFilter.from_key(filter_key) if filter_key is not None else None
+        try:
+            # Shares the call with users asking the same question meanwhile
+            ask_flights.do(
+                (normalize_query(query), snapshot.version, options),
+                lambda: answer_question(snapshot, query, threshold, k, nprobe, ef_search, search_filter, reject=False)
+            )
+            return True
+        except Exception as e:
+            print(f"⚠️ Failed to pre-warm '{query}': {e}")
+            return False
+
+    queries = query_log.most_common(limit)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="answer-cache-warm") as executor:
+        warmed = sum(executor.map(lambda item: warm(*item), queries))
+    print(f"🔥 Pre-warmed answer cache with {warmed} queries for index version {snapshot.version}")
+    return warmed
+
+def on_index_swap(snapshot):
+    answer_cache.retain_version(snapshot.version)
+    if ANSWER_CACHE_WARM_QUERIES > 0:
+        threading.Thread(target=warm_answer_cache, args=(snapshot,), name="answer-cache-warm", daemon=True).start()
+
+index_manager.subscribe(on_index_swap)
+
 def main():
     chatbot_call_with_sources()
 
@@ -0,0 +1,156 @@
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor
+from api.src.embedding_cache import SqliteEmbeddingStore
+from api.src.metrics import cache_requests, llm_tokens, record_stage
+from api.src.shared_paths import SHARED_DIR
+import os
+import time
+import random
+import hashlib
+import threading
+import openai
+import tiktoken
+
+CHUNK_EMBEDDING_STORE_PATH = os.getenv(
+    "CHUNK_EMBEDDING_STORE_PATH",
+    os.path.join(SHARED_DIR, "cache", "chunk_embeddings.sqlite")
+)
+
+# Texts per embeddings request, requests in flight and the account's tokens-per-minute limit
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+EMBEDDING_MAX_RETRIES = 6
+
+
+def chunk_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def load_encoding(model_name, fallback="cl100k_base"):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding(fallback)
+    except Exception as e:
+        # tiktoken downloads its tables on first use; don't fail a build over a counter
+        print(f"⚠️ Could not load tiktoken encoding, estimating token counts: {e}")
+        return None
+
+
+class TokenRateLimiter:
+    """
+    Token bucket refilled at tokens_per_minute / 60 per second.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        # A single request larger than the bucket just waits for a full bucket
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                wait = (tokens - self._available) / self.rate
+            time.sleep(wait)
+
+
+class BatchedCachedEmbeddings(Embeddings):
+    """
+    Embeds documents through a persistent store keyed by hash(model, chunk text).
+    Only chunks missing from the store are sent to the model, in large batches
+    issued concurrently under a tokens-per-minute budget. Queries pass straight through.
+    """
+
+    def __init__(self, embeddings, store_path=CHUNK_EMBEDDING_STORE_PATH, batch_size=EMBEDDING_BATCH_SIZE,
+                 concurrency=EMBEDDING_CONCURRENCY, tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE):
+        self.embeddings = embeddings
+        self.store = SqliteEmbeddingStore(store_path)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute)
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.encoding = load_encoding(self.model_name)
+        self.last_stats = None
+
+    def count_tokens(self, texts):
+        if self.encoding is None:
+            # Rough estimate for Portuguese/English prose
+            return sum(len(text) for text in texts) // 4
+        return sum(len(tokens) for tokens in self.encoding.encode_batch(texts, disallowed_special=()))
+
+    def _embed_batch(self, texts):
+        tokens = self.count_tokens(texts)
+        for attempt in range(EMBEDDING_MAX_RETRIES):
+            self.rate_limiter.acquire(tokens)
+            try:
+                return self.embeddings.embed_documents(texts), tokens
+            except openai.RateLimitError as e:
+                if attempt == EMBEDDING_MAX_RETRIES - 1:
+                    raise
+                delay = 2 ** attempt * (1 + random.random())
+                print(f"⏳ Embedding rate limit hit, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def embed_documents(self, texts):
+        started = time.perf_counter()
+        keys = [chunk_key(self.model_name, text) for text in texts]
+        vectors = self.store.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+
+        def run(batch):
+            embedded, tokens = self._embed_batch([missing[key] for key in batch])
+            # Persist per batch so an interrupted rebuild keeps what it paid for
+            self.store.put_many(list(zip(batch, embedded)))
+            return dict(zip(batch, embedded)), tokens
+
+        total_tokens = 0
+        if batches:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for embedded, tokens in executor.map(run, batches):
+                    vectors.update(embedded)
+                    total_tokens += tokens
+
+        elapsed = time.perf_counter() - started
+        hits = len(texts) - sum(1 for key in keys if key in missing)
+        cache_requests.inc(hits, cache="chunk_embeddings", result="hit")
+        cache_requests.inc(len(texts) - hits, cache="chunk_embeddings", result="miss")
+        llm_tokens.inc(total_tokens, kind="embedding")
+        record_stage("embed_chunks", elapsed)
+        self.last_stats = {
+            "chunks": len(texts),
+            "cache_hits": hits,
+            "embedded": len(missing_keys),
+            "requests": len(batches),
+            "tokens": total_tokens,
+            "seconds": elapsed,
+            "chunks_per_second": len(missing_keys) / elapsed if elapsed else 0.0,
+            "tokens_per_second": total_tokens / elapsed if elapsed else 0.0,
+        }
+        print(
+            f"🧮 Embedded {len(texts)} chunks: {self.last_stats['cache_hits']} from cache, "
+            f"{len(missing_keys)} new in {len(batches)} requests "
+            f"({self.last_stats['chunks_per_second']:.1f} chunks/s, {self.last_stats['tokens_per_second']:.0f} tokens/s)"
+        )
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
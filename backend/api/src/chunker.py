@@ -0,0 +1,217 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from api.src.near_duplicates import CHUNK_DEDUP, CHUNK_DEDUP_ACROSS_ARTICLES, SimHashIndex, simhash, unique_chunks
+import os
+import time
+import itertools
+import resource
+import multiprocessing
+
+# Streaming chunk stage of build_index. Articles are read lazily, split on a pool of
+# worker processes a few batches ahead of the consumer, and handed over in article
+# order in batches sized for the embedding stage, so embedding starts with the first
+# batch and the corpus is never held in memory as a whole. Kept light on imports:
+# every worker process loads this module.
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 1)))
+# Articles per task sent to a worker, and tasks kept in flight per worker
+CHUNK_TASK_ARTICLES = int(os.getenv("CHUNK_TASK_ARTICLES", "64"))
+CHUNK_TASKS_AHEAD = 2
+
+_splitter = None
+
+
+def splitter():
+    global _splitter
+    if _splitter is None:
+        _splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return _splitter
+
+
+def split_documents(documents, dedup=CHUNK_DEDUP):
+    """
+    Splits each document on its own. Returns, per document, (number of pieces,
+    [(position, chunk, simhash)] of the pieces kept), near-duplicates within the
+    document left out with dedup (fingerprints are only computed with dedup).
+    """
+    results = []
+    for doc in documents:
+        pieces = splitter().split_documents([doc])
+        if dedup:
+            fingerprints = [simhash(piece.page_content) for piece in pieces]
+            kept = unique_chunks(pieces, fingerprints=fingerprints)
+        else:
+            fingerprints = [None] * len(pieces)
+            kept = range(len(pieces))
+        results.append((len(pieces), [(n, pieces[n], fingerprints[n]) for n in kept]))
+    return results
+
+
+def split_task(documents, dedup=CHUNK_DEDUP):
+    # Runs in a worker: split_documents plus the time it took
+    started = time.perf_counter()
+    return split_documents(documents, dedup), time.perf_counter() - started
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process and of its finished children.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return own, children
+
+
+class ChunkStream:
+    """
+    Iterates over (chunks, chunk ids, {article id: indexed_articles entry}) batches
+    of about batch_size chunks for articles, an iterable of (article id, Document,
+    indexed_articles entry). Chunk ids are "<article id>-<position>", exactly as a
+    sequential split would give. With workers <= 1 everything runs in this process.
+    With dedup, near-duplicates are dropped within each article in the workers and,
+    with across_articles, across articles here, in article order (the stream only
+    knows its own articles: on incremental builds, the changed ones). An article's
+    entry lists the chunks dropped for repeating another article under "dropped",
+    {position: id of the article that kept the text}, so a build that changes the
+    keeper can split the article again and restore them.
+
+        stream = ChunkStream(articles)
+        for chunks, chunk_ids, entries in stream:
+            ...
+        print(stream.summary())
+    """
+
+    def __init__(self, articles, batch_size=2048, workers=CHUNK_WORKERS, dedup=CHUNK_DEDUP,
+                 task_articles=CHUNK_TASK_ARTICLES, across_articles=CHUNK_DEDUP_ACROSS_ARTICLES):
+        self.articles = articles
+        self.batch_size = batch_size
+        self.workers = workers
+        self.dedup = dedup
+        self.task_articles = task_articles
+        # Fingerprint -> article id of the first chunk kept with that text
+        self.seen = SimHashIndex() if dedup and across_articles else None
+        self.cross_duplicates = 0
+        # Processes the split actually ran on
+        self.processes = 1
+        self.article_count = 0
+        self.chunk_count = 0
+        self.piece_count = 0
+        self.seconds = 0.0
+        # Splitting time summed over the workers, and the time the consumer spent
+        # waiting for chunks, i.e. the stall the stage adds to the build
+        self.split_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def _tasks(self):
+        task = []
+        for article in self.articles:
+            task.append(article)
+            if len(task) == self.task_articles:
+                yield task
+                task = []
+        if task:
+            yield task
+
+    def _results(self):
+        """
+        (task, split results) in article order, keeping a bounded number of tasks in flight.
+        """
+        tasks = self._tasks()
+        first = next(tasks, None)
+        second = next(tasks, None) if first is not None else None
+        if self.workers <= 1 or second is None:
+            # A single task isn't worth starting worker processes for
+            for task in itertools.chain(filter(None, (first, second)), tasks):
+                yield task, split_task([doc for _, doc, _ in task], self.dedup)
+            return
+
+        # Spawned like the scraper's parse pool: the build process runs threads too
+        self.processes = self.workers
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = deque()
+            for task in itertools.chain((first, second), tasks):
+                pending.append((task, pool.submit(split_task, [doc for _, doc, _ in task], self.dedup)))
+                if len(pending) >= self.workers * CHUNK_TASKS_AHEAD:
+                    task, future = pending.popleft()
+                    yield task, future.result()
+            while pending:
+                task, future = pending.popleft()
+                yield task, future.result()
+
+    def __iter__(self):
+        started = time.perf_counter()
+        chunks, ids, entries = [], [], {}
+        results = self._results()
+        while True:
+            waited = time.perf_counter()
+            try:
+                task, (split, seconds) = next(results)
+            except StopIteration:
+                break
+            self.wait_seconds += time.perf_counter() - waited
+            self.split_seconds += seconds
+
+            for (aid, _, entry), (pieces, kept) in zip(task, split):
+                unique, dropped = self._across_articles(aid, kept)
+                entries[aid] = {**entry, "chunks": pieces, **({"dropped": dropped} if dropped else {})}
+                for n, chunk, fingerprint in unique:
+                    chunks.append(chunk)
+                    ids.append(f"{aid}-{n}")
+                self.article_count += 1
+                self.piece_count += pieces
+            if len(chunks) >= self.batch_size:
+                self.chunk_count += len(chunks)
+                yield chunks, ids, entries
+                chunks, ids, entries = [], [], {}
+
+        if entries:
+            self.chunk_count += len(chunks)
+            yield chunks, ids, entries
+        self.seconds = time.perf_counter() - started
+
+    def _across_articles(self, aid, kept):
+        """
+        The kept chunks of article aid that no earlier article already has, and
+        {position: owner article id} of those that one has.
+        """
+        if self.seen is None:
+            return kept, {}
+        unique = []
+        dropped = {}
+        for n, chunk, fingerprint in kept:
+            if fingerprint is not None:
+                owner = self.seen.find(fingerprint)
+                if owner is not None and owner != aid:
+                    self.cross_duplicates += 1
+                    dropped[str(n)] = owner
+                    continue
+                self.seen.add(fingerprint, aid)
+            unique.append((n, chunk, fingerprint))
+        return unique, dropped
+
+    def collect(self):
+        """
+        Every batch merged into one (chunks, chunk ids, entries), for small inputs.
+        """
+        chunks, ids, entries = [], [], {}
+        for batch_chunks, batch_ids, batch_entries in self:
+            chunks.extend(batch_chunks)
+            ids.extend(batch_ids)
+            entries.update(batch_entries)
+        return chunks, ids, entries
+
+    @property
+    def duplicates(self):
+        return self.piece_count - self.chunk_count
+
+    def summary(self):
+        own, children = peak_rss_bytes()
+        rate = self.piece_count / self.split_seconds if self.split_seconds else 0.0
+        return (
+            f"{self.article_count} articles -> {self.chunk_count} chunks, split on {self.processes} processes "
+            f"at {rate:.0f} chunks/s each, build blocked on chunking {self.wait_seconds:.1f}s of {self.seconds:.1f}s, "
+            f"peak memory {own / 1024 / 1024:.0f} MB (workers {children / 1024 / 1024:.0f} MB)"
+        )
@@ -0,0 +1,106 @@
+from langchain_core.documents import Document
+from api.src.chunk_embeddings import load_encoding
+from api.src.lexical_index import tokenize
+import os
+import re
+import threading
+
+# Decides what goes into the QA prompt. Of the retrieved chunks, only those scoring
+# close to the best one are sent, and together they must fit a token budget. Chunks
+# are sent whole while they fit; one that doesn't is cut down to the sentences that
+# mention the question's terms first, so simple questions get short prompts.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Most chunks retrieved per question; how many are sent depends on their scores
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "5"))
+# Chunks further than this (squared L2) from the best match are left out
+CONTEXT_SCORE_MARGIN = float(os.getenv("CONTEXT_SCORE_MARGIN", "0.15"))
+# Cut a chunk that doesn't fit the remaining budget instead of leaving it out
+CONTEXT_TRIM = os.getenv("CONTEXT_TRIM", "true").lower() == "true"
+# Tokenizer of the answering model (gpt-4.1 models use o200k_base)
+TOKENIZER_MODEL = "gpt-4.1-nano"
+TOKENIZER_FALLBACK = "o200k_base"
+# "Content: ...\nSource: ..." around every chunk in the "stuff" prompt
+DOCUMENT_OVERHEAD_TOKENS = 8
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text):
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                _encoding = load_encoding(TOKENIZER_MODEL, TOKENIZER_FALLBACK)
+                _encoding_loaded = True
+    if _encoding is None:
+        # Rough estimate for Portuguese/English prose
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def select_chunks(results_with_scores, margin=CONTEXT_SCORE_MARGIN):
+    """
+    The results worth sending, in order: the top one, then those scoring within
+    margin of the best score. A clear winner is sent alone.
+    """
+    if not results_with_scores:
+        return []
+    best = min(score for _, score in results_with_scores)
+    return results_with_scores[:1] + [
+        (doc, score) for doc, score in results_with_scores[1:] if score <= best + margin
+    ]
+
+
+def trim_to_budget(text, query_terms, budget):
+    """
+    As many sentences of text as fit in budget tokens, in their original order.
+    Sentences sharing more terms with the question are kept first, then the others
+    from the beginning, so text with no matching sentence (a purely semantic match)
+    is kept from its beginning.
+    """
+    sentences = [sentence for sentence in SENTENCE_END_RE.split(text.strip()) if sentence]
+    overlap = [len(query_terms.intersection(tokenize(sentence))) for sentence in sentences]
+    ranked = sorted(range(len(sentences)), key=lambda i: -overlap[i])
+
+    kept = []
+    used = 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i])
+        if used + tokens > budget:
+            continue
+        kept.append(i)
+        used += tokens
+    if not kept and sentences:
+        # A single sentence longer than the budget: cut it
+        return sentences[ranked[0]][:budget * 4], budget
+    return " ".join(sentences[i] for i in sorted(kept)), used
+
+
+def build_context(question, results_with_scores, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Picks and trims the chunks to answer question from. Returns ([(Document, score)]
+    with the text actually sent, tokens of that text).
+    """
+    query_terms = set(tokenize(question))
+    selected = select_chunks(results_with_scores)
+    context = []
+    used = 0
+    for doc, score in selected:
+        remaining = token_budget - used - DOCUMENT_OVERHEAD_TOKENS
+        if remaining <= 0:
+            break
+        text = doc.page_content.strip()
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if not CONTEXT_TRIM:
+                continue
+            text, tokens = trim_to_budget(text, query_terms, remaining)
+        if not text:
+            continue
+        context.append((Document(page_content=text, metadata=doc.metadata), score))
+        used += tokens + DOCUMENT_OVERHEAD_TOKENS
+    return context, used
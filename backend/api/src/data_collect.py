@@ -1,63 +1,34 @@
-import requests
 from bs4 import BeautifulSoup
+from api.src.fetcher import AsyncFetcher
+from api.src.article_parser import parse_article_html, parse_portuguese_datetime, PT_MONTHS
+from api.src.article_store import SegmentWriter, compact_segments
+from api.src.page_cache import open_page_cache
+from api.src.metrics import instrument_s3, timed
+from api.src.shared_paths import SHARED_DIR
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
-import time
-import datetime
+import asyncio
+import itertools
+import multiprocessing
+import argparse
 from datetime import datetime
 import boto3
-from io import BytesIO
 
 S3_BUCKET = os.getenv("S3_BUCKET", "your-s3-bucket-name")
 S3_PREFIX = "data"
-s3 = boto3.client("s3")
-
-PT_MONTHS = {
-    "janeiro": "01",
-    "fevereiro": "02",
-    "março": "03",
-    "abril": "04",
-    "maio": "05",
-    "junho": "06",
-    "julho": "07",
-    "agosto": "08",
-    "setembro": "09",
-    "outubro": "10",
-    "novembro": "11",
-    "dezembro": "12"
-}
+s3 = instrument_s3(boto3.client("s3"))
 
 BASE_URL = 'https://poligrafo.sapo.pt/fact-checks/'
 HEADERS = {'User-Agent': 'Mozilla/5.0'}
-
-SHARED_DIR = os.getenv(
-    "SHARED_DATA_DIR",
-    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared', 'data'))
-)
+# Processes parsing article pages during a run; 1 parses on a thread in this process
+SCRAPE_PARSE_WORKERS = int(os.getenv("SCRAPE_PARSE_WORKERS", str(os.cpu_count() or 1)))
 
 # Paths used throughout the app
 OUTPUT_FILE = os.path.join(SHARED_DIR, 'data/articles.json')
 META_FILE = os.path.join(SHARED_DIR, 'data/last_run.json')
 
 
-def parse_portuguese_datetime(text):
-    """
-    Converts '26 de Maio de 2025 às 11:00' into datetime object.
-    """
-    try:
-        parts = text.lower().split(" de ")
-        day = parts[0].strip()
-        month = PT_MONTHS[parts[1].strip()]
-        year_time = parts[2].split(" às ")
-        year = year_time[0].strip()
-        time_str = year_time[1].strip()
-        datetime_str = f"{day}.{month}.{year} {time_str}"
-        return datetime.strptime(datetime_str, "%d.%m.%Y %H:%M")
-    except Exception as e:
-        print(f"⚠️ Failed to parse date '{text}': {e}")
-        return datetime.now()
-
-
 def load_last_run():
     key = f"{S3_PREFIX}/last_run.json"
     try:
@@ -72,13 +43,11 @@ def save_last_run(timestamp):
     payload = json.dumps({"last_seen": timestamp.isoformat()})
     s3.put_object(Bucket=S3_BUCKET, Key=key, Body=payload.encode("utf-8"))
 
-def fetch_article_links(page_url):
-    response = requests.get(page_url, headers=HEADERS)
-    if response.status_code != 200:
-        print(f"Failed to retrieve {page_url}")
-        return []
+def listing_page_url(page_number):
+    return f"{BASE_URL}" if page_number == 1 else f"{BASE_URL}{page_number}/"
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+def parse_article_links(html):
+    soup = BeautifulSoup(html, 'html.parser')
     articles = soup.find_all('article')
     links = []
 
@@ -92,101 +61,176 @@ def fetch_article_links(page_url):
 
     return links
 
-def scrape_article_content(article_url):
-    response = requests.get(article_url, headers=HEADERS)
-    if response.status_code != 200:
-        print(f"Failed to retrieve {article_url}")
+def parse_pool(workers=SCRAPE_PARSE_WORKERS):
+    """
+    Process pool for article parsing, or None to parse on the default thread pool.
+    Workers are spawned: this process already runs threads (event loop executor, S3 transfers).
+    """
+    if workers <= 1:
         return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    title_tag = soup.find('h1')
-    title = title_tag.get_text(strip=True) if title_tag else "No title"
-
-    content_div = soup.find('div', class_='elementor-widget-theme-post-content')
-    paragraphs = content_div.find_all('p') if content_div else []
-    content = "\n\n".join(p.get_text(strip=True) for p in paragraphs)
-
-    verdict_container = soup.find('div', class_='fact-check-result')
-    verdict_tag = verdict_container.find('span') if verdict_container else None
-    verdict = verdict_tag.get_text(strip=True) if verdict_tag else "Unknown"
-
-    # Get publication time from custom class
-    pub_tag = soup.find(class_="custom-post-date-time")
-    published = parse_portuguese_datetime(pub_tag.get_text(strip=True)) if pub_tag else datetime.now()
-
-    return {
-        'url': article_url,
-        'title': title,
-        'verdict': verdict,
-        'content': content,
-        'published': published.isoformat()
-    }
+async def fetch_and_parse_article(fetcher, article_url, pool=None, cache=None):
+    with timed("scrape_fetch"):
+        # Conditional when the page is cached: unchanged pages come back without a body
+        result = await cache.fetch(fetcher, article_url) if cache is not None else await fetcher.fetch(article_url)
+    if result is None or result.status != 200:
+        print(f"Failed to retrieve {article_url}")
+        return None
+    # Parse off the event loop so the remaining downloads keep going meanwhile
+    loop = asyncio.get_running_loop()
+    with timed("scrape_parse"):
+        return await loop.run_in_executor(pool, parse_article_html, result.text, article_url)
+
+async def fetch_listing(fetcher, page_number):
+    page_url = listing_page_url(page_number)
+    result = await fetcher.fetch(page_url)
+    if result is None or result.status != 200:
+        print(f"Failed to retrieve {page_url}")
+        return []
+    return parse_article_links(result.text)
 
-def append_article_to_json(article, key=f"{S3_PREFIX}/articles.json"):
-    data = []
-    try:
-        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-        data = json.loads(obj['Body'].read().decode('utf-8'))
-    except s3.exceptions.NoSuchKey:
-        data = []
-    except json.JSONDecodeError:
-        print("Warning: JSON file was malformed. Starting fresh.")
-
-    if not any(existing['url'] == article['url'] for existing in data):
-        data.append(article)
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=key,
-            Body=json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
-        )
-        print(f"✅ Saved: {article['title']}")
-        return True
-    else:
-        print(f"⚠️ Skipped duplicate: {article['url']}")
-        return False
-
-def data_collect():
-    last_run = load_last_run()
+async def collect_articles(writer, last_run, max_pages, backfill=False, cache=None):
+    """
+    Walks up to max_pages listing pages. All articles of a page are downloaded and
+    parsed concurrently, and the next listing page is prefetched while the current
+    one is saved. Articles are consumed in listing order (newest first) so the
+    incremental run can stop at the first one that was already scraped, without
+    downloading it when its URL is already stored; a backfill walks every page and
+    relies on duplicate detection instead, re-validating cached pages.
+    """
     newest_article_time = None
-    stop_scraping = False
-
-    page_number = 1
-    while page_number < 2:
-        page_url = f"{BASE_URL}" if page_number == 1 else f"{BASE_URL}{page_number}/"
-        print(f"\n🔎 Processing page: {page_url}")
-        article_links = fetch_article_links(page_url)
-
-        if not article_links:
-            print("🚫 No more articles found.")
-            break
-
-        for link in article_links:
-            article = scrape_article_content(link)
-            if not article:
-                continue
-
-            article_time = datetime.fromisoformat(article['published'])
-
-            if not newest_article_time or article_time > newest_article_time:
-                newest_article_time = article_time
-
-            if last_run and article_time <= last_run:
-                print("🛑 Reached previously scraped content. Stopping.")
-                stop_scraping = True
-                break
-
-            if append_article_to_json(article):
-                time.sleep(2)
-
-        if stop_scraping:
-            break
+    loop = asyncio.get_running_loop()
+    pool = parse_pool()
+
+    async with AsyncFetcher(headers=HEADERS) as fetcher:
+        next_listing = asyncio.create_task(fetch_listing(fetcher, 1))
+
+        try:
+            for page_number in range(1, max_pages + 1):
+                print(f"\n🔎 Processing page: {listing_page_url(page_number)}")
+                article_links = await next_listing
+
+                if not article_links:
+                    print("🚫 No more articles found.")
+                    break
+
+                if page_number < max_pages:
+                    next_listing = asyncio.create_task(fetch_listing(fetcher, page_number + 1))
+
+                stop_scraping = False
+                if not backfill:
+                    new_links = list(itertools.takewhile(lambda link: not writer.contains(link), article_links))
+                    if len(new_links) < len(article_links):
+                        print(f"🛑 Reached an already stored article after {len(new_links)} new links. Stopping.")
+                        stop_scraping = True
+                    article_links = new_links
+
+                tasks = [
+                    asyncio.create_task(fetch_and_parse_article(fetcher, link, pool, cache))
+                    for link in article_links
+                ]
+
+                try:
+                    for task in tasks:
+                        article = await task
+                        if not article:
+                            continue
+
+                        article_time = datetime.fromisoformat(article['published'])
+
+                        if not newest_article_time or article_time > newest_article_time:
+                            newest_article_time = article_time
+
+                        if not backfill and last_run and article_time <= last_run:
+                            print("🛑 Reached previously scraped content. Stopping.")
+                            stop_scraping = True
+                            break
+
+                        # add() may flush a segment to S3, so keep it off the event loop
+                        await loop.run_in_executor(None, writer.add, article)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+
+                if stop_scraping:
+                    break
+        finally:
+            next_listing.cancel()
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+    return newest_article_time
+
+def reparse_cached_pages(writer, cache, pool=None, batch_size=200):
+    """
+    Runs the current extraction over every cached page and stores the articles
+    that come out different, without downloading anything.
+    """
+    parsed = 0
+    batch = []
+
+    def flush():
+        articles = pool.map(parse_article_html, *zip(*batch), chunksize=16) if pool else (parse_article_html(*page) for page in batch)
+        for article in articles:
+            writer.add(article)
+        batch.clear()
+
+    for url, text in cache.iter_pages():
+        batch.append((text, url))
+        parsed += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return parsed
+
+def data_collect(backfill_pages=None, reparse=False):
+    """
+    Incremental run by default: only the first listing page, stopping at the last
+    scraped article. Pass backfill_pages to walk that many listing pages instead,
+    or reparse to re-extract every cached page (e.g. after a parser change).
+    """
+    cache = open_page_cache()
+    if reparse:
+        if cache is None:
+            raise RuntimeError("Re-parsing needs the page cache (PAGE_CACHE_PATH).")
+        pool = parse_pool()
+        try:
+            with timed("reparse"), SegmentWriter() as writer:
+                parsed = reparse_cached_pages(writer, cache, pool)
+        finally:
+            cache.close()
+            if pool is not None:
+                pool.shutdown()
+        print(f"\n📰 Re-parsed {parsed} cached pages, saved {writer.saved} changed articles.")
+        return
 
-        page_number += 1
+    last_run = load_last_run()
+    backfill = backfill_pages is not None
+    max_pages = backfill_pages if backfill else 1
 
-    if newest_article_time:
+    try:
+        with timed("scrape"), SegmentWriter() as writer:
+            newest_article_time = asyncio.run(
+                collect_articles(writer, last_run, max_pages, backfill=backfill, cache=cache)
+            )
+    finally:
+        if cache is not None:
+            print(f"🗄️ Page cache: {cache.stats()}")
+            cache.close()
+    print(f"\n📰 Saved {writer.saved} new articles.")
+
+    with timed("compact_segments"):
+        compact_segments()
+
+    if newest_article_time and (not last_run or newest_article_time > last_run):
         save_last_run(newest_article_time)
         print(f"\n🕒 Last run timestamp updated: {newest_article_time.isoformat()}")
 
 if __name__ == "__main__":
-    data_collect()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape new Polígrafo fact-checks into S3.")
+    parser.add_argument("--backfill", type=int, metavar="PAGES", help="walk this many listing pages")
+    parser.add_argument("--reparse", action="store_true", help="re-extract the cached pages instead of scraping")
+    args = parser.parse_args()
+    data_collect(backfill_pages=args.backfill, reparse=args.reparse)
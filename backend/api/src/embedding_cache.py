@@ -0,0 +1,298 @@
+from langchain_core.embeddings import Embeddings
+from api.src.metrics import cache_requests, timed
+from collections import OrderedDict
+from array import array
+import os
+import time
+import sqlite3
+import threading
+import unicodedata
+
+# In-memory LRU tier, in number of query vectors
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+# Optional on-disk tier that survives restarts. Disabled when no path is set.
+QUERY_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH")
+QUERY_CACHE_DISK_MB = float(os.getenv("QUERY_EMBEDDING_CACHE_DISK_MB", "256"))
+
+
+def normalize_query(text):
+    """
+    Collapses the differences that don't change the meaning of a question:
+    unicode form, case and whitespace.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.lower().split())
+
+
+def evict_least_recent(conn, table, key_column, size_column, stored_bytes, max_bytes):
+    """
+    Deletes the least recently used rows of table (by its last_used column) once the
+    blobs in size_column exceed max_bytes. Returns the bytes left stored.
+    """
+    if not max_bytes or stored_bytes <= max_bytes:
+        return stored_bytes
+    # Drop the oldest tenth in one go so eviction doesn't run on every insert
+    target = max_bytes * 0.9
+    rows = conn.execute(f"SELECT {key_column}, LENGTH({size_column}) FROM {table} ORDER BY last_used ASC")
+    evicted = []
+    for key, size in rows:
+        if stored_bytes <= target:
+            break
+        evicted.append((key,))
+        stored_bytes -= size
+    conn.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", evicted)
+    return stored_bytes
+
+
+def pack_vector(vector):
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SqliteEmbeddingStore:
+    """
+    Persistent key -> vector store with least-recently-used eviction once the
+    stored vectors exceed max_bytes. Vectors are kept as float32.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get_many(self, keys):
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = unpack_vector(blob)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            keys = [key for key, _ in items]
+            replaced = 0
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            rows = [(key, pack_vector(vector), now) for key, vector in items]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._bytes += sum(len(blob) for _, blob, _ in rows) - replaced
+            self._evict()
+            self._conn.commit()
+
+    def put(self, key, vector):
+        self.put_many([(key, vector)])
+
+    def _evict(self):
+        self._bytes = evict_least_recent(self._conn, "embeddings", "key", "vector", self._bytes, self.max_bytes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache for query embeddings: a bounded in-memory LRU in front of
+    an optional SqliteEmbeddingStore.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, disk_path=QUERY_CACHE_PATH, disk_max_mb=QUERY_CACHE_DISK_MB):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = SqliteEmbeddingStore(disk_path, int(disk_max_mb * 1024 * 1024)) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                cache_requests.inc(cache="query_embeddings", result="hit")
+                return vector
+
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                cache_requests.inc(cache="query_embeddings", result="disk_hit")
+                self._remember(key, vector)
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        cache_requests.inc(cache="query_embeddings", result="miss")
+        return None
+
+    def put(self, key, vector):
+        self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.put(key, vector)
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_max_entries": self.max_entries,
+            }
+        if self.disk is not None:
+            stats["disk_entries"] = len(self.disk)
+            stats["disk_bytes"] = self.disk.size_bytes
+        return stats
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model so embed_query is served from a QueryEmbeddingCache.
+    Queries are cached under their normalized text, so case and whitespace variants
+    share a vector, but a miss embeds the text as it was asked: the vector is the
+    one the model would have returned without the cache.
+    Document embedding (used when indexing) is passed straight through.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+
+    def _key(self, normalized):
+        return f"{self.model_name}:{normalized}"
+
+    def embed_query(self, text):
+        key = self._key(normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is None:
+            with timed("embed_query_api"):
+                vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self._key(normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is None:
+            with timed("embed_query_api"):
+                vector = await self.embeddings.aembed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    def _cached_queries(self, texts):
+        """
+        Returns (keys, {key: vector} for cached queries, {key: text} for the rest),
+        text being the first of the variants of a key to appear in texts.
+        """
+        keys = []
+        found = {}
+        missing = {}
+        for text in texts:
+            key = self._key(normalize_query(text))
+            keys.append(key)
+            if key in found or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+        return keys, found, missing
+
+    def embed_queries(self, texts):
+        """
+        embed_query for many queries, with everything not cached embedded in one request.
+        """
+        keys, found, missing = self._cached_queries(texts)
+        if missing:
+            with timed("embed_query_api"):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                self.cache.put(key, vector)
+                found[key] = vector
+        return [found[key] for key in keys]
+
+    async def aembed_queries(self, texts):
+        keys, found, missing = self._cached_queries(texts)
+        if missing:
+            with timed("embed_query_api"):
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                self.cache.put(key, vector)
+                found[key] = vector
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+
+query_embedding_cache = QueryEmbeddingCache()
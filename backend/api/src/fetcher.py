@@ -0,0 +1,145 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import os
+import random
+import asyncio
+import aiohttp
+
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+# Maximum requests per second sent to any single host
+SCRAPE_RATE_PER_HOST = float(os.getenv("SCRAPE_RATE_PER_HOST", "4"))
+SCRAPE_MAX_RETRIES = int(os.getenv("SCRAPE_MAX_RETRIES", "4"))
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "30"))
+# Longest Retry-After honoured; a server asking for more is retried after this anyway
+SCRAPE_MAX_RETRY_AFTER = float(os.getenv("SCRAPE_MAX_RETRY_AFTER", "120"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class FetchResult:
+    def __init__(self, url, status, text, headers, from_cache=False):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.headers = headers
+        # Served from the page cache after the server answered 304 Not Modified
+        self.from_cache = from_cache
+
+
+class HostRateLimiter:
+    """
+    Spaces out request starts to the same host by at least 1 / rate seconds.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def defer(self, host, seconds):
+        """
+        Pushes the host's next slot back, e.g. after a Retry-After response.
+        """
+        loop = asyncio.get_running_loop()
+        self._next_slot[host] = max(self._next_slot.get(host, 0.0), loop.time() + seconds)
+
+
+class AsyncFetcher:
+    """
+    Pooled aiohttp client with bounded concurrency, a per-host rate limit and
+    retries with exponential backoff that honour Retry-After.
+
+        async with AsyncFetcher(headers=HEADERS) as fetcher:
+            result = await fetcher.fetch(url)
+    """
+
+    def __init__(self, headers=None, concurrency=SCRAPE_CONCURRENCY, rate_per_host=SCRAPE_RATE_PER_HOST,
+                 max_retries=SCRAPE_MAX_RETRIES, timeout=SCRAPE_TIMEOUT, backoff=1.0):
+        self.headers = headers or {}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.rate_limiter = HostRateLimiter(rate_per_host)
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def fetch(self, url, headers=None):
+        """
+        Returns a FetchResult, or None once all retries are exhausted.
+        Non-retryable statuses (e.g. 404) are returned as-is.
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                await self.rate_limiter.wait(host)
+                try:
+                    async with self._session.get(url, headers=headers) as response:
+                        if response.status not in RETRY_STATUSES:
+                            try:
+                                text = await response.text()
+                            except (UnicodeDecodeError, LookupError) as e:
+                                # Wrong or unknown charset: keep what decodes rather than lose the page
+                                print(f"⚠️ Could not decode {url} ({e!r}), replacing invalid characters")
+                                text = (await response.read()).decode("utf-8", errors="replace")
+                            return FetchResult(url, response.status, text, dict(response.headers))
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if retry_after is not None:
+                            retry_after = min(retry_after, SCRAPE_MAX_RETRY_AFTER)
+                        reason = f"HTTP {response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    reason = repr(e)
+
+            if attempt == self.max_retries:
+                print(f"❌ Giving up on {url} after {attempt + 1} attempts ({reason})")
+                return None
+
+            delay = retry_after if retry_after is not None else self.backoff * (2 ** attempt) * (1 + random.random())
+            if retry_after is not None:
+                self.rate_limiter.defer(host, retry_after)
+            print(f"⏳ Retrying {url} in {delay:.1f}s ({reason})")
+            await asyncio.sleep(delay)
@@ -0,0 +1,767 @@
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from concurrent.futures import ThreadPoolExecutor
+from api.src.metrics import timed
+from api.src.lexical_index import (
+    LEXICAL_FILE, LEXICAL_SCHEMA, HYBRID_CANDIDATES, lexical_search, index_terms, remove_terms,
+    optimize_terms, reciprocal_rank_fusion
+)
+from api.src.attribute_index import (
+    ATTRIBUTES_FILE, ATTRIBUTES_SCHEMA, FILTER_EXACT_MAX, AttributeIndex, chunk_attributes, export_attributes,
+    load_verdicts
+)
+import os
+import json
+import math
+import contextvars
+import queue
+import shutil
+import sqlite3
+import threading
+import numpy as np
+import faiss
+
+# On-disk layout of an index version:
+#   index.faiss      vectors, labelled with the row ids of docstore.sqlite
+#   docstore.sqlite  chunk text and metadata, read only for the hits of a search
+#   vectors.sqlite   full float32 vectors by row id. Rebuilds start from these, since a
+#                    quantized index.faiss can't give back exact vectors. Only shipped
+#                    to readers when they re-rank quantized search results.
+#   lexical.sqlite   keyword index over the same rows (see lexical_index.py)
+#   attributes.npy   verdict / date / article columns for filtered search (see attribute_index.py)
+# Readers memory-map index.faiss, so workers on the same host share its pages through
+# the page cache, and open docstore.sqlite read-only instead of unpickling a docstore.
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+VECTORS_FILE = "vectors.sqlite"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+# SQLite connections opened per loaded index
+DOCSTORE_POOL_SIZE = int(os.getenv("DOCSTORE_POOL_SIZE", "8"))
+
+# Vector index built by build_index: "flat" (exact), "ivf" or "hnsw" (approximate)
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+# IVF: number of clusters (0 picks ~4*sqrt(n)) and clusters scanned per query
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Trained indexes (IVF, SQ8, PQ) are retrained once they grow this much past their training size
+INDEX_RETRAIN_GROWTH = float(os.getenv("INDEX_RETRAIN_GROWTH", "4"))
+# HNSW: links per node, and candidate list sizes at build and query time
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+# How vectors are stored: "none" (float32), "sq8" (1 byte per dimension, 4x smaller)
+# or "pq" (PQ_DIMS_PER_CODE dimensions per byte, e.g. 16 -> 64x smaller)
+QUANTIZATIONS = ("none", "sq8", "pq")
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "none")
+PQ_DIMS_PER_CODE = int(os.getenv("PQ_DIMS_PER_CODE", "16"))
+# PQ codebooks have 256 centroids per sub-quantizer; smaller corpora stay unquantized
+PQ_MIN_TRAINING_POINTS = 256
+# Quantized search fetches k * RERANK_FACTOR candidates and re-ranks them with exact
+# distances, when the index was published with its vectors (INDEX_RERANK). 1 disables it.
+INDEX_RERANK = os.getenv("INDEX_RERANK", "false").lower() == "true"
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+# Runs keyword lookups while the vector search runs on the calling thread
+lexical_executor = ThreadPoolExecutor(max_workers=DOCSTORE_POOL_SIZE, thread_name_prefix="lexical")
+
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+DOCSTORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row_id INTEGER PRIMARY KEY,
+    chunk_id TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+VECTORS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vec.vectors (row_id INTEGER PRIMARY KEY, vector BLOB NOT NULL);
+"""
+
+
+def is_compact_index(path):
+    return os.path.exists(os.path.join(path, DOCSTORE_FILE))
+
+
+def read_index_mmap(path):
+    # In-place mapping isn't available for every index type (IVF lists are mapped by
+    # the plain mmap reader instead); anything else is loaded into memory.
+    for flags in (MMAP_FLAGS, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY):
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            error = e
+    print(f"ℹ️ Loading {path} into memory instead of mmap: {error}")
+    return faiss.read_index(path)
+
+
+def _unwrap(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index):
+    """
+    "flat", "ivf" or "hnsw" for an index written by IndexWriter (or LangChain).
+    """
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def index_quantization(index):
+    """
+    "none", "sq8" or "pq": how the vectors of index are stored.
+    """
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "sq8"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    return "none"
+
+
+def default_nlist(n):
+    # faiss wants ~39 training points per cluster
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def pq_subquantizers(d):
+    # One byte per PQ_DIMS_PER_CODE dimensions, rounded down to a divisor of d
+    m = max(1, d // PQ_DIMS_PER_CODE)
+    while d % m:
+        m -= 1
+    return m
+
+
+def factory_string(index_type, quantization, d, n, nlist=IVF_NLIST):
+    storage = {"none": "Flat", "sq8": "SQ8", "pq": f"PQ{pq_subquantizers(d)}"}[quantization]
+    if index_type == "ivf":
+        return f"IVF{nlist or default_nlist(n)},{storage}"
+    if index_type == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M},{storage}"
+    return f"IDMap2,{storage}"
+
+
+def build_faiss_index(index_type, vectors, row_ids, quantization="none", nlist=IVF_NLIST):
+    """
+    Builds an index of index_type holding vectors, labelled with row_ids,
+    training it on vectors when the type or quantization needs it.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    d = vectors.shape[1]
+    if quantization == "pq" and len(vectors) < PQ_MIN_TRAINING_POINTS:
+        print(f"ℹ️ {len(vectors)} vectors are too few to train PQ, storing them unquantized for now.")
+        quantization = "none"
+
+    index = faiss.index_factory(d, factory_string(index_type, quantization, d, len(vectors), nlist))
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        # Lets remove_ids() and reconstruct() address vectors by row id
+        inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vectors)
+
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(row_ids, dtype=np.int64))
+    return index
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """
+    Per-query search parameters, so concurrent requests never share mutable index state.
+    selector restricts the search to the row ids it accepts.
+    """
+    kind = index_kind(index)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(nprobe=nprobe or IVF_NPROBE, sel=selector)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or HNSW_EF_SEARCH, sel=selector)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def fetch_vectors(conn, row_ids):
+    """
+    Returns (row ids found, their full vectors as a float32 matrix).
+    """
+    found = []
+    vectors = []
+    for start in range(0, len(row_ids), 500):
+        batch = [int(row_id) for row_id in row_ids[start:start + 500]]
+        placeholders = ",".join("?" * len(batch))
+        for row_id, blob in conn.execute(
+            f"SELECT row_id, vector FROM vec.vectors WHERE row_id IN ({placeholders})", batch
+        ):
+            found.append(row_id)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+    return found, np.stack(vectors) if vectors else None
+
+
+def fetch_documents(conn, row_ids):
+    """
+    Returns {row id: Document} for row_ids, in one query.
+    """
+    if not row_ids:
+        return {}
+    placeholders = ",".join("?" * len(row_ids))
+    rows = conn.execute(
+        f"SELECT row_id, page_content, metadata FROM chunks WHERE row_id IN ({placeholders})",
+        [int(row_id) for row_id in row_ids]
+    ).fetchall()
+    return {
+        row_id: Document(page_content=content, metadata=json.loads(metadata))
+        for row_id, content, metadata in rows
+    }
+
+
+class CompactIndex:
+    """
+    Read side of an index version. Thread-safe.
+    """
+
+    def __init__(self, path, pool_size=DOCSTORE_POOL_SIZE):
+        self.path = path
+        self.index = read_index_mmap(os.path.join(path, INDEX_FILE))
+        # immutable=1: the snapshot never changes, so SQLite skips locking and WAL files.
+        # All connections are opened up front, so they stay valid if the cache is pruned.
+        uri = f"file:{os.path.join(path, DOCSTORE_FILE)}?mode=ro&immutable=1"
+        vectors_path = os.path.join(path, VECTORS_FILE)
+        # Exact re-ranking only helps quantized indexes, and needs the shipped vectors
+        self.rerank = (
+            os.path.exists(vectors_path) and RERANK_FACTOR > 1
+            and index_quantization(self.index) != "none"
+        )
+        lexical_path = os.path.join(path, LEXICAL_FILE)
+        self.has_lexical = os.path.exists(lexical_path)
+        self.attributes = None
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            if self.rerank:
+                conn.execute("ATTACH DATABASE ? AS vec", (f"file:{vectors_path}?mode=ro&immutable=1",))
+            if self.has_lexical:
+                conn.execute("ATTACH DATABASE ? AS lex", (f"file:{lexical_path}?mode=ro&immutable=1",))
+            self._pool.put(conn)
+
+        attributes_path = os.path.join(path, ATTRIBUTES_FILE)
+        if os.path.exists(attributes_path):
+            self.attributes = AttributeIndex(attributes_path, self._with_connection(load_verdicts))
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def kind(self):
+        return index_kind(self.index)
+
+    @property
+    def quantization(self):
+        return index_quantization(self.index)
+
+    def _with_connection(self, fn, *args):
+        conn = self._pool.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._pool.put(conn)
+
+    def documents(self, row_ids):
+        return self._with_connection(fetch_documents, row_ids)
+
+    def _lexical_search(self, text, limit):
+        with timed("lexical_search"):
+            return self._with_connection(lexical_search, text, limit)
+
+    def _rerank(self, vectors, labels, k):
+        """
+        Re-orders candidate labels by exact distance to the query vectors.
+        """
+        candidates = sorted({int(label) for label in labels.ravel() if label >= 0})
+        found, full = self._with_connection(fetch_vectors, candidates)
+        position = {row_id: i for i, row_id in enumerate(found)}
+
+        out_labels = np.full((len(vectors), k), -1, dtype=np.int64)
+        out_distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        for i, (query, row_labels) in enumerate(zip(vectors, labels)):
+            rows = [int(label) for label in row_labels if int(label) in position]
+            if not rows:
+                continue
+            exact = ((full[[position[row] for row in rows]] - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            out_labels[i, :len(best)] = np.array(rows)[best]
+            out_distances[i, :len(best)] = exact[best]
+        return out_distances, out_labels
+
+    def _allowed(self, search_filter):
+        """
+        Row ids a filter lets through, or None when there is nothing to filter.
+        """
+        if search_filter is None or search_filter.is_empty():
+            return None
+        if self.attributes is None:
+            raise ValueError("This index version has no attribute index; rebuild it to use filters.")
+        return self.attributes.row_ids(search_filter)
+
+    def _search(self, vectors, k, nprobe=None, ef_search=None, allowed=None):
+        if allowed is not None and len(allowed) <= FILTER_EXACT_MAX:
+            return self._exact_search(vectors, allowed, k)
+
+        selector = self.attributes.selector(allowed) if allowed is not None else None
+        params = search_parameters(self.index, nprobe, ef_search, selector)
+        if self.rerank:
+            _, candidates = self.index.search(vectors, k * RERANK_FACTOR, params=params)
+            return self._rerank(vectors, candidates, k)
+        return self.index.search(vectors, k, params=params)
+
+    def _vectors(self, row_ids):
+        """
+        (row ids, vectors) for row_ids, exact when the vectors were shipped with the index.
+        """
+        if self.rerank:
+            row_ids, stored = self._with_connection(fetch_vectors, list(row_ids))
+            return row_ids, stored
+        row_ids = [int(row_id) for row_id in row_ids]
+        return row_ids, self.index.reconstruct_batch(np.array(row_ids, dtype=np.int64))
+
+    def _exact_search(self, vectors, row_ids, k):
+        """
+        Brute force over just row_ids, for filters selective enough that it beats the index.
+        """
+        labels = np.full((len(vectors), k), -1, dtype=np.int64)
+        distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        if len(row_ids) == 0:
+            return distances, labels
+        row_ids, stored = self._vectors(row_ids)
+        if stored is None:
+            return distances, labels
+        row_ids = np.array(row_ids, dtype=np.int64)
+        # ‖q‖² - 2·q·s + ‖s‖² as one matmul: a Q×N matrix instead of a Q×N×d temporary
+        exact = (
+            (vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ stored.T + (stored ** 2).sum(axis=1)[None, :]
+        )
+        np.maximum(exact, 0, out=exact)
+        take = min(k, exact.shape[1])
+        best = np.argpartition(exact, take - 1, axis=1)[:, :take]
+        order = np.argsort(np.take_along_axis(exact, best, axis=1), axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        labels[:, :take] = row_ids[best]
+        distances[:, :take] = np.take_along_axis(exact, best, axis=1)
+        return distances, labels
+
+    def distances(self, vector, row_ids):
+        """
+        Squared L2 distances from vector to row_ids.
+        """
+        row_ids, stored = self._vectors(row_ids)
+        if stored is None:
+            return {}
+        return dict(zip(row_ids, ((stored - vector) ** 2).sum(axis=1).tolist()))
+
+    def search_by_vectors(self, vectors, k, nprobe=None, ef_search=None, search_filter=None):
+        """
+        Returns, for each query vector, up to k (Document, score) pairs, best first.
+        Scores are squared L2 distances, like LangChain's FAISS store.
+        nprobe (IVF) and ef_search (HNSW) trade recall for speed; other index types ignore them.
+        search_filter (a SearchFilter) is applied inside the search, so k hits come back
+        whenever k chunks match it.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.index.d)
+        distances, labels = self._search(vectors, k, nprobe, ef_search, self._allowed(search_filter))
+        wanted = {int(label) for label in labels.ravel() if label >= 0}
+        docs = self.documents(sorted(wanted))
+        return [
+            [(docs[int(label)], float(score)) for label, score in zip(row_labels, row_scores) if int(label) in docs]
+            for row_labels, row_scores in zip(labels, distances)
+        ]
+
+    def search_by_vector(self, vector, k, nprobe=None, ef_search=None, search_filter=None):
+        return self.search_by_vectors([vector], k, nprobe, ef_search, search_filter)[0]
+
+    def hybrid_search(self, text, vector, k, max_distance=None, nprobe=None, ef_search=None,
+                      search_filter=None, candidates=HYBRID_CANDIDATES):
+        """
+        Fuses keyword (BM25) and vector rankings with reciprocal rank fusion and returns
+        up to k (Document, score) pairs in fused order. Scores stay squared L2 distances.
+        max_distance applies to keyword matches as well, by their vector distance, so
+        nothing beyond the caller's threshold comes back. Falls back to the nearest
+        chunk when nothing qualifies, like filter_by_threshold.
+        """
+        return self.hybrid_search_many(
+            [text], [vector], k, max_distance, nprobe, ef_search, search_filter, candidates
+        )[0]
+
+    def hybrid_candidates(self, texts, vectors, k, nprobe=None, ef_search=None, search_filter=None,
+                          candidates=HYBRID_CANDIDATES):
+        """
+        The two rankings hybrid search fuses, per query: ({row id: distance} of the
+        nearest max(k, candidates) chunks, nearest first, [(row id, BM25 score)] of the
+        keyword hits, best first). The keyword searches run alongside the vector search.
+        """
+        allowed = self._allowed(search_filter)
+        # Keyword hits are filtered afterwards, so look a bit deeper when filtering
+        lexical_limit = candidates * 4 if allowed is not None else candidates
+        # Run in a copy of the caller's context so the stage lands in its request timings
+        lexical = [
+            lexical_executor.submit(contextvars.copy_context().run, self._lexical_search, text, lexical_limit)
+            for text in texts
+        ]
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.index.d)
+        distances, labels = self._search(vectors, max(k, candidates), nprobe, ef_search, allowed)
+
+        results = []
+        for row_labels, row_distances, future in zip(labels, distances, lexical):
+            lexical_hits = future.result()
+            if allowed is not None and lexical_hits:
+                keep = np.isin([row_id for row_id, _ in lexical_hits], allowed)
+                lexical_hits = [hit for hit, kept in zip(lexical_hits, keep) if kept][:candidates]
+            distance = {int(label): float(score) for label, score in zip(row_labels, row_distances) if label >= 0}
+            results.append((distance, lexical_hits))
+        return results
+
+    def hybrid_search_many(self, texts, vectors, k, max_distance=None, nprobe=None, ef_search=None,
+                           search_filter=None, candidates=HYBRID_CANDIDATES):
+        """
+        hybrid_search for a batch of queries: one matrix vector search and one docstore
+        read for all of them, with the keyword searches running alongside.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.index.d)
+        results = self.hybrid_candidates(texts, vectors, k, nprobe, ef_search, search_filter, candidates)
+
+        rankings = []
+        for vector, (distance, lexical_hits) in zip(vectors, results):
+            lexical_distance = {}
+            if max_distance is not None:
+                # Keyword-only hits need their vector distance to be held to the threshold
+                missing = [row for row, _ in lexical_hits if row not in distance]
+                lexical_distance = self.distances(vector, missing) if missing else {}
+            fused = fuse_rankings(distance, lexical_hits, k, max_distance, lexical_distance)
+            distance.update(lexical_distance)
+            missing = [row for row in fused if row not in distance]
+            if missing:
+                distance.update(self.distances(vector, missing))
+            rankings.append((fused, distance))
+
+        docs = self.documents(sorted({row for fused, _ in rankings for row in fused}))
+        return [[(docs[row], distance[row]) for row in fused if row in docs] for fused, distance in rankings]
+
+
+def fuse_rankings(distance, lexical_hits, k, max_distance=None, lexical_distance=None):
+    """
+    Top k ids after reciprocal rank fusion of the vector candidates ({id: distance},
+    nearest first) and the keyword hits, both within max_distance. Keyword hits that
+    aren't vector candidates are looked up in lexical_distance. Falls back to the
+    nearest candidate when nothing qualifies.
+    """
+    vector_ranking = [row for row, score in distance.items() if max_distance is None or score <= max_distance]
+    if max_distance is not None:
+        lexical_distance = lexical_distance or {}
+        lexical_hits = [
+            (row, score) for row, score in lexical_hits
+            if distance.get(row, lexical_distance.get(row, math.inf)) <= max_distance
+        ]
+    fused = reciprocal_rank_fusion([vector_ranking, [row for row, _ in lexical_hits]])[:k]
+    if not fused and distance:
+        fused = [next(iter(distance))]
+    return fused
+
+
+class LegacyIndex:
+    """
+    Same search interface over an index saved by LangChain (index.faiss + index.pkl).
+    """
+
+    def __init__(self, path, embeddings):
+        self.path = path
+        self.db = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        self.index = self.db.index
+
+    kind = "flat"
+    quantization = "none"
+    has_lexical = False
+    attributes = None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def search_by_vectors(self, vectors, k, nprobe=None, ef_search=None, search_filter=None):
+        return [self.search_by_vector(vector, k, search_filter=search_filter) for vector in vectors]
+
+    def search_by_vector(self, vector, k, nprobe=None, ef_search=None, search_filter=None):
+        if search_filter is not None and not search_filter.is_empty():
+            raise ValueError("Filters need an index built by build_index, not a LangChain one.")
+        return self.db.similarity_search_with_score_by_vector(list(vector), k=k)
+
+
+def load_index(path, embeddings):
+    if is_compact_index(path):
+        return CompactIndex(path)
+    return LegacyIndex(path, embeddings)
+
+
+class IndexWriter:
+    """
+    Write side used by build_index. Keeps index.faiss, the docstore, the stored vectors
+    and the keyword index in step. Works on a private copy of an index version:
+
+        writer = IndexWriter.open(snapshot_dir, work_dir)  # or IndexWriter.create(work_dir)
+        writer.remove(chunk_ids)
+        writer.add(chunk_ids, documents, vectors)
+        writer.save()
+
+    index_type and quantization are what save() writes. Changes the index can't take
+    in place (switching type or quantization, removing from HNSW, retraining) go through
+    a flat working copy that save() rebuilds from the exact vectors in vectors.sqlite.
+    Filterable attributes live in the docstore and are exported to attributes.npy by save().
+    """
+
+    def __init__(self, path, index, conn, index_type=None, quantization=None):
+        self.path = path
+        self.index = index
+        self.conn = conn
+        conn.execute("ATTACH DATABASE ? AS vec", (os.path.join(path, VECTORS_FILE),))
+        conn.executescript(VECTORS_SCHEMA)
+        conn.execute("ATTACH DATABASE ? AS lex", (os.path.join(path, LEXICAL_FILE),))
+        conn.executescript(LEXICAL_SCHEMA)
+        conn.executescript(ATTRIBUTES_SCHEMA)
+        self.next_row_id = int(self._meta("next_row_id", 0))
+        self.trained_on = int(self._meta("trained_on", 0))
+        self.index_type = index_type or (index_kind(index) if index is not None else INDEX_TYPE)
+        self.quantization = quantization or (index_quantization(index) if index is not None else INDEX_QUANTIZATION)
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {self.index_type!r}, expected one of {INDEX_TYPES}")
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {self.quantization!r}, expected one of {QUANTIZATIONS}")
+        if self.ntotal and not conn.execute("SELECT COUNT(*) FROM vec.vectors").fetchone()[0]:
+            self._backfill_vectors()
+        if self.ntotal and not conn.execute("SELECT COUNT(*) FROM lex.chunk_terms").fetchone()[0]:
+            self._backfill_terms()
+        if self.ntotal and not conn.execute("SELECT COUNT(*) FROM attributes").fetchone()[0]:
+            self._backfill_attributes()
+
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _backfill_vectors(self):
+        # Versions written before vectors.sqlite existed were never quantized, so this is exact
+        if index_quantization(self.index) != "none":
+            print("⚠️ No stored vectors for a quantized index, rebuilding from approximate vectors.")
+        row_ids = [row[0] for row in self.conn.execute("SELECT row_id FROM chunks ORDER BY row_id")]
+        vectors = self.index.reconstruct_batch(np.array(row_ids, dtype=np.int64))
+        self.conn.executemany(
+            "INSERT INTO vec.vectors (row_id, vector) VALUES (?, ?)",
+            [(row_id, vector.tobytes()) for row_id, vector in zip(row_ids, vectors)]
+        )
+
+    def _backfill_terms(self):
+        print("🔤 Building the keyword index for existing chunks...")
+        rows = self.conn.execute("SELECT row_id, page_content, metadata FROM chunks").fetchall()
+        index_terms(self.conn, [
+            (row_id, Document(page_content=content, metadata=json.loads(metadata)))
+            for row_id, content, metadata in rows
+        ])
+
+    def _backfill_attributes(self):
+        # Older chunks carry their verdict but no publication date until they are re-indexed
+        self.conn.executemany(
+            "INSERT INTO attributes (row_id, verdict, published, article_id) VALUES (?, ?, ?, ?)",
+            [
+                chunk_attributes(row_id, json.loads(metadata))
+                for row_id, metadata in self.conn.execute("SELECT row_id, metadata FROM chunks")
+            ]
+        )
+
+    @classmethod
+    def create(cls, path, dimension=None, index_type=None, quantization=None):
+        os.makedirs(path, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(path, DOCSTORE_FILE))
+        conn.executescript(DOCSTORE_SCHEMA)
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension)) if dimension else None
+        return cls(path, index, conn, index_type or INDEX_TYPE, quantization or INDEX_QUANTIZATION)
+
+    @classmethod
+    def open(cls, source_path, path, embeddings=None, index_type=None, quantization=None, vectors_path=None):
+        """
+        Copies the version at source_path into path and opens it for writing.
+        Indexes saved by LangChain are converted on the way. index_type and
+        quantization default to those of the source index. vectors_path points at
+        the version's vectors.sqlite when it wasn't shipped with the index.
+        """
+        if not is_compact_index(source_path):
+            return cls.from_langchain(LegacyIndex(source_path, embeddings).db, path, index_type, quantization)
+
+        os.makedirs(path, exist_ok=True)
+        for fname in (INDEX_FILE, DOCSTORE_FILE):
+            shutil.copyfile(os.path.join(source_path, fname), os.path.join(path, fname))
+        vectors_path = vectors_path or os.path.join(source_path, VECTORS_FILE)
+        if os.path.exists(vectors_path):
+            shutil.copyfile(vectors_path, os.path.join(path, VECTORS_FILE))
+        if os.path.exists(os.path.join(source_path, LEXICAL_FILE)):
+            shutil.copyfile(os.path.join(source_path, LEXICAL_FILE), os.path.join(path, LEXICAL_FILE))
+        index = faiss.read_index(os.path.join(path, INDEX_FILE))
+        conn = sqlite3.connect(os.path.join(path, DOCSTORE_FILE))
+        return cls(path, index, conn, index_type, quantization)
+
+    @classmethod
+    def from_langchain(cls, db, path, index_type=None, quantization=None):
+        print(f"🔧 Converting LangChain index ({db.index.ntotal} vectors) to the compact format...")
+        writer = cls.create(path, db.index.d, index_type, quantization)
+        positions = sorted(db.index_to_docstore_id)
+        vectors = db.index.reconstruct_n(0, db.index.ntotal)
+        chunk_ids = [db.index_to_docstore_id[position] for position in positions]
+        documents = [db.docstore.search(chunk_id) for chunk_id in chunk_ids]
+        writer.add(chunk_ids, documents, vectors[positions])
+        return writer
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def chunk_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT chunk_id FROM chunks")}
+
+    def chunk_ids_for_sources(self, sources):
+        """
+        Chunk ids whose metadata "source" is one of sources (one pass over the docstore).
+        """
+        found = []
+        for chunk_id, metadata in self.conn.execute("SELECT chunk_id, metadata FROM chunks"):
+            if json.loads(metadata).get("source") in sources:
+                found.append(chunk_id)
+        return found
+
+    def add(self, chunk_ids, documents, vectors):
+        if not chunk_ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = build_faiss_index("flat", vectors[:0], [])
+
+        row_ids = np.arange(self.next_row_id, self.next_row_id + len(chunk_ids), dtype=np.int64)
+        self.conn.executemany(
+            "INSERT INTO chunks (row_id, chunk_id, page_content, metadata) VALUES (?, ?, ?, ?)",
+            [
+                (int(row_id), chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                for row_id, chunk_id, doc in zip(row_ids, chunk_ids, documents)
+            ]
+        )
+        self.conn.executemany(
+            "INSERT INTO vec.vectors (row_id, vector) VALUES (?, ?)",
+            [(int(row_id), vector.tobytes()) for row_id, vector in zip(row_ids, vectors)]
+        )
+        index_terms(self.conn, zip(row_ids, documents))
+        self.conn.executemany(
+            "INSERT INTO attributes (row_id, verdict, published, article_id) VALUES (?, ?, ?, ?)",
+            [chunk_attributes(row_id, doc.metadata) for row_id, doc in zip(row_ids, documents)]
+        )
+        self.index.add_with_ids(vectors, row_ids)
+        self.next_row_id += len(chunk_ids)
+
+    def remove(self, chunk_ids):
+        """
+        Removes chunk_ids that exist; returns how many were removed.
+        """
+        row_ids = []
+        for start in range(0, len(chunk_ids), 500):
+            batch = list(chunk_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            row_ids.extend(
+                row[0] for row in self.conn.execute(
+                    f"SELECT row_id FROM chunks WHERE chunk_id IN ({placeholders})", batch
+                )
+            )
+        if not row_ids:
+            return 0
+
+        kind = index_kind(self.index)
+        if kind == "hnsw":
+            # HNSW graphs don't support deletion: continue on a flat copy, rebuilt by save()
+            self.index = self._rebuild("flat")
+        removed = np.array(row_ids, dtype=np.int64)
+        if kind == "ivf":
+            # The IVF hashtable direct map only accepts an explicit id array
+            self.index.remove_ids(faiss.IDSelectorArray(len(removed), faiss.swig_ptr(removed)))
+        else:
+            self.index.remove_ids(faiss.IDSelectorBatch(removed))
+        self.conn.executemany("DELETE FROM chunks WHERE row_id = ?", [(row_id,) for row_id in row_ids])
+        self.conn.executemany("DELETE FROM vec.vectors WHERE row_id = ?", [(row_id,) for row_id in row_ids])
+        self.conn.executemany("DELETE FROM attributes WHERE row_id = ?", [(row_id,) for row_id in row_ids])
+        remove_terms(self.conn, row_ids)
+        return len(row_ids)
+
+    def _rebuild(self, index_type, quantization="none"):
+        row_ids = []
+        vectors = []
+        for row_id, blob in self.conn.execute("SELECT row_id, vector FROM vec.vectors ORDER BY row_id"):
+            row_ids.append(row_id)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        vectors = np.stack(vectors) if vectors else np.zeros((0, self.index.d), dtype=np.float32)
+        return build_faiss_index(index_type, vectors, row_ids, quantization)
+
+    def _is_trained_type(self):
+        return self.index_type == "ivf" or self.quantization != "none"
+
+    def _needs_rebuild(self):
+        if index_kind(self.index) != self.index_type or index_quantization(self.index) != self.quantization:
+            return True
+        # Clusters and codebooks trained on a much smaller corpus fit the new data poorly
+        return self._is_trained_type() and self.index.ntotal > INDEX_RETRAIN_GROWTH * max(self.trained_on, 1)
+
+    def save(self):
+        if self.index is not None and self.index.ntotal and self._needs_rebuild():
+            label = self.index_type if self.quantization == "none" else f"{self.index_type}/{self.quantization}"
+            print(f"🔧 Building {label} index over {self.index.ntotal} vectors...")
+            self.index = self._rebuild(self.index_type, self.quantization)
+            if self._is_trained_type():
+                self.trained_on = self.index.ntotal
+
+        verdicts = export_attributes(self.conn, os.path.join(self.path, ATTRIBUTES_FILE))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [
+                ("next_row_id", str(self.next_row_id)), ("trained_on", str(self.trained_on)),
+                ("index_type", self.index_type), ("quantization", self.quantization),
+                ("verdicts", json.dumps(verdicts, ensure_ascii=False))
+            ]
+        )
+        optimize_terms(self.conn)
+        self.conn.commit()
+        # Readers open the files read-only and immutable: fold the journals in and compact them
+        self.conn.execute("VACUUM")
+        self.conn.execute("VACUUM vec")
+        self.conn.execute("VACUUM lex")
+        self.conn.close()
+
+        index_file = os.path.join(self.path, INDEX_FILE)
+        faiss.write_index(self.index, index_file)
+        if self.index.ntotal:
+            size = os.path.getsize(index_file)
+            raw = self.index.ntotal * self.index.d * 4
+            print(
+                f"🗜️ {INDEX_FILE}: {size / 1024 / 1024:.1f} MB for {self.index.ntotal} vectors "
+                f"(compression {raw / size:.1f}:1 against raw float32)"
+            )
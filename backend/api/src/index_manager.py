@@ -0,0 +1,214 @@
+from langchain_core.retrievers import BaseRetriever
+from langchain_openai import OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
+from langchain.chains.qa_with_sources import load_qa_with_sources_chain
+from api.src.embedding_cache import CachedQueryEmbeddings, query_embedding_cache
+from api.src.index_store import load_index_manifest, fetch_index
+from api.src.sharded_index import load_index
+from api.src.metrics import instrument_s3, timed, registry, TokenUsageCallback
+from pydantic import ConfigDict
+from typing import Any
+from dotenv import load_dotenv
+from datetime import datetime
+import os
+import json
+import boto3
+import tempfile
+import threading
+
+load_dotenv()
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = "index/"  # The folder in S3 where index files are stored
+S3_VERSION_KEY = f"{S3_PREFIX}version.json"  # legacy, before versioned snapshots
+
+# How often (in seconds) the backend checks S3 for a newer index. 0 disables polling.
+INDEX_REFRESH_SECONDS = int(os.getenv("INDEX_REFRESH_SECONDS", "300"))
+
+s3 = instrument_s3(boto3.client("s3"))
+
+index_vectors = registry.gauge("index_vectors", "Vectors in the loaded index.")
+index_size_bytes = registry.gauge("index_size_bytes", "On-disk size of the loaded index version, by file.", ("file",))
+index_loaded_timestamp = registry.gauge("index_loaded_timestamp_seconds", "When the loaded index version was swapped in.")
+
+
+def record_index_size(index):
+    index_vectors.set(index.ntotal)
+    # Shards have the same files: report the total per file name
+    sizes = {}
+    for root, _, names in os.walk(index.path):
+        for name in names:
+            sizes[name] = sizes.get(name, 0) + os.path.getsize(os.path.join(root, name))
+    for name, size in sizes.items():
+        index_size_bytes.set(size, file=name)
+
+
+def download_index_from_s3(target_dir):
+    """
+    Downloads an index published in the legacy flat layout under index/.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_PREFIX):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            filename = os.path.join(target_dir, os.path.basename(key))
+            s3.download_file(S3_BUCKET, key, filename)
+
+
+def fetch_remote_version():
+    """
+    Returns the version of an index in the legacy flat layout: the one in version.json,
+    or the ETag of index.faiss for indexes published before version.json existed.
+    """
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=S3_VERSION_KEY)
+        return json.loads(obj["Body"].read().decode("utf-8"))["version"]
+    except s3.exceptions.NoSuchKey:
+        pass
+
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}index.faiss")
+        return head["ETag"].strip('"')
+    except Exception as e:
+        print(f"⚠️ Could not determine index version: {e}")
+        return None
+
+
+class SnapshotRetriever(BaseRetriever):
+    """
+    LangChain retriever over a loaded index, for the chains used by the CLI.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    embeddings: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        vector = self.embeddings.embed_query(query)
+        return [doc for doc, _ in self.index.search_by_vector(vector, self.k)]
+
+
+class IndexSnapshot:
+    """
+    Everything needed to answer a query against one index version.
+    Snapshots are never mutated, so a request keeps using the one it started with
+    even if a newer version is swapped in while it is running.
+    """
+
+    def __init__(self, index, embeddings, chain, version):
+        self.index = index
+        self.embeddings = embeddings
+        self.retriever = SnapshotRetriever(index=index, embeddings=embeddings, k=3)
+        self.chain = chain
+        self.version = version
+        self.loaded_at = datetime.now()
+
+
+class IndexManager:
+    def __init__(self):
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """
+        Registers callback(snapshot), called after every swap to a new index version.
+        """
+        self._listeners.append(callback)
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else None
+
+    @property
+    def loaded_at(self):
+        snapshot = self._snapshot
+        return snapshot.loaded_at if snapshot else None
+
+    def current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("FAISS index is not loaded yet.")
+        return snapshot
+
+    def refresh(self, force=False):
+        """
+        Loads the published index if its version differs from the one in memory.
+        Returns True when a new snapshot was swapped in.
+        """
+        with self._refresh_lock:
+            manifest, _ = load_index_manifest()
+            version = manifest["version"] if manifest else fetch_remote_version()
+            current = self._snapshot
+            if not force and current is not None and version == current.version:
+                return False
+
+            snapshot = self._load(version, manifest)
+            # Plain reference assignment: in-flight requests keep their old snapshot.
+            self._snapshot = snapshot
+        index_loaded_timestamp.set(snapshot.loaded_at.timestamp())
+
+        print(f"🔄 Loaded FAISS index version {version}")
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"⚠️ Index swap listener failed: {e}")
+        return True
+
+    def _load(self, version, manifest=None):
+        # The query cache outlives snapshots: query vectors don't depend on the index version
+        embeddings = CachedQueryEmbeddings(OpenAIEmbeddings(), query_embedding_cache)
+
+        if manifest:
+            # Served from the local cache when this version was downloaded before.
+            # Vectors are memory-mapped and chunks read from SQLite on demand.
+            index_dir = fetch_index(manifest)
+            with timed("index_load"):
+                index = load_index(index_dir, embeddings)
+            record_index_size(index)
+        else:
+            with tempfile.TemporaryDirectory() as index_dir:
+                with timed("index_download"):
+                    download_index_from_s3(index_dir)
+                with timed("index_load"):
+                    index = load_index(index_dir, embeddings)
+                record_index_size(index)
+
+        # stream_usage makes streamed answers report their token usage too
+        llm = ChatOpenAI(
+            temperature=0, model_name="gpt-4.1-nano", stream_usage=True, callbacks=[TokenUsageCallback()]
+        )
+        chain = load_qa_with_sources_chain(llm, chain_type="stuff")
+        return IndexSnapshot(index, embeddings, chain, version)
+
+    def start_polling(self, interval=INDEX_REFRESH_SECONDS):
+        if interval <= 0 or self._poller is not None:
+            return
+
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"⚠️ Index refresh failed: {e}")
+
+        self._stop.clear()
+        self._poller = threading.Thread(target=poll, name="index-refresh", daemon=True)
+        self._poller.start()
+
+    def stop_polling(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+
+index_manager = IndexManager()
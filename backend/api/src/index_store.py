@@ -0,0 +1,274 @@
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from api.src.article_store import is_precondition_failure
+from api.src.metrics import instrument_s3, record_stage
+from api.src.shared_paths import SHARED_DIR
+import os
+import json
+import time
+import shutil
+import tempfile
+import boto3
+
+# Every build is published as an immutable snapshot under index/versions/<version>/.
+# index/manifest.json points at the current one and is written last, so readers only
+# ever see complete snapshots. index/manifests/ keeps the manifests of recent versions.
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_INDEX_PREFIX = "index/"
+S3_MANIFEST_KEY = f"{S3_INDEX_PREFIX}manifest.json"
+S3_VERSIONS_PREFIX = f"{S3_INDEX_PREFIX}versions/"
+S3_MANIFEST_HISTORY_PREFIX = f"{S3_INDEX_PREFIX}manifests/"
+
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", os.path.join(SHARED_DIR, "cache", "index"))
+# Published versions kept in S3, and versions kept in the local cache
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+INDEX_CACHE_KEEP_VERSIONS = int(os.getenv("INDEX_CACHE_KEEP_VERSIONS", "2"))
+INDEX_TRANSFER_CONCURRENCY = int(os.getenv("INDEX_TRANSFER_CONCURRENCY", "8"))
+
+transfer_config = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=INDEX_TRANSFER_CONCURRENCY
+)
+
+s3 = instrument_s3(boto3.client("s3"))
+
+
+class ConcurrentPublishError(RuntimeError):
+    pass
+
+
+def new_version():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def load_index_manifest():
+    """
+    Returns (manifest, etag), or (None, None) if no versioned index was published yet.
+    """
+    try:
+        obj = s3.get_object(Bucket=S3_BUCKET, Key=S3_MANIFEST_KEY)
+        return json.loads(obj["Body"].read().decode("utf-8")), obj.get("ETag")
+    except s3.exceptions.NoSuchKey:
+        return None, None
+
+
+def _upload(local_path, key):
+    s3.upload_file(local_path, S3_BUCKET, key, Config=transfer_config)
+    head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    return {"key": key, "etag": head["ETag"].strip('"'), "size": os.path.getsize(local_path)}
+
+
+def _upload_all(files, version):
+    """
+    files: {relative path: local path}. Returns {relative path: object entry}.
+    """
+    prefix = f"{S3_VERSIONS_PREFIX}{version}/"
+    with ThreadPoolExecutor(max_workers=INDEX_TRANSFER_CONCURRENCY) as executor:
+        entries = executor.map(lambda item: (item[0], _upload(item[1], prefix + item[0])), files.items())
+        return dict(entries)
+
+
+def publish_index(local_dir, metadata=None, previous_etag=None, reuse=None, **extra):
+    """
+    Uploads every file under local_dir (plus the metadata files, which readers don't
+    download) as a new version, then switches index/manifest.json to it.
+    reuse ({"files": {...}, "metadata": {...}}) lists object entries of earlier versions
+    that belong to the new one unchanged: they are referenced, not uploaded again.
+    The switch fails with ConcurrentPublishError if another build published in between.
+    """
+    version = new_version()
+
+    files = {}
+    for root, _, names in os.walk(local_dir):
+        for name in names:
+            full_path = os.path.join(root, name)
+            files[os.path.relpath(full_path, local_dir).replace(os.sep, "/")] = full_path
+
+    manifest = {
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "files": {**(reuse or {}).get("files", {}), **_upload_all(files, version)},
+        "metadata": {**(reuse or {}).get("metadata", {}), **_upload_all(metadata or {}, f"{version}/metadata")},
+        **extra
+    }
+    body = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+    s3.put_object(Bucket=S3_BUCKET, Key=f"{S3_MANIFEST_HISTORY_PREFIX}{version}.json", Body=body)
+
+    condition = {"IfMatch": previous_etag} if previous_etag else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(Bucket=S3_BUCKET, Key=S3_MANIFEST_KEY, Body=body, **condition)
+    except ClientError as e:
+        if is_precondition_failure(e):
+            raise ConcurrentPublishError("Another build published a new index version first.") from e
+        raise
+
+    prune_versions()
+    return version
+
+
+def load_index_metadata(manifest, name):
+    entry = manifest.get("metadata", {}).get(name)
+    if entry is None:
+        return None
+    obj = s3.get_object(Bucket=S3_BUCKET, Key=entry["key"])
+    return json.loads(obj["Body"].read().decode("utf-8"))
+
+
+def download_index_metadata(manifest, name, local_path):
+    """
+    Downloads a metadata file too large to load as JSON. Returns local_path, or None if
+    the version has no such file.
+    """
+    entry = manifest.get("metadata", {}).get(name)
+    if entry is None:
+        return None
+    s3.download_file(S3_BUCKET, entry["key"], local_path, ExtraArgs={"IfMatch": entry["etag"]}, Config=transfer_config)
+    return local_path
+
+
+def prune_versions(keep=INDEX_KEEP_VERSIONS):
+    """
+    Deletes published versions older than the newest keep, except for objects
+    a kept manifest still refers to.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    history = []
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_MANIFEST_HISTORY_PREFIX):
+        history.extend(obj["Key"] for obj in page.get("Contents", []))
+    history.sort()
+    if len(history) <= keep:
+        return
+
+    referenced = set()
+    for key in history[-keep:]:
+        manifest = json.loads(s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read().decode("utf-8"))
+        for section in ("files", "metadata"):
+            referenced.update(entry["key"] for entry in manifest.get(section, {}).values())
+
+    doomed = []
+    for key in history[:-keep]:
+        version = key[len(S3_MANIFEST_HISTORY_PREFIX):-len(".json")]
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{S3_VERSIONS_PREFIX}{version}/"):
+            doomed.extend(obj["Key"] for obj in page.get("Contents", []) if obj["Key"] not in referenced)
+        doomed.append(key)
+
+    for start in range(0, len(doomed), 1000):
+        s3.delete_objects(
+            Bucket=S3_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in doomed[start:start + 1000]]}
+        )
+    print(f"🧹 Pruned {len(history) - keep} old index versions.")
+
+
+def _fetch_object(entry, objects_dir):
+    """
+    Downloads one object into the content-addressed cache, unless it is already there.
+    """
+    path = os.path.join(objects_dir, entry["etag"])
+    if os.path.exists(path) and os.path.getsize(path) == entry["size"]:
+        return path, False
+
+    fd, tmp_path = tempfile.mkstemp(dir=objects_dir, prefix=".download-")
+    os.close(fd)
+    try:
+        # IfMatch makes S3 refuse the download if the object isn't the version the manifest names
+        s3.download_file(S3_BUCKET, entry["key"], tmp_path, ExtraArgs={"IfMatch": entry["etag"]}, Config=transfer_config)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, True
+
+
+def fetch_index_files(manifest, rel_paths, target_dir, cache_dir=INDEX_CACHE_DIR):
+    """
+    Places just rel_paths of manifest's version under target_dir, through the object
+    cache, for builds that only need part of a version. Returns target_dir.
+    """
+    objects_dir = os.path.join(cache_dir, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+    entries = [(rel_path, manifest["files"][rel_path]) for rel_path in rel_paths]
+    with ThreadPoolExecutor(max_workers=INDEX_TRANSFER_CONCURRENCY) as executor:
+        results = list(executor.map(lambda item: _fetch_object(item[1], objects_dir), entries))
+    for (rel_path, _), (object_path, _) in zip(entries, results):
+        target = os.path.join(target_dir, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(object_path, target)
+    return target_dir
+
+
+def fetch_index(manifest, cache_dir=INDEX_CACHE_DIR):
+    """
+    Returns a local directory holding the files of manifest's version. Objects are
+    cached on disk by ETag, so only files that changed since a cached version are
+    downloaded, all in parallel. The directory must be treated as read-only.
+    """
+    objects_dir = os.path.join(cache_dir, "objects")
+    versions_dir = os.path.join(cache_dir, "versions")
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(versions_dir, exist_ok=True)
+
+    version_dir = os.path.join(versions_dir, manifest["version"])
+    if os.path.isdir(version_dir):
+        os.utime(version_dir)
+        return version_dir
+
+    started = time.perf_counter()
+    entries = list(manifest["files"].items())
+    with ThreadPoolExecutor(max_workers=INDEX_TRANSFER_CONCURRENCY) as executor:
+        results = list(executor.map(lambda item: _fetch_object(item[1], objects_dir), entries))
+
+    # Assemble the version directory next to the cache and move it in atomically
+    staging = tempfile.mkdtemp(dir=versions_dir, prefix=".staging-")
+    for (rel_path, _), (object_path, _) in zip(entries, results):
+        target = os.path.join(staging, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(object_path, target)
+        except OSError:
+            shutil.copyfile(object_path, target)
+    try:
+        os.rename(staging, version_dir)
+    except OSError:
+        # Another worker assembled the same version first
+        shutil.rmtree(staging, ignore_errors=True)
+
+    downloaded = [entry for (_, entry), (_, fetched) in zip(entries, results) if fetched]
+    size = sum(entry["size"] for entry in downloaded)
+    elapsed = time.perf_counter() - started
+    record_stage("index_download", elapsed)
+    print(
+        f"⬇️ Index {manifest['version']}: downloaded {len(downloaded)}/{len(entries)} files "
+        f"({size / 1024 / 1024:.1f} MB) in {elapsed:.1f}s"
+    )
+    prune_local_cache(cache_dir, keep_version=manifest["version"])
+    return version_dir
+
+
+def prune_local_cache(cache_dir=INDEX_CACHE_DIR, keep=INDEX_CACHE_KEEP_VERSIONS, keep_version=None):
+    """
+    Keeps the most recently used keep versions (and keep_version), then drops
+    cached objects no remaining version links to.
+    """
+    objects_dir = os.path.join(cache_dir, "objects")
+    versions_dir = os.path.join(cache_dir, "versions")
+    versions = [name for name in os.listdir(versions_dir) if not name.startswith(".")]
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(versions_dir, name)), reverse=True)
+
+    kept = set(versions[:keep]) | ({keep_version} if keep_version else set())
+    for name in versions:
+        if name not in kept:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+    referenced = set()
+    for name in kept:
+        for root, _, files in os.walk(os.path.join(versions_dir, name)):
+            for fname in files:
+                referenced.add(os.stat(os.path.join(root, fname)).st_ino)
+    for name in os.listdir(objects_dir):
+        path = os.path.join(objects_dir, name)
+        if not name.startswith(".") and os.stat(path).st_ino not in referenced:
+            os.remove(path)
@@ -0,0 +1,191 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from datetime import datetime, timezone
+from api.src.metrics import registry, record_stage
+from api.src.shared_paths import SHARED_DIR
+import multiprocessing
+import traceback
+import threading
+import uuid
+import sys
+import os
+
+# Long-running maintenance work (scraping, reindexing) runs in worker processes so
+# it never holds an HTTP worker or competes with /ask for the GIL. Each job type
+# has its own single-process pool: at most one job of a type runs at a time. A
+# request for a type that is already queued or running gets that job back when it
+# asks for the same parameters, and is refused (JobConflict) when it doesn't.
+JOB_LOG_DIR = os.getenv("JOB_LOG_DIR", os.path.join(SHARED_DIR, "jobs"))
+# Finished jobs kept for the status endpoint
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "50"))
+# Lines of job output returned as progress
+JOB_PROGRESS_LINES = int(os.getenv("JOB_PROGRESS_LINES", "20"))
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+def run_job(target, kwargs, log_path):
+    """
+    Entry point in the worker process: runs target(**kwargs) with its output going
+    to log_path, which the API reads back as progress. Returns (result, the metrics
+    recorded by this job), so they can be merged into the API's /metrics.
+    """
+    # Workers are reused: only report what this job recorded
+    registry.reset()
+    with open(log_path, "a", encoding="utf-8", buffering=1) as log:
+        sys.stdout = sys.stderr = log
+        try:
+            return target(**kwargs), registry.snapshot()
+        except Exception:
+            traceback.print_exc()
+            raise
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+
+def tail(path, lines):
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return [line.rstrip("\n") for line in f.readlines()[-lines:]]
+    except FileNotFoundError:
+        return []
+
+
+class JobConflict(RuntimeError):
+    def __init__(self, job):
+        super().__init__(
+            f"A {job.kind} job with other parameters ({job.kwargs}) is already {job.status}: {job.id}"
+        )
+        self.job = job
+
+
+class Job:
+    def __init__(self, kind, kwargs):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.created = now()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.log_path = os.path.join(JOB_LOG_DIR, f"{self.id}.log")
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self, progress_lines=JOB_PROGRESS_LINES):
+        return {
+            "job_id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "params": self.kwargs,
+            "created": self.created.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "result": self.result,
+            "error": self.error,
+            "progress": tail(self.log_path, progress_lines) if progress_lines else []
+        }
+
+
+class JobRunner:
+    """
+    Registry of background jobs. register() declares a job type with the function
+    the worker runs and an optional on_success(job, result) hook, which runs in the
+    API process before the job is reported as succeeded (e.g. to load a new index).
+    """
+
+    def __init__(self, history=JOB_HISTORY):
+        self.history = history
+        self._types = {}
+        self._executors = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        # Workers are spawned, not forked: the API process has threads and open indexes
+        self._context = multiprocessing.get_context("spawn")
+
+    def register(self, kind, target, on_success=None):
+        self._types[kind] = (target, on_success)
+
+    def _executor(self, kind):
+        if kind not in self._executors:
+            self._executors[kind] = ProcessPoolExecutor(max_workers=1, mp_context=self._context)
+        return self._executors[kind]
+
+    def submit(self, kind, **kwargs):
+        """
+        Queues a job of type kind and returns it, or returns the job of that type
+        that is already queued or running with the same kwargs. Raises JobConflict
+        when that job was started with other kwargs, e.g. a full rebuild requested
+        during an incremental reindex: retry once it has finished.
+        """
+        target, _ = self._types[kind]
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.kind == kind and job.active:
+                    if job.kwargs != kwargs:
+                        raise JobConflict(job)
+                    return job
+
+            job = Job(kind, kwargs)
+            self._jobs[job.id] = job
+            self._prune()
+            os.makedirs(JOB_LOG_DIR, exist_ok=True)
+            job.started = now()
+            job.status = "running"
+            future = self._executor(kind).submit(run_job, target, kwargs, job.log_path)
+        # Outside the lock: a job that is already done runs _finish right here
+        future.add_done_callback(lambda f: self._finish(job, f))
+        print(f"🛠️ Started {kind} job {job.id}")
+        return job
+
+    def _finish(self, job, future):
+        _, on_success = self._types[job.kind]
+        try:
+            result, metrics = future.result()
+            registry.merge(metrics)
+            if on_success is not None:
+                result = on_success(job, result)
+            job.result = result
+            job.status = "succeeded"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+            if isinstance(e, BrokenProcessPool):
+                # The worker died (e.g. out of memory): the next job gets a fresh one
+                with self._lock:
+                    self._executors.pop(job.kind, None)
+        job.finished = now()
+        record_stage(f"job_{job.kind.replace('-', '_')}", (job.finished - job.started).total_seconds())
+        print(f"{'✅' if job.status == 'succeeded' else '❌'} {job.kind} job {job.id} {job.status}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            job = self._jobs.pop(job_id)
+            try:
+                os.remove(job.log_path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+
+job_runner = JobRunner()
@@ -0,0 +1,132 @@
+import os
+import re
+import unicodedata
+
+# Keyword side of hybrid retrieval. Chunks are normalised here (accent folding,
+# Portuguese stop words, light stemming) and stored as plain term strings in an
+# SQLite FTS5 table, which keeps the inverted index and ranks matches with BM25.
+# The table lives in lexical.sqlite next to index.faiss, keyed by docstore row id.
+LEXICAL_FILE = "lexical.sqlite"
+LEXICAL_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS lex.chunk_terms USING fts5(terms, tokenize='unicode61 remove_diacritics 0');
+"""
+
+# Keyword + vector retrieval for indexes that have lexical.sqlite; vector-only otherwise
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+# Candidates taken from each retriever before fusion, and the reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+TOKEN_RE = re.compile(r"\w+")
+
+STOPWORDS = {
+    "a", "o", "as", "os", "ao", "aos", "um", "uma", "uns", "umas", "de", "da", "do", "das", "dos",
+    "e", "em", "no", "na", "nos", "nas", "num", "numa", "por", "pelo", "pela", "pelos", "pelas",
+    "para", "pra", "com", "sem", "sob", "que", "se", "ou", "mas", "como", "mais", "muito", "ja",
+    "foi", "ser", "sao", "esta", "este", "isto", "isso", "aquele", "aquela", "essa", "esse",
+    "ele", "ela", "eles", "elas", "seu", "sua", "seus", "suas", "lhe", "me", "te", "ha", "tem",
+    "entre", "ate", "quando", "onde", "qual", "quais", "the", "of", "and",
+}
+
+# Plural endings after accent folding, with the shortest stem each applies to
+# (meses -> mes, informacoes -> informacao, animais -> animal, but reis -> rei)
+PLURAL_RULES = (
+    ("eses", "es", 1), ("oes", "ao", 3), ("aes", "ao", 3), ("ais", "al", 3), ("eis", "el", 3),
+    ("ois", "ol", 3), ("ns", "m", 3), ("res", "r", 3), ("zes", "z", 3), ("les", "l", 3), ("s", "", 3),
+)
+DERIVATION_SUFFIXES = ("issimo", "issima", "mente", "zinho", "zinha", "inho", "inha")
+# A stressed final syllable marks a singular ending in s: português, país, após
+SINGULAR_S_ENDINGS = ("ás", "ês", "ís", "ós", "ús")
+
+
+def fold(text):
+    """
+    Lowercase and strip accents: "Eleições" -> "eleicoes".
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def stem(token):
+    """
+    Light Portuguese stemmer over a lowercase token: accent folding, plurals, a few
+    derivations and the final gender vowel. Numbers and short words are kept as they
+    are, since they are often what the question is about ("60 concelhos", "IVA").
+    """
+    singular = token.endswith(SINGULAR_S_ENDINGS)
+    token = fold(token)
+    if len(token) <= 3 or not token.isalpha():
+        return token
+    for suffix, replacement, min_stem in () if singular else PLURAL_RULES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_stem:
+            token = token[:-len(suffix)] + replacement
+            break
+    for suffix in DERIVATION_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)]
+            break
+    if len(token) > 4 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if fold(token) not in STOPWORDS]
+
+
+def chunk_terms(document):
+    # The title is the claim being checked, so it counts for every chunk of the article
+    return " ".join(tokenize(f"{document.metadata.get('title', '')} {document.page_content}"))
+
+
+def match_expression(text):
+    """
+    FTS5 query matching any term of text. Tokens are \\w+ only, so quoting is safe.
+    """
+    terms = dict.fromkeys(tokenize(text))
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def lexical_search(conn, text, limit):
+    """
+    Returns [(row id, BM25 score)], best first. conn must have lexical.sqlite attached as "lex".
+    """
+    expression = match_expression(text)
+    if not expression:
+        return []
+    # FTS5's bm25() is negative, more negative is better
+    return conn.execute(
+        "SELECT rowid, -bm25(chunk_terms) FROM lex.chunk_terms WHERE chunk_terms MATCH ? "
+        "ORDER BY bm25(chunk_terms) LIMIT ?",
+        (expression, limit)
+    ).fetchall()
+
+
+def index_terms(conn, rows):
+    """
+    rows: (row id, Document) pairs.
+    """
+    conn.executemany(
+        "INSERT INTO lex.chunk_terms (rowid, terms) VALUES (?, ?)",
+        [(int(row_id), chunk_terms(doc)) for row_id, doc in rows]
+    )
+
+
+def remove_terms(conn, row_ids):
+    conn.executemany("DELETE FROM lex.chunk_terms WHERE rowid = ?", [(int(row_id),) for row_id in row_ids])
+
+
+def optimize_terms(conn):
+    # Merges the FTS5 b-trees into one, so readers do a single lookup per term
+    conn.execute("INSERT INTO lex.chunk_terms (chunk_terms) VALUES ('optimize')")
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses ranked id lists: score(id) = sum of 1 / (k + rank). Returns ids, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
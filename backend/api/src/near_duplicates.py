@@ -0,0 +1,95 @@
+from api.src.lexical_index import TOKEN_RE, fold
+import os
+import hashlib
+import numpy as np
+
+# Near-duplicate chunks are dropped before they are embedded: within an article (the
+# claim quoted again in the verdict, a paragraph repeated after an update) and across
+# the articles of a build (methodology notes, corrections and footers pasted into
+# many fact-checks), where the first article to carry the text keeps it.
+# Chunks are compared by 64-bit SimHash over word 3-shingles: fingerprints of texts
+# sharing most of their shingles differ in few bits.
+CHUNK_DEDUP = os.getenv("CHUNK_DEDUP", "true").lower() == "true"
+CHUNK_DEDUP_ACROSS_ARTICLES = os.getenv("CHUNK_DEDUP_ACROSS_ARTICLES", "true").lower() == "true"
+# Fingerprints this many bits apart or fewer count as the same text. A bit differs
+# with probability angle/pi between the two shingle sets, so 3 bits means ~99% of
+# shingles shared, 6 bits ~96%. Adjacent chunks of an article, which only share
+# their overlap, are 20+ bits apart. Larger values mean narrower buckets and more
+# comparisons per chunk.
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))
+SHINGLE_SIZE = 3
+
+
+def shingles(text):
+    tokens = [fold(token) for token in TOKEN_RE.findall(text)]
+    if len(tokens) < SHINGLE_SIZE:
+        return tokens
+    return [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+
+
+def simhash(text):
+    """
+    64-bit SimHash of text's shingles, or None for text without words.
+    """
+    features = shingles(text)
+    if not features:
+        return None
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little") for feature in features],
+        dtype=np.uint64
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    # Each bit is set when most shingles have it set
+    majority = (bits.sum(axis=0) * 2 > len(features)).astype(np.uint8)
+    return int.from_bytes(np.packbits(majority, bitorder="little").tobytes(), "little")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    Fingerprints with a value each, in banded buckets. The 64 bits are cut into
+    max_distance + 1 bands: fingerprints at most max_distance bits apart agree on at
+    least one whole band, so a lookup only compares against its bucket mates.
+    """
+
+    def __init__(self, max_distance=SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [64 * i // bands for i in range(bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._buckets = [{} for _ in self._bands]
+
+    def find(self, fingerprint):
+        """
+        Value of a stored fingerprint within max_distance bits of fingerprint, or None.
+        """
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            for seen, value in buckets.get((fingerprint >> shift) & mask, ()):
+                if hamming(fingerprint, seen) <= self.max_distance:
+                    return value
+        return None
+
+    def add(self, fingerprint, value):
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            buckets.setdefault((fingerprint >> shift) & mask, []).append((fingerprint, value))
+
+
+def unique_chunks(documents, max_distance=SIMHASH_MAX_DISTANCE, fingerprints=None):
+    """
+    Positions of the documents to keep: the first of every group of near-duplicates.
+    fingerprints, if given, are the documents' simhash values.
+    """
+    if fingerprints is None:
+        fingerprints = [simhash(doc.page_content) for doc in documents]
+    kept = []
+    seen = SimHashIndex(max_distance)
+    for i, fingerprint in enumerate(fingerprints):
+        if fingerprint is not None and seen.find(fingerprint) is not None:
+            continue
+        kept.append(i)
+        if fingerprint is not None:
+            seen.add(fingerprint, i)
+    return kept
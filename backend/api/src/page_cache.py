@@ -0,0 +1,188 @@
+from api.src.fetcher import FetchResult
+from api.src.metrics import cache_requests
+from api.src.shared_paths import SHARED_DIR
+from api.src.embedding_cache import evict_least_recent
+import os
+import time
+import zlib
+import asyncio
+import sqlite3
+import threading
+
+# Raw article pages as last downloaded, compressed and keyed by URL, with the
+# validators (ETag / Last-Modified) the site sent. Later fetches of the same URL are
+# conditional, so unchanged pages come back as a body-less 304, and stored pages can
+# be parsed again after the extraction logic changes without touching the site.
+# Set to an empty string to disable the cache
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", os.path.join(SHARED_DIR, "cache", "pages.sqlite"))
+PAGE_CACHE_MAX_MB = float(os.getenv("PAGE_CACHE_MAX_MB", "1024"))
+
+
+def header(headers, name):
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CachedPage:
+    def __init__(self, url, text, etag, last_modified, fetched_at):
+        self.url = url
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def validators(self):
+        """
+        Request headers that make the server answer 304 if the page didn't change.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    SQLite store of zlib-compressed pages, evicting the least recently fetched
+    pages once the compressed bodies exceed max_bytes.
+
+        with PageCache() as cache:
+            result = await cache.fetch(fetcher, url)
+    """
+
+    def __init__(self, path=PAGE_CACHE_PATH, max_bytes=int(PAGE_CACHE_MAX_MB * 1024 * 1024)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages(last_used)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM pages").fetchone()[0]
+        self.not_modified = 0
+        self.downloaded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, fetched_at = row
+        return CachedPage(url, zlib.decompress(body).decode("utf-8"), etag, last_modified, fetched_at)
+
+    def put(self, url, text, etag=None, last_modified=None):
+        body = zlib.compress(text.encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT LENGTH(body) FROM pages WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, body, etag, last_modified, fetched_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, body, etag, last_modified, now, now)
+            )
+            self._bytes += len(body) - (row[0] if row else 0)
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, url):
+        """
+        Marks a page as confirmed current by the server.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+
+    def _evict(self):
+        self._bytes = evict_least_recent(self._conn, "pages", "url", "body", self._bytes, self.max_bytes)
+
+    def urls(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT url FROM pages ORDER BY url")]
+
+    def iter_pages(self, batch_size=200):
+        """
+        Yields (url, text) for every stored page, reading batch_size pages at a time.
+        """
+        urls = self.urls()
+        for start in range(0, len(urls), batch_size):
+            batch = urls[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT url, body FROM pages WHERE url IN ({placeholders})", batch
+                ).fetchall()
+            for url, body in rows:
+                yield url, zlib.decompress(body).decode("utf-8")
+
+    async def fetch(self, fetcher, url):
+        """
+        fetcher.fetch(url), made conditional when the page is cached. A 304 is
+        returned as a 200 carrying the cached body; a new 200 replaces the cached copy.
+        """
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self.get, url)
+        result = await fetcher.fetch(url, headers=cached.validators() if cached else None)
+        if result is None:
+            return None
+
+        if result.status == 304 and cached is not None:
+            self.not_modified += 1
+            cache_requests.inc(cache="pages", result="not_modified")
+            await loop.run_in_executor(None, self.touch, url)
+            return FetchResult(url, 200, cached.text, result.headers, from_cache=True)
+
+        if result.status == 200:
+            self.downloaded += 1
+            cache_requests.inc(cache="pages", result="changed" if cached else "miss")
+            await loop.run_in_executor(
+                None, self.put, url, result.text,
+                header(result.headers, "ETag"), header(result.headers, "Last-Modified")
+            )
+        return result
+
+    def stats(self):
+        return {
+            "pages": len(self),
+            "bytes": self.size_bytes,
+            "not_modified": self.not_modified,
+            "downloaded": self.downloaded
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_page_cache(path=PAGE_CACHE_PATH):
+    """
+    The page cache at path, or None when caching is disabled.
+    """
+    return PageCache(path) if path else None
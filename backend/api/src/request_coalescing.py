@@ -0,0 +1,256 @@
+from contextlib import contextmanager, asynccontextmanager
+from collections import deque
+from api.src.metrics import registry
+import os
+import math
+import time
+import asyncio
+import threading
+
+# Protects the OpenAI quota when a claim goes viral. Identical questions asked
+# while one is being answered wait for that answer instead of starting their own
+# (single flight), and LLM calls go through a gate: at most LLM_MAX_CONCURRENCY run
+# at once, LLM_MAX_QUEUE more may wait, and anything beyond that is turned away with
+# a Retry-After estimate so clients back off instead of piling up.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+# Longest a request waits in the queue before giving up with 429
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Starting guess for an LLM call's duration, refined as calls complete
+LLM_EXPECTED_SECONDS = float(os.getenv("LLM_EXPECTED_SECONDS", "2"))
+
+coalesced_requests = registry.counter(
+    "coalesced_requests_total", "Requests answered by waiting on an identical request already in flight."
+)
+llm_calls_active = registry.gauge("llm_calls_active", "LLM calls running.")
+llm_calls_waiting = registry.gauge("llm_calls_waiting", "Requests waiting for an LLM call slot.")
+overloaded_requests = registry.counter("overloaded_requests_total", "Requests rejected with 429 because the LLM queue was full.")
+
+
+class Overloaded(RuntimeError):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many questions in flight, retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs fn once per key at a time: callers arriving while a call for their key is
+    running wait for it and get its result (or its exception). A follower waits at
+    most timeout seconds in all, the longest it would have queued for a call slot of
+    its own, then makes the call itself, so a hung call can't hold up everyone asking
+    the same question. A leader turned away with Overloaded doesn't turn its followers
+    away too: they start (or join) a new call instead.
+    """
+
+    def __init__(self, timeout=LLM_QUEUE_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Returns (result, shared), shared being True for callers that waited on another's call.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+
+            if leader:
+                return self._lead(key, call, fn), False
+
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                print(f"⚠️ Identical request still running after {self.timeout:.0f}s, answering on its own.")
+                return fn(), False
+            if isinstance(call.error, Overloaded):
+                continue
+            if call.error is not None:
+                raise call.error
+            coalesced_requests.inc()
+            return call.result, True
+
+    def _lead(self, key, call, fn):
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    """
+    A request queued for a call slot: threads wait on an event, coroutines on a
+    future of their own loop, so waiting never occupies a worker thread.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(_wake, self.future)
+        else:
+            self.event.set()
+
+
+class LLMGate:
+    """
+    Counting semaphore with a bounded FIFO wait queue for LLM calls, usable from
+    threads and coroutines alike. A released slot is handed straight to the next
+    waiter.
+
+        with llm_gate.slot():
+            chain.invoke(...)
+    """
+
+    def __init__(self, concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, timeout=LLM_QUEUE_TIMEOUT):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        self._call_seconds = LLM_EXPECTED_SECONDS
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """
+        Whole seconds until the queue has likely drained enough to take another request.
+        """
+        return max(1, math.ceil(self._call_seconds * (self.waiting + 1) / self.concurrency))
+
+    def _reject(self):
+        overloaded_requests.inc()
+        raise Overloaded(self.retry_after())
+
+    def admit(self):
+        """
+        Raises Overloaded if a new request would find the queue full, before any work is spent on it.
+        """
+        with self._lock:
+            if self.active >= self.concurrency and self.waiting >= self.max_queue:
+                self._reject()
+
+    def _enqueue(self, reject, loop=None):
+        """
+        Takes a free slot (returns None) or queues a waiter for one (returns it).
+        """
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self.active += 1
+                llm_calls_active.set(self.active)
+                return None
+            if reject and self.waiting >= self.max_queue:
+                self._reject()
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            llm_calls_waiting.set(self.waiting)
+            return waiter
+
+    def _abandon(self, waiter):
+        """
+        Takes waiter out of the queue. Returns True if it was granted a slot meanwhile.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            llm_calls_waiting.set(self.waiting)
+            return False
+
+    def acquire(self, reject=True):
+        """
+        Takes a call slot, waiting in the queue if needed. With reject, a full queue
+        or a wait longer than timeout raise Overloaded; without it, waits as long as it takes.
+        """
+        waiter = self._enqueue(reject)
+        if waiter is None or waiter.event.wait(self.timeout if reject else None):
+            return
+        if not self._abandon(waiter):
+            with self._lock:
+                self._reject()
+
+    async def acquire_async(self, reject=True):
+        """
+        acquire for coroutines: waits on the event loop instead of a thread.
+        """
+        waiter = self._enqueue(reject, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout if reject else None)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                with self._lock:
+                    self._reject()
+        except asyncio.CancelledError:
+            # The caller went away: hand back a slot granted in the meantime
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self, seconds=None):
+        with self._lock:
+            if seconds is not None:
+                self._call_seconds = 0.8 * self._call_seconds + 0.2 * seconds
+            if self._waiters:
+                # The slot goes to the next waiter as it is: active stays the same
+                self._waiters.popleft().grant()
+                llm_calls_waiting.set(self.waiting)
+            else:
+                self.active -= 1
+                llm_calls_active.set(self.active)
+
+    @contextmanager
+    def slot(self, reject=True):
+        self.acquire(reject)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def async_slot(self, reject=True):
+        await self.acquire_async(reject)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+
+ask_flights = SingleFlight()
+llm_gate = LLMGate()
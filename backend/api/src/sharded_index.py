@@ -0,0 +1,370 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from api.src.index_format import (
+    CompactIndex, IndexWriter, DOCSTORE_FILE, VECTORS_FILE, fuse_rankings, load_index as load_single_index
+)
+from api.src.lexical_index import HYBRID_CANDIDATES
+from api.src.attribute_index import to_days
+from api.src.metrics import timed
+from langchain_core.documents import Document
+import os
+import json
+import heapq
+import contextvars
+import shutil
+import calendar
+import numpy as np
+
+# A sharded index version splits the chunks by publication period, each shard being
+# an ordinary index version (see index_format.py) in its own directory:
+#   shards.json                 period and {shard name: vectors, first / last day covered}
+#   shards/<name>/index.faiss   ...and the rest of the index files for that shard
+# Shards are named "2025-05" (month), "2025" (year) or "undated". New articles land in
+# the current period, so a build only rewrites the shards it touches and publishes the
+# others by reference. Readers search the shards in parallel and merge the results;
+# date-filtered queries skip the shards outside the range.
+SHARDS_FILE = "shards.json"
+SHARDS_DIR = "shards"
+UNDATED_SHARD = "undated"
+
+# "month", "year", or "none" for a single unsharded index. Opt-in: an unfiltered
+# query searches every shard, so sharding only pays off for date-filtered traffic
+# or indexes too big to rebuild and upload as one
+SHARD_PERIODS = ("none", "year", "month")
+INDEX_SHARD_PERIOD = os.getenv("INDEX_SHARD_PERIOD", "none")
+# SQLite connections per shard (each shard only sees a fraction of the queries' reads)
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "2"))
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", "8"))
+
+shard_executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+
+
+def is_sharded_index(path):
+    return os.path.exists(os.path.join(path, SHARDS_FILE))
+
+
+def shard_name(published, period):
+    """
+    Shard holding chunks published at published (an ISO date string).
+    """
+    try:
+        published = datetime.fromisoformat(published)
+    except (TypeError, ValueError):
+        return UNDATED_SHARD
+    return f"{published.year:04d}" if period == "year" else f"{published.year:04d}-{published.month:02d}"
+
+
+def shard_bounds(name):
+    """
+    {"first": ..., "last": ...}: the days (ISO dates) a shard covers, None for undated.
+    """
+    if name == UNDATED_SHARD:
+        return {"first": None, "last": None}
+    if len(name) == 4:
+        first, last = date(int(name), 1, 1), date(int(name), 12, 31)
+    else:
+        year, month = int(name[:4]), int(name[5:7])
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+    return {"first": first.isoformat(), "last": last.isoformat()}
+
+
+def shard_files(manifest, name):
+    """
+    {relative path: object entry} of the files of shard name in a published manifest.
+    """
+    prefix = f"{SHARDS_DIR}/{name}/"
+    return {rel_path: entry for rel_path, entry in manifest["files"].items() if rel_path.startswith(prefix)}
+
+
+def shard_vectors_key(name):
+    # Metadata name of a shard's vectors.sqlite when it isn't shipped to readers
+    return f"{SHARDS_DIR}/{name}/{VECTORS_FILE}"
+
+
+def overlaps(shard, search_filter):
+    """
+    Whether a shard can hold chunks matching search_filter's date range.
+    """
+    if search_filter is None or (search_filter.published_from is None and search_filter.published_to is None):
+        return True
+    if shard["first"] is None:
+        # Undated chunks never match a date bound
+        return False
+    return (
+        (search_filter.published_from is None or shard["last"] >= search_filter.published_from)
+        and (search_filter.published_to is None or shard["first"] <= search_filter.published_to)
+    )
+
+
+class ShardedIndex:
+    """
+    Read side of a sharded index version, with the CompactIndex search interface.
+    Queries fan out to the shards on shard_executor; results are merged by score, and
+    row ids become (shard, row id) pairs while the shards' results are combined.
+    Keyword scores come from each shard's own BM25 statistics, which is close enough
+    for rank fusion between shards of similar size.
+    """
+
+    def __init__(self, path, pool_size=SHARD_POOL_SIZE):
+        self.path = path
+        with open(os.path.join(path, SHARDS_FILE), encoding="utf-8") as f:
+            layout = json.load(f)
+        self.period = layout["period"]
+        self.shards = []
+        for name, entry in sorted(layout["shards"].items()):
+            bounds = {
+                "first": to_days(entry["first"]) if entry["first"] else None,
+                "last": to_days(entry["last"]) if entry["last"] else None
+            }
+            self.shards.append((name, bounds, CompactIndex(os.path.join(path, SHARDS_DIR, name), pool_size)))
+        self.has_lexical = bool(self.shards) and all(shard.has_lexical for _, _, shard in self.shards)
+        self.d = self.shards[0][2].index.d if self.shards else 0
+
+    @property
+    def ntotal(self):
+        return sum(shard.ntotal for _, _, shard in self.shards)
+
+    @property
+    def kind(self):
+        return self.shards[0][2].kind if self.shards else "flat"
+
+    @property
+    def quantization(self):
+        return self.shards[0][2].quantization if self.shards else "none"
+
+    def _select(self, search_filter):
+        return [shard for _, bounds, shard in self.shards if overlaps(bounds, search_filter)]
+
+    def _fan_out(self, stage, fn, shards):
+        def run(shard):
+            with timed(stage):
+                return fn(shard)
+
+        if len(shards) == 1:
+            return [run(shards[0])]
+        # Each call runs in its own copy of the caller's context, so the stage lands in its request timings
+        contexts = [contextvars.copy_context() for _ in shards]
+        return list(shard_executor.map(lambda context, shard: context.run(run, shard), contexts, shards))
+
+    def search_by_vectors(self, vectors, k, nprobe=None, ef_search=None, search_filter=None):
+        """
+        CompactIndex.search_by_vectors over the shards search_filter can match.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.d)
+        shards = self._select(search_filter)
+        if not shards:
+            return [[] for _ in vectors]
+        per_shard = self._fan_out(
+            "shard_search",
+            lambda shard: shard.search_by_vectors(vectors, k, nprobe, ef_search, search_filter),
+            shards
+        )
+        return [
+            heapq.nsmallest(k, (hit for results in query_results for hit in results), key=lambda hit: hit[1])
+            for query_results in zip(*per_shard)
+        ]
+
+    def search_by_vector(self, vector, k, nprobe=None, ef_search=None, search_filter=None):
+        return self.search_by_vectors([vector], k, nprobe, ef_search, search_filter)[0]
+
+    def hybrid_search(self, text, vector, k, max_distance=None, nprobe=None, ef_search=None,
+                      search_filter=None, candidates=HYBRID_CANDIDATES):
+        return self.hybrid_search_many(
+            [text], [vector], k, max_distance, nprobe, ef_search, search_filter, candidates
+        )[0]
+
+    def _distances(self, shards, vector, keys):
+        """
+        {(shard, row): squared L2 distance to vector} for (shard, row) keys.
+        """
+        rows = {}
+        for s, row in keys:
+            rows.setdefault(s, []).append(row)
+        return {
+            (s, row): score
+            for s, shard_rows in rows.items() for row, score in shards[s].distances(vector, shard_rows).items()
+        }
+
+    def hybrid_search_many(self, texts, vectors, k, max_distance=None, nprobe=None, ef_search=None,
+                           search_filter=None, candidates=HYBRID_CANDIDATES):
+        """
+        CompactIndex.hybrid_search_many over the shards search_filter can match: each
+        shard returns its vector and keyword candidates, which are merged into global
+        rankings and fused once, so the result matches a search over one big index.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.d)
+        shards = self._select(search_filter)
+        if not shards:
+            return [[] for _ in vectors]
+        per_shard = self._fan_out(
+            "shard_search",
+            lambda shard: shard.hybrid_candidates(texts, vectors, k, nprobe, ef_search, search_filter, candidates),
+            shards
+        )
+
+        rankings = []
+        for i, vector in enumerate(vectors):
+            distance = {}
+            lexical_hits = []
+            for s, shard_results in enumerate(per_shard):
+                shard_distance, shard_hits = shard_results[i]
+                distance.update(((s, row), score) for row, score in shard_distance.items())
+                lexical_hits.extend(((s, row), score) for row, score in shard_hits)
+            nearest = heapq.nsmallest(max(k, candidates), distance.items(), key=lambda item: item[1])
+            distance = dict(nearest)
+            lexical_hits = heapq.nlargest(candidates, lexical_hits, key=lambda hit: hit[1])
+
+            lexical_distance = {}
+            if max_distance is not None:
+                lexical_distance = self._distances(
+                    shards, vector, [key for key, _ in lexical_hits if key not in distance]
+                )
+            fused = fuse_rankings(distance, lexical_hits, k, max_distance, lexical_distance)
+            distance.update(lexical_distance)
+            distance.update(self._distances(shards, vector, [key for key in fused if key not in distance]))
+            rankings.append((fused, distance))
+
+        wanted = {}
+        for fused, _ in rankings:
+            for s, row in fused:
+                wanted.setdefault(s, set()).add(row)
+        per_shard = self._fan_out("shard_documents", lambda s: shards[s].documents(sorted(wanted[s])), list(wanted))
+        docs = dict(zip(wanted, per_shard))
+        return [
+            [(docs[s][row], distance[(s, row)]) for s, row in fused if row in docs.get(s, {})]
+            for fused, distance in rankings
+        ]
+
+
+def load_index(path, embeddings):
+    if is_sharded_index(path):
+        return ShardedIndex(path)
+    return load_single_index(path, embeddings)
+
+
+def copy_rows(source, target, batch_size=2000):
+    """
+    Adds every chunk of the IndexWriter source, with its stored vector, to target
+    (an IndexWriter or ShardedIndexWriter). Used to change the shard layout without
+    embedding anything again.
+    """
+    cursor = source.conn.execute(
+        "SELECT c.chunk_id, c.page_content, c.metadata, v.vector "
+        "FROM chunks c JOIN vec.vectors v ON v.row_id = c.row_id ORDER BY c.row_id"
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        target.add(
+            [chunk_id for chunk_id, _, _, _ in rows],
+            [Document(page_content=content, metadata=json.loads(metadata)) for _, content, metadata, _ in rows],
+            np.stack([np.frombuffer(blob, dtype=np.float32) for _, _, _, blob in rows])
+        )
+
+
+class ShardedIndexWriter:
+    """
+    Write side of a sharded index, with the IndexWriter interface build_index uses.
+    Only the shards a build touches are opened: open_shard(name) returns
+    (directory, vectors.sqlite path or None) of a shard of the previous version, and
+    shards that don't exist yet are created when chunks arrive for them.
+
+        writer = ShardedIndexWriter(work_dir, layout=previous_layout, open_shard=fetch)
+        writer.open_shards(shards of the changed articles)
+        writer.remove(chunk_ids)
+        writer.add(chunk_ids, documents, vectors)
+        writer.save()   # returns the shards written
+    """
+
+    def __init__(self, path, period="month", index_type=None, quantization=None,
+                 layout=None, open_shard=None):
+        if period not in SHARD_PERIODS[1:]:
+            raise ValueError(f"Unknown shard period {period!r}, expected one of {SHARD_PERIODS[1:]}")
+        self.path = path
+        self.period = period
+        self.index_type = index_type
+        self.quantization = quantization
+        self.shards = dict((layout or {}).get("shards", {}))
+        self.open_shard = open_shard
+        self.writers = {}
+        # {article id: shard} of every article added, for indexed_articles.json
+        self.article_shards = {}
+        os.makedirs(os.path.join(path, SHARDS_DIR), exist_ok=True)
+
+    def _shard_path(self, name):
+        return os.path.join(self.path, SHARDS_DIR, name)
+
+    @property
+    def ntotal(self):
+        opened = sum(writer.ntotal for writer in self.writers.values())
+        return opened + sum(entry["vectors"] for name, entry in self.shards.items() if name not in self.writers)
+
+    def open_shards(self, names):
+        """
+        Opens the existing shards among names for writing.
+        """
+        for name in sorted(set(names)):
+            if name in self.shards and name not in self.writers:
+                source_path, vectors_path = self.open_shard(name)
+                self.writers[name] = IndexWriter.open(
+                    source_path, self._shard_path(name), None, self.index_type, self.quantization, vectors_path
+                )
+
+    def _writer(self, name):
+        self.open_shards([name])
+        if name not in self.writers:
+            self.writers[name] = IndexWriter.create(
+                self._shard_path(name), index_type=self.index_type, quantization=self.quantization
+            )
+        return self.writers[name]
+
+    def chunk_ids_for_sources(self, sources):
+        return [chunk_id for writer in self.writers.values() for chunk_id in writer.chunk_ids_for_sources(sources)]
+
+    def add(self, chunk_ids, documents, vectors):
+        groups = {}
+        for chunk_id, doc, vector in zip(chunk_ids, documents, vectors):
+            name = shard_name(doc.metadata.get("published"), self.period)
+            group = groups.setdefault(name, ([], [], []))
+            group[0].append(chunk_id)
+            group[1].append(doc)
+            group[2].append(vector)
+            self.article_shards[doc.metadata.get("article_id")] = name
+        for name, (ids, docs, shard_vectors) in groups.items():
+            self._writer(name).add(ids, docs, np.asarray(shard_vectors, dtype=np.float32))
+
+    def remove(self, chunk_ids):
+        """
+        Removes chunk_ids from the opened shards; returns how many were removed.
+        """
+        return sum(writer.remove(chunk_ids) for writer in self.writers.values())
+
+    def save(self):
+        """
+        Saves the opened shards, drops the ones left empty and writes shards.json.
+        Returns the names of the shards written or dropped.
+        """
+        for name, writer in sorted(self.writers.items()):
+            if not writer.ntotal:
+                writer.conn.close()
+                shutil.rmtree(self._shard_path(name), ignore_errors=True)
+                self.shards.pop(name, None)
+                continue
+            print(f"🧩 Shard {name}:")
+            writer.save()
+            self.shards[name] = {"vectors": writer.ntotal, **shard_bounds(name)}
+
+        with open(os.path.join(self.path, SHARDS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"period": self.period, "shards": self.shards}, f, ensure_ascii=False, indent=2)
+        return sorted(self.writers)
+
+    def shard_dirs(self):
+        """
+        {shard name: local directory} of the shards written by save().
+        """
+        return {
+            name: self._shard_path(name) for name in self.writers
+            if os.path.exists(os.path.join(self._shard_path(name), DOCSTORE_FILE))
+        }
@@ -0,0 +1,10 @@
+import os
+
+# Directory shared by the API, the scraper, the index builder and their worker
+# processes (caches, job logs, scraped data). Absolute, so every process resolves
+# the same place whatever its working directory; docker-compose points it at the
+# mounted volume.
+SHARED_DIR = os.getenv(
+    "SHARED_DATA_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared', 'data'))
+)
@@ -0,0 +1,266 @@
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+import io
+import re
+import time
+import zlib
+import asyncio
+import hashlib
+import threading
+import numpy as np
+
+# Local stand-ins for the services the pipeline talks to, so the benchmarks run
+# offline and deterministically: an in-memory S3, a hashing embedding model and a
+# canned chat model. Each can add a fixed latency per call to mimic the real service.
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class NoSuchKey(ClientError):
+    def __init__(self, key, operation="GetObject"):
+        super().__init__({"Error": {"Code": "NoSuchKey", "Message": key}}, operation)
+
+
+class FakeS3Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+def precondition_failed(operation):
+    return ClientError({"Error": {"Code": "PreconditionFailed", "Message": "At least one of the pre-conditions you specified did not hold"}}, operation)
+
+
+class FakeS3Paginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix="", PageSize=1000):
+        keys = self.client.keys(Prefix)
+        for start in range(0, max(len(keys), 1), PageSize):
+            self.client._round_trip()
+            yield {"Contents": [self.client._listing(key) for key in keys[start:start + PageSize]]}
+
+
+class FakeS3:
+    """
+    In-memory S3 with the calls, conditional writes (IfMatch / IfNoneMatch) and
+    errors the app relies on. Buckets are ignored: every key lives in one namespace.
+    """
+
+    exceptions = FakeS3Exceptions
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _etag(self, key):
+        return '"%s"' % hashlib.md5(self.objects[key]).hexdigest()
+
+    def _listing(self, key):
+        with self._lock:
+            return {"Key": key, "Size": len(self.objects[key]), "ETag": self._etag(key)}
+
+    def _read(self, key, operation, if_match=None):
+        with self._lock:
+            if key not in self.objects:
+                raise NoSuchKey(key, operation)
+            if if_match is not None and if_match.strip('"') != self._etag(key).strip('"'):
+                raise precondition_failed(operation)
+            return self.objects[key], self._etag(key)
+
+    def _write(self, key, data, operation, if_match=None, if_none_match=None):
+        with self._lock:
+            if if_none_match == "*" and key in self.objects:
+                raise precondition_failed(operation)
+            if if_match is not None and (key not in self.objects or self._etag(key).strip('"') != if_match.strip('"')):
+                raise precondition_failed(operation)
+            self.objects[key] = data
+            return self._etag(key)
+
+    def keys(self, prefix=""):
+        with self._lock:
+            return sorted(key for key in self.objects if key.startswith(prefix))
+
+    def get_object(self, Bucket, Key, IfMatch=None, **kwargs):
+        self._round_trip()
+        data, etag = self._read(Key, "GetObject", IfMatch)
+        return {"Body": StreamingBody(io.BytesIO(data), len(data)), "ETag": etag, "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._round_trip()
+        try:
+            data, etag = self._read(Key, "HeadObject")
+        except NoSuchKey:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ETag": etag, "ContentLength": len(data)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._round_trip()
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        return {"ETag": self._write(Key, data, "PutObject", IfMatch, IfNoneMatch)}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        self._round_trip()
+        with open(Filename, "rb") as f:
+            self._write(Key, f.read(), "PutObject")
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Config=None, **kwargs):
+        self._round_trip()
+        data, _ = self._read(Key, "GetObject", (ExtraArgs or {}).get("IfMatch"))
+        with open(Filename, "wb") as f:
+            f.write(data)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._round_trip()
+        with self._lock:
+            self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._round_trip()
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+        return {"Deleted": Delete["Objects"]}
+
+    def get_paginator(self, operation):
+        if operation != "list_objects_v2":
+            raise NotImplementedError(operation)
+        return FakeS3Paginator(self)
+
+    @property
+    def size_bytes(self):
+        with self._lock:
+            return sum(len(data) for data in self.objects.values())
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings (feature hashing of the tokens), so texts
+    sharing words end up close together and retrieval behaves like a real model.
+    latency is added once per request, like an embeddings API call.
+    """
+
+    def __init__(self, dimensions=256, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = f"fake-hashing-{dimensions}"
+        self.requests = 0
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in TOKEN_RE.findall(text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering every prompt with the same short text after latency
+    seconds (time to first token) plus token_latency per token. Reports token usage
+    like the OpenAI models do.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer: str = (
+        "Segundo os artigos verificados pelo Polígrafo, a afirmação é falsa: os dados "
+        "oficiais não a confirmam e as fontes citadas foram desmentidas."
+    )
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self):
+        return re.findall(r"\S+\s*", self.answer)
+
+    def _usage(self, messages, tokens):
+        prompt = sum(len(str(message.content)) for message in messages) // 4
+        return {"input_tokens": prompt, "output_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens()
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        message = AIMessage(content=self.answer, usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens()
+        await asyncio.sleep(self.latency + self.token_latency * len(tokens))
+        message = AIMessage(content=self.answer, usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        tokens = self._tokens()
+        for i, token in enumerate(tokens):
+            time.sleep(self.token_latency)
+            usage = self._usage(messages, tokens) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        tokens = self._tokens()
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(self.token_latency)
+            usage = self._usage(messages, tokens) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def install_fakes(s3, embeddings_latency=0.0, llm_latency=0.0, llm_token_latency=0.0, dimensions=256):
+    """
+    Points every module that talks to S3 or OpenAI at the local stand-ins.
+    """
+    from api.src import article_store, build_index, data_collect, index_manager, index_store
+
+    for module in (article_store, build_index, data_collect, index_manager, index_store):
+        module.s3 = s3
+
+    def embeddings(**kwargs):
+        return HashingEmbeddings(dimensions, embeddings_latency)
+
+    def chat_model(**kwargs):
+        return FakeChatModel(
+            latency=llm_latency, token_latency=llm_token_latency, callbacks=kwargs.get("callbacks")
+        )
+
+    build_index.OpenAIEmbeddings = embeddings
+    index_manager.OpenAIEmbeddings = embeddings
+    index_manager.ChatOpenAI = chat_model
@@ -0,0 +1,256 @@
+from aiohttp import web
+import os
+import random
+import hashlib
+import asyncio
+import threading
+import requests
+
+# HTML fixtures for the scraper benchmarks. Synthetic pages mirror the markup
+# data_collect.py parses on poligrafo.sapo.pt (listing <article> links, <h1>, the
+# post content widget, the verdict box and the Portuguese publication date).
+# Real pages can be recorded once with
+#
+#   cd backend && python -m benchmarks.fixtures --record benchmarks/fixtures --pages 3
+#
+# and are then preferred over the synthetic ones by the benchmarks.
+
+VERDICTS = ("Falso", "Verdadeiro", "Impreciso", "Pimenta na Língua", "Descontextualizado", "Enganador")
+PT_MONTH_NAMES = (
+    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
+)
+WORDS = (
+    "governo", "ministro", "saúde", "pensões", "salário", "mínimo", "inflação", "habitação", "rendas",
+    "vacina", "eleições", "parlamento", "deputado", "orçamento", "impostos", "IRS", "IVA", "escolas",
+    "professores", "hospitais", "urgências", "imigração", "fronteiras", "clima", "seca", "incêndios",
+    "combustíveis", "preços", "energia", "eletricidade", "Lisboa", "Porto", "Europa", "Bruxelas",
+    "dados", "oficiais", "estatísticas", "INE", "Pordata", "relatório", "publicação", "redes", "sociais",
+    "vídeo", "fotografia", "afirmação", "declarações", "entrevista", "segundo", "aumento", "descida",
+    "milhões", "euros", "percentagem", "anos", "portugueses", "câmara", "municipal", "polícia", "tribunal"
+)
+PARAGRAPHS_PER_ARTICLE = 10
+WORDS_PER_PARAGRAPH = 30
+
+ARTICLE_TEMPLATE = """<!DOCTYPE html>
+<html lang="pt-PT"><head><meta charset="utf-8"><title>{title} - Polígrafo</title></head>
+<body>
+<header class="site-header"><nav><a href="/">Polígrafo</a><a href="/fact-checks/">Fact-checks</a></nav></header>
+<main>
+<div class="elementor-widget-theme-post-title"><h1 class="elementor-heading-title">{title}</h1></div>
+<div class="custom-post-date-time">{published}</div>
+<div class="fact-check-result"><span>{verdict}</span></div>
+<div class="elementor-element elementor-widget elementor-widget-theme-post-content">
+<div class="elementor-widget-container">
+{paragraphs}
+</div>
+</div>
+<aside class="related"><article><a href="/fact-checks/relacionado/">Artigo relacionado</a></article></aside>
+</main>
+<footer><p>© Polígrafo</p></footer>
+</body></html>
+"""
+
+LISTING_TEMPLATE = """<!DOCTYPE html>
+<html lang="pt-PT"><head><meta charset="utf-8"><title>Fact-checks - Polígrafo</title></head>
+<body><main><div class="elementor-posts-container">
+{articles}
+</div></main></body></html>
+"""
+
+LISTING_ITEM = """<article class="elementor-post"><div class="elementor-post__thumbnail"><img src="/img/{slug}.jpg"></div>
+<h3 class="elementor-post__title"><a href="{url}">{title}</a></h3></article>"""
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def portuguese_date(n):
+    # Newest first: article 0 is the most recent, one article per hour before it
+    day, hour = divmod(n, 24)
+    year = 2025 - day // 336
+    month = 12 - (day // 28) % 12
+    return f"{28 - day % 28} de {PT_MONTH_NAMES[month - 1]} de {year} às {23 - hour:02d}:00"
+
+
+def _article_fields(n, seed):
+    rng = random.Random(seed * 1_000_003 + n)
+    title = sentence(rng, 10).rstrip(".")
+    paragraphs = [sentence(rng, WORDS_PER_PARAGRAPH) for _ in range(PARAGRAPHS_PER_ARTICLE)]
+    return title, rng.choice(VERDICTS), paragraphs
+
+
+def synthetic_article(n, base_url="/fact-checks/", seed=0):
+    """
+    Returns (url, html) of the n-th synthetic article. Same n, same page.
+    """
+    title, verdict, paragraphs = _article_fields(n, seed)
+    html = ARTICLE_TEMPLATE.format(
+        title=title,
+        published=portuguese_date(n),
+        verdict=verdict,
+        paragraphs="\n".join(f"<p>{text}</p>" for text in paragraphs)
+    )
+    return f"{base_url}artigo-{n}/", html
+
+
+def synthetic_record(n, base_url="/fact-checks/", seed=0):
+    """
+    The article data_collect would store for synthetic_article(n), without the HTML round trip.
+    """
+    from api.src.data_collect import parse_portuguese_datetime
+
+    title, verdict, paragraphs = _article_fields(n, seed)
+    return {
+        "url": f"{base_url}artigo-{n}/",
+        "title": title,
+        "verdict": verdict,
+        "content": "\n\n".join(paragraphs),
+        "published": parse_portuguese_datetime(portuguese_date(n)).isoformat()
+    }
+
+
+def synthetic_listing(page_number, per_page, total, base_url="/fact-checks/", seed=0):
+    """
+    Listing page linking articles [(page_number - 1) * per_page, page_number * per_page).
+    """
+    start = (page_number - 1) * per_page
+    items = []
+    for n in range(start, min(start + per_page, total)):
+        title, _, _ = _article_fields(n, seed)
+        items.append(LISTING_ITEM.format(slug=f"artigo-{n}", url=f"{base_url}artigo-{n}/", title=title))
+    return LISTING_TEMPLATE.format(articles="\n".join(items))
+
+
+def load_recorded(path):
+    """
+    Returns [(url, html)] of the article pages recorded under path, or [] if there are none.
+    """
+    articles_dir = os.path.join(path, "articles")
+    if not os.path.isdir(articles_dir):
+        return []
+    pages = []
+    with open(os.path.join(path, "urls.txt"), encoding="utf-8") as f:
+        urls = dict(line.rstrip("\n").split("\t", 1) for line in f if line.strip())
+    for name in sorted(os.listdir(articles_dir)):
+        with open(os.path.join(articles_dir, name), encoding="utf-8") as f:
+            pages.append((urls.get(name, name), f.read()))
+    return pages
+
+
+def record(path, pages=1):
+    """
+    Saves the listing pages and every article they link to from the live site.
+    """
+    from api.src.data_collect import listing_page_url, parse_article_links, HEADERS
+
+    os.makedirs(os.path.join(path, "articles"), exist_ok=True)
+    os.makedirs(os.path.join(path, "listings"), exist_ok=True)
+    urls = []
+    for page_number in range(1, pages + 1):
+        response = requests.get(listing_page_url(page_number), headers=HEADERS)
+        response.raise_for_status()
+        with open(os.path.join(path, "listings", f"{page_number}.html"), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        for url in parse_article_links(response.text):
+            name = f"{len(urls):05d}.html"
+            page = requests.get(url, headers=HEADERS)
+            if page.status_code != 200:
+                continue
+            with open(os.path.join(path, "articles", name), "w", encoding="utf-8") as f:
+                f.write(page.text)
+            urls.append((name, url))
+    with open(os.path.join(path, "urls.txt"), "w", encoding="utf-8") as f:
+        f.writelines(f"{name}\t{url}\n" for name, url in urls)
+    print(f"💾 Recorded {len(urls)} articles from {pages} listing pages into {path}")
+
+
+class FixtureSite:
+    """
+    Local HTTP server serving total synthetic articles behind per_page listing pages,
+    with the same URL layout as the live site. Article pages carry an ETag and
+    answer conditional requests with 304. latency is added to every response.
+
+        with FixtureSite(total=500) as site:
+            data_collect.BASE_URL = site.base_url
+    """
+
+    def __init__(self, total, per_page=20, latency=0.0, seed=0):
+        self.total = total
+        self.per_page = per_page
+        self.latency = latency
+        self.seed = seed
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.base_url = None
+
+    async def _handle(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        page = request.match_info.get("page")
+        slug = request.match_info.get("slug")
+        if slug is not None:
+            n = int(slug.rsplit("-", 1)[1])
+            if n >= self.total:
+                raise web.HTTPNotFound()
+            _, html = synthetic_article(n, self.base_url, self.seed)
+            etag = '"%s"' % hashlib.md5(html.encode("utf-8")).hexdigest()
+            if request.headers.get("If-None-Match") == etag:
+                self.not_modified += 1
+                return web.Response(status=304, headers={"ETag": etag})
+            self.bytes_sent += len(html.encode("utf-8"))
+            return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+        else:
+            page_number = int(page) if page else 1
+            if (page_number - 1) * self.per_page >= self.total:
+                raise web.HTTPNotFound()
+            html = synthetic_listing(page_number, self.per_page, self.total, self.base_url, self.seed)
+        self.bytes_sent += len(html.encode("utf-8"))
+        return web.Response(text=html, content_type="text/html")
+
+    def __enter__(self):
+        started = threading.Event()
+
+        async def start():
+            app = web.Application()
+            app.router.add_get("/fact-checks/", self._handle)
+            app.router.add_get(r"/fact-checks/{page:\d+}/", self._handle)
+            app.router.add_get(r"/fact-checks/{slug:artigo-\d+}/", self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.base_url = f"http://127.0.0.1:{port}/fact-checks/"
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fixture-site", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record live Polígrafo pages as scraper fixtures.")
+    parser.add_argument("--record", required=True, metavar="DIR", help="where to save the pages")
+    parser.add_argument("--pages", type=int, default=1, help="listing pages to record")
+    args = parser.parse_args()
+    record(args.record, args.pages)
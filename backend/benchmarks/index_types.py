@@ -0,0 +1,160 @@
+from api.src.index_format import (
+    build_faiss_index, search_parameters, index_kind, index_quantization, QUANTIZATIONS, RERANK_FACTOR
+)
+from api.src.embedding_cache import unpack_vector
+from api.src.chunk_embeddings import CHUNK_EMBEDDING_STORE_PATH
+import os
+import time
+import sqlite3
+import argparse
+import numpy as np
+import faiss
+
+# Compares the index types and vector quantizations build_index can publish
+# against exact (flat, float32) search:
+#
+#   cd backend && python -m benchmarks.index_types --n 100000
+#   cd backend && python -m benchmarks.index_types --store shared/cache/chunk_embeddings.sqlite --quantization sq8 pq
+#
+# Recall@k is the share of the exact top-k found. Latency is per single query,
+# the way the API searches, including exact re-ranking where enabled.
+# Compression is raw float32 size over index size.
+
+IVF_NPROBES = (1, 4, 16, 64)
+HNSW_EF_SEARCHES = (16, 64, 256)
+
+
+def synthetic_corpus(n, dim, clusters=256, seed=0):
+    """
+    Clustered vectors, closer to real embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, size=n)
+    vectors = centers[assignment] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recorded_corpus(path, limit=None):
+    """
+    Chunk embeddings stored by earlier builds (see chunk_embeddings.py).
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    query = "SELECT vector FROM embeddings" + (f" LIMIT {int(limit)}" if limit else "")
+    vectors = np.stack([unpack_vector(row[0]) for row in conn.execute(query)])
+    conn.close()
+    return vectors.astype(np.float32)
+
+
+def sample_queries(vectors, count, seed=1):
+    # Perturbed corpus vectors: near neighbours exist, but the query is never an exact copy
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=count, replace=False)]
+    noisy = picked + 0.05 * rng.normal(size=picked.shape).astype(np.float32) * np.abs(picked).mean()
+    return noisy.astype(np.float32)
+
+
+def index_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+
+def run_queries(index, queries, k, vectors=None, **search_kwargs):
+    """
+    With vectors (row id = position), k * RERANK_FACTOR candidates are re-ranked exactly,
+    as CompactIndex does with the vectors shipped next to a quantized index.
+    """
+    params = search_parameters(index, **search_kwargs)
+    fetch = k * RERANK_FACTOR if vectors is not None else k
+    labels = np.full((len(queries), k), -1, dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, found = index.search(query[None, :], fetch, params=params)
+        found = found[0][found[0] >= 0]
+        if vectors is not None:
+            exact = ((vectors[found] - query) ** 2).sum(axis=1)
+            found = found[np.argsort(exact)[:k]]
+        latencies[i] = time.perf_counter() - started
+        labels[i, :len(found)] = found
+    return labels, latencies
+
+
+def recall_at_k(labels, truth):
+    hits = sum(len(set(row[row >= 0]) & set(expected)) for row, expected in zip(labels, truth))
+    return hits / truth.size
+
+
+def benchmark(vectors, queries, k, quantizations=("none",)):
+    row_ids = np.arange(len(vectors), dtype=np.int64)
+    # Exact search first: it is the ground truth for every other row
+    configs = [("flat", "none", {}, False)]
+    for quantization in quantizations:
+        reranks = (False, True) if quantization != "none" else (False,)
+        for rerank in reranks:
+            if quantization != "none":
+                configs.append(("flat", quantization, {}, rerank))
+            configs += [("ivf", quantization, {"nprobe": nprobe}, rerank) for nprobe in IVF_NPROBES]
+            configs += [("hnsw", quantization, {"ef_search": ef}, rerank) for ef in HNSW_EF_SEARCHES]
+
+    raw_bytes = vectors.nbytes
+    truth = None
+    built = {}
+    results = []
+    for index_type, quantization, search_kwargs, rerank in configs:
+        key = (index_type, quantization)
+        if key not in built:
+            started = time.perf_counter()
+            index = build_faiss_index(index_type, vectors, row_ids, quantization)
+            built[key] = (index, time.perf_counter() - started)
+        index, build_seconds = built[key]
+
+        labels, latencies = run_queries(index, queries, k, vectors if rerank else None, **search_kwargs)
+        if truth is None:
+            truth = labels
+        size = index_bytes(index)
+        results.append({
+            "index": index_kind(index),
+            "quant": index_quantization(index) + ("+rr" if rerank else ""),
+            "params": ", ".join(f"{key}={value}" for key, value in search_kwargs.items()) or "-",
+            "recall": recall_at_k(labels, truth),
+            "p50_ms": np.percentile(latencies, 50) * 1000,
+            "p99_ms": np.percentile(latencies, 99) * 1000,
+            "memory_mb": size / 1024 / 1024,
+            "compression": raw_bytes / size,
+            "build_s": build_seconds,
+        })
+    return results
+
+
+def print_results(results, k):
+    print(
+        f"{'index':<6} {'quant':<8} {'params':<14} {f'recall@{k}':>9} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'MB':>8} {'ratio':>6} {'build s':>8}"
+    )
+    for row in results:
+        print(
+            f"{row['index']:<6} {row['quant']:<8} {row['params']:<14} {row['recall']:>9.3f} {row['p50_ms']:>8.3f} "
+            f"{row['p99_ms']:>8.3f} {row['memory_mb']:>8.1f} {row['compression']:>6.1f} {row['build_s']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall / latency / memory of flat, IVF and HNSW indexes.")
+    parser.add_argument("--store", nargs="?", const=CHUNK_EMBEDDING_STORE_PATH, help="use recorded chunk embeddings")
+    parser.add_argument("--n", type=int, default=50000, help="corpus size (synthetic) or limit (recorded)")
+    parser.add_argument("--dim", type=int, default=256, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS, default=["none"],
+                        help="vector compressions to compare (quantized ones also run with exact re-ranking)")
+    args = parser.parse_args()
+
+    if args.store:
+        vectors = recorded_corpus(args.store, args.n)
+        print(f"📂 {len(vectors)} recorded embeddings ({vectors.shape[1]} dims) from {args.store}")
+    else:
+        vectors = synthetic_corpus(args.n, args.dim)
+        print(f"🎲 {len(vectors)} synthetic vectors ({args.dim} dims)")
+
+    queries = sample_queries(vectors, min(args.queries, len(vectors)))
+    print_results(benchmark(vectors, queries, args.k, args.quantization), args.k)
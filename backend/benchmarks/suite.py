@@ -0,0 +1,495 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# End-to-end benchmarks of the pipeline with OpenAI, S3 and the Polígrafo site
+# replaced by the local stand-ins in benchmarks/fakes.py and benchmarks/fixtures.py,
+# so they run offline, cost nothing and are comparable between commits:
+#
+#   cd backend && python -m benchmarks.suite
+#   cd backend && python -m benchmarks.suite --sizes 1000 10000 --concurrency 1 8 --compare benchmarks/results/<old>.json
+#
+# Scenarios: index build throughput (cold, warm chunk store, incremental), cold start
+# (first index download + load + first answer), /ask latency under concurrent load,
+# and scraper parse / end-to-end throughput. Results are written as JSON.
+#
+# The fakes add fixed latencies (see --embedding-latency and friends) in place of
+# the network, so absolute numbers measure our own overhead plus those constants.
+
+# Spawned worker processes (e.g. the scraper's parsers) import this module again:
+# they inherit the environment and so reuse the same work directory
+WORK_DIR = os.environ.get("BENCHMARK_WORK_DIR") or tempfile.mkdtemp(prefix="poligrafo-bench-")
+
+# Must be set before the api modules read them at import time
+os.environ.update({
+    "BENCHMARK_WORK_DIR": WORK_DIR,
+    "S3_BUCKET": "benchmark",
+    "SHARED_DATA_DIR": WORK_DIR,
+    "CHUNK_EMBEDDING_STORE_PATH": os.path.join(WORK_DIR, "chunk_embeddings.sqlite"),
+    "INDEX_CACHE_DIR": os.path.join(WORK_DIR, "cache", "index"),
+    "JOB_LOG_DIR": os.path.join(WORK_DIR, "jobs"),
+    "INDEX_REFRESH_SECONDS": "0",
+    # Every /ask goes through embedding, retrieval and the LLM
+    "ANSWER_CACHE_SIMILARITY": "1.01",
+    "ANSWER_CACHE_WARM_QUERIES": "0",
+    "QUERY_EMBEDDING_CACHE_PATH": "",
+    "QUERY_LOG_PATH": "",
+    "SCRAPE_RATE_PER_HOST": "0",
+    "OPENAI_API_KEY": "benchmark"
+})
+
+from api.src import article_store, build_index as build_module, data_collect as collect_module  # noqa: E402
+from api.src.index_manager import index_manager  # noqa: E402
+from api.src.chatbot import get_fact_check_response  # noqa: E402
+from api.src.chunk_embeddings import CHUNK_EMBEDDING_STORE_PATH  # noqa: E402
+from api.src.article_parser import parse_article_html, HTML_PARSERS, etree  # noqa: E402
+from api.src.index_store import INDEX_CACHE_DIR  # noqa: E402
+from api.src.page_cache import PAGE_CACHE_PATH  # noqa: E402
+from api.src.metrics import registry  # noqa: E402
+from benchmarks.fakes import FakeS3, install_fakes  # noqa: E402
+from benchmarks.fixtures import (  # noqa: E402
+    FixtureSite, synthetic_article, synthetic_record, load_recorded, WORDS
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+SIZES = (1000, 10000, 100000)
+CONCURRENCY = (1, 8, 32)
+BASE_URL = "https://poligrafo.sapo.pt/fact-checks/"
+
+
+class Fakes:
+    """
+    Latencies of the stand-ins, shared by every scenario.
+    """
+
+    def __init__(self, s3_latency=0.0, embedding_latency=0.0, llm_latency=0.0, llm_token_latency=0.0):
+        self.s3_latency = s3_latency
+        self.embedding_latency = embedding_latency
+        self.llm_latency = llm_latency
+        self.llm_token_latency = llm_token_latency
+
+    def install(self):
+        """
+        Points the app at a fresh, empty S3 and returns it.
+        """
+        s3 = FakeS3(latency=self.s3_latency)
+        install_fakes(s3, self.embedding_latency, self.llm_latency, self.llm_token_latency)
+        return s3
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+@contextmanager
+def quiet():
+    """
+    Sends the pipeline's per-article progress output to a log file instead of the terminal.
+    """
+    with open(os.path.join(WORK_DIR, "pipeline.log"), "a", encoding="utf-8") as log:
+        stdout = sys.stdout
+        sys.stdout = log
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def stage_totals():
+    """
+    {stage: seconds} recorded since the last registry.reset().
+    """
+    values = registry.snapshot().get("stage_seconds", {})
+    return {key[0]: round(total, 4) for key, (_, total, _) in values.items()}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(latencies):
+    return {
+        "count": len(latencies),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        **{f"p{q}_ms": round(percentile(latencies, q) * 1000, 2) if latencies else None for q in (50, 90, 99)},
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None
+    }
+
+
+def chunks_per_article():
+    articles = [synthetic_record(n, BASE_URL) for n in range(20)]
+    chunks, _, _ = build_module.split_articles(articles)
+    return len(chunks) / len(articles)
+
+
+def store_articles(start, count):
+    with quiet(), article_store.SegmentWriter(flush_size=1000) as writer:
+        for n in range(start, start + count):
+            writer.add(synthetic_record(n, BASE_URL))
+
+
+def reset_chunk_store():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(CHUNK_EMBEDDING_STORE_PATH + suffix):
+            os.remove(CHUNK_EMBEDDING_STORE_PATH + suffix)
+
+
+def timed_build(**kwargs):
+    registry.reset()
+    started = time.perf_counter()
+    with quiet():
+        build_module.build_index(**kwargs)
+    return time.perf_counter() - started, stage_totals()
+
+
+def bench_build(fakes, sizes, index_type):
+    """
+    Index build throughput for each corpus size, in chunks per second:
+    cold (every chunk embedded), warm (chunk store already filled, as on a
+    rebuild) and incremental (1% new articles merged into the published index).
+    """
+    per_article = chunks_per_article()
+    results = []
+    for size in sizes:
+        s3 = fakes.install()
+        reset_chunk_store()
+        articles = max(1, round(size / per_article))
+        started = time.perf_counter()
+        store_articles(0, articles)
+        ingest_seconds = time.perf_counter() - started
+
+        cold_seconds, cold_stages = timed_build(rebuild=True, index_type=index_type)
+        warm_seconds, warm_stages = timed_build(rebuild=True, index_type=index_type)
+
+        added = max(1, articles // 100)
+        store_articles(articles, added)
+        incremental_seconds, incremental_stages = timed_build(index_type=index_type)
+
+        chunks = round(articles * per_article)
+        result = {
+            "chunks": chunks,
+            "articles": articles,
+            "index_type": index_type,
+            "ingest_seconds": round(ingest_seconds, 3),
+            "cold_seconds": round(cold_seconds, 3),
+            "cold_chunks_per_second": round(chunks / cold_seconds, 1),
+            "warm_seconds": round(warm_seconds, 3),
+            "warm_chunks_per_second": round(chunks / warm_seconds, 1),
+            "incremental_articles": added,
+            "incremental_seconds": round(incremental_seconds, 3),
+            "s3_bytes": s3.size_bytes,
+            "stages": {"cold": cold_stages, "warm": warm_stages, "incremental": incremental_stages}
+        }
+        print(
+            f"🏗️ build {chunks} chunks: cold {result['cold_chunks_per_second']}/s, "
+            f"warm {result['warm_chunks_per_second']}/s, incremental +{added} articles in {incremental_seconds:.2f}s"
+        )
+        results.append(result)
+    return results
+
+
+def bench_cold_start(fakes):
+    """
+    Time from an empty local cache to the first answer: manifest read, index
+    download, load, then one query. Also a restart with the cache already filled.
+    """
+    registry.reset()
+    shutil.rmtree(INDEX_CACHE_DIR, ignore_errors=True)
+    index_manager._snapshot = None
+
+    started = time.perf_counter()
+    with quiet():
+        index_manager.refresh(force=True)
+    loaded = time.perf_counter()
+    get_fact_check_response("O salário mínimo aumentou este ano?", log_query=False)
+    answered = time.perf_counter()
+    stages = stage_totals()
+
+    index_manager._snapshot = None
+    started_warm = time.perf_counter()
+    with quiet():
+        index_manager.refresh(force=True)
+    warm_loaded = time.perf_counter()
+
+    result = {
+        "load_seconds": round(loaded - started, 4),
+        "first_answer_seconds": round(answered - loaded, 4),
+        "total_seconds": round(answered - started, 4),
+        "cached_load_seconds": round(warm_loaded - started_warm, 4),
+        "vectors": index_manager.current().index.ntotal,
+        "stages": stages
+    }
+    print(
+        f"🧊 cold start: {result['total_seconds']}s to first answer "
+        f"(load {result['load_seconds']}s, cached load {result['cached_load_seconds']}s)"
+    )
+    return result
+
+
+def claims(count, seed=0):
+    """
+    Distinct claims, so neither the query embedding cache nor the answer cache hit.
+    """
+    import random
+
+    rng = random.Random(seed)
+    return [f"{' '.join(rng.choice(WORDS) for _ in range(12))} ({i})?" for i in range(count)]
+
+
+async def load_test(path, payloads, concurrency):
+    import httpx
+    from api.main import app
+
+    latencies = []
+    errors = 0
+    queue = list(reversed(payloads))
+
+    async def worker(client):
+        nonlocal errors
+        while queue:
+            payload = queue.pop()
+            started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def bench_ask(concurrency_levels, requests_per_level, threshold):
+    """
+    /ask latency percentiles and throughput at each concurrency level, through
+    the real FastAPI app (middleware, validation, threadpool) in-process.
+    """
+    results = []
+    for level, concurrency in enumerate(concurrency_levels):
+        payloads = [
+            {"query": claim, "source_threshold": threshold}
+            for claim in claims(requests_per_level, seed=level + 1)
+        ]
+        registry.reset()
+        latencies, errors, elapsed = asyncio.run(load_test("/ask", payloads, concurrency))
+        result = {
+            "concurrency": concurrency,
+            **latency_summary(latencies),
+            "requests_per_second": round(len(latencies) / elapsed, 2),
+            "errors": errors,
+            "stages": stage_totals()
+        }
+        print(
+            f"💬 /ask x{concurrency}: p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+            f"{result['requests_per_second']} req/s, {errors} errors"
+        )
+        results.append(result)
+    return results
+
+
+def bench_parse(pages):
+    """
+    Article page parsing throughput of each parser backend, on recorded pages when
+    benchmarks/fixtures holds some and on synthetic ones otherwise. Also counts the
+    pages where a backend's article differs from html.parser's.
+    """
+    recorded = load_recorded(FIXTURES_DIR)
+    fixtures = recorded or [synthetic_article(n, BASE_URL) for n in range(pages)]
+    size = sum(len(html.encode("utf-8")) for _, html in fixtures)
+
+    result = {"fixtures": "recorded" if recorded else "synthetic", "pages": len(fixtures)}
+    parsed = {}
+    for parser in HTML_PARSERS:
+        if parser == "lxml" and etree is None:
+            continue
+        started = time.perf_counter()
+        with quiet():
+            parsed[parser] = [parse_article_html(html, url, parser=parser) for url, html in fixtures]
+        elapsed = time.perf_counter() - started
+        result[parser] = {
+            "seconds": round(elapsed, 4),
+            "pages_per_second": round(len(fixtures) / elapsed, 1),
+            "mb_per_second": round(size / elapsed / 1024 / 1024, 2)
+        }
+    for parser, articles in parsed.items():
+        result[parser]["mismatches"] = sum(a != b for a, b in zip(articles, parsed["html.parser"]))
+        print(
+            f"🧩 parse ({parser}): {result[parser]['pages_per_second']} pages/s "
+            f"({result[parser]['mb_per_second']} MB/s, {result['fixtures']}), "
+            f"{result[parser]['mismatches']} pages differ from html.parser"
+        )
+    return result
+
+
+def bench_scrape(fakes, articles, per_page, site_latency):
+    """
+    data_collect end to end against a local copy of the site: listing walk,
+    concurrent downloads, parsing and segment writes to S3. Then the runs that
+    follow it: an incremental run with nothing new, and a backfill over the same
+    pages re-validated through the page cache.
+    """
+    fakes.install()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(PAGE_CACHE_PATH + suffix):
+            os.remove(PAGE_CACHE_PATH + suffix)
+    pages = -(-articles // per_page)
+    runs = {}
+
+    with FixtureSite(total=articles, per_page=per_page, latency=site_latency) as site:
+        base_url = collect_module.BASE_URL
+        collect_module.BASE_URL = site.base_url
+        try:
+            for run, backfill_pages in (("backfill", pages), ("incremental", None), ("revalidate", pages)):
+                registry.reset()
+                requests_before, bytes_before, not_modified_before = site.requests, site.bytes_sent, site.not_modified
+                started = time.perf_counter()
+                with quiet():
+                    collect_module.data_collect(backfill_pages=backfill_pages)
+                runs[run] = {
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "http_requests": site.requests - requests_before,
+                    "not_modified": site.not_modified - not_modified_before,
+                    "bytes_downloaded": site.bytes_sent - bytes_before,
+                    "stages": stage_totals()
+                }
+        finally:
+            collect_module.BASE_URL = base_url
+
+    stored, _ = article_store.load_url_index()
+    result = {
+        "articles": len(stored),
+        "site_latency": site_latency,
+        **runs["backfill"],
+        "articles_per_second": round(len(stored) / runs["backfill"]["seconds"], 1),
+        "incremental": runs["incremental"],
+        "revalidate": runs["revalidate"]
+    }
+    print(
+        f"🕷️ scrape: {len(stored)} articles in {result['seconds']:.2f}s ({result['articles_per_second']}/s); "
+        f"incremental {runs['incremental']['seconds']:.2f}s / {runs['incremental']['http_requests']} requests; "
+        f"revalidate {runs['revalidate']['seconds']:.2f}s, {runs['revalidate']['not_modified']} not modified"
+    )
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix=""):
+    """
+    {"a": {"b": 1}, "c": [{"d": 2}]} -> {"a.b": 1, "c.0.d": 2}, numbers only.
+    """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = flatten(json.load(f)["results"])
+    current = flatten(results)
+    print(f"\n📊 Compared with {baseline_path}:")
+    for key in sorted(current):
+        if key in baseline and baseline[key] and ".stages." not in key:
+            change = (current[key] - baseline[key]) / abs(baseline[key]) * 100
+            print(f"  {key:<45} {baseline[key]:>12} -> {current[key]:>12}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks with local stand-ins for OpenAI, S3 and the site.")
+    parser.add_argument("--scenarios", nargs="+", default=["build", "cold_start", "ask", "scrape"],
+                        choices=["build", "cold_start", "ask", "scrape"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES, help="index sizes, in chunks")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--serving-size", type=int, default=10000, help="chunks in the index served to /ask")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=200, help="/ask requests per concurrency level")
+    parser.add_argument("--threshold", type=float, default=1.5, help="source_threshold sent with /ask")
+    parser.add_argument("--parse-pages", type=int, default=500)
+    parser.add_argument("--scrape-articles", type=int, default=400)
+    parser.add_argument("--per-page", type=int, default=20, help="articles per listing page")
+    parser.add_argument("--s3-latency", type=float, default=0.005, help="seconds per S3 call")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embeddings request")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to the first LLM token")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="seconds per further LLM token")
+    parser.add_argument("--site-latency", type=float, default=0.02, help="seconds per fixture site response")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier result file to print changes against")
+    args = parser.parse_args()
+
+    fakes = Fakes(args.s3_latency, args.embedding_latency, args.llm_latency, args.llm_token_latency)
+    results = {}
+    try:
+        if "build" in args.scenarios:
+            results["build"] = bench_build(fakes, args.sizes, args.index_type)
+        if "cold_start" in args.scenarios or "ask" in args.scenarios:
+            # One published index serves both
+            bench_build(fakes, [args.serving_size], args.index_type)
+            if "cold_start" in args.scenarios:
+                results["cold_start"] = bench_cold_start(fakes)
+            if "ask" in args.scenarios:
+                index_manager.current()
+                results["ask"] = bench_ask(args.concurrency, args.requests, args.threshold)
+        if "scrape" in args.scenarios:
+            results["parse"] = bench_parse(args.parse_pages)
+            results["scrape"] = bench_scrape(fakes, args.scrape_articles, args.per_page, args.site_latency)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {**vars(args), "fakes": fakes.to_dict()},
+        "results": results
+    }
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Results written to {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import pytest
+
+# The api modules read their settings at import time: point them at a scratch
+# directory and keep them off the network before any test module imports them.
+# Run with: cd backend && python -m pytest
+WORK_DIR = tempfile.mkdtemp(prefix="poligrafo-tests-")
+os.environ.update({
+    "S3_BUCKET": "tests",
+    "SHARED_DATA_DIR": WORK_DIR,
+    "CHUNK_EMBEDDING_STORE_PATH": os.path.join(WORK_DIR, "chunk_embeddings.sqlite"),
+    "INDEX_CACHE_DIR": os.path.join(WORK_DIR, "cache", "index"),
+    "PAGE_CACHE_PATH": "",
+    "JOB_LOG_DIR": os.path.join(WORK_DIR, "jobs"),
+    "INDEX_REFRESH_SECONDS": "0",
+    "ANSWER_CACHE_WARM_QUERIES": "0",
+    "QUERY_EMBEDDING_CACHE_PATH": "",
+    "QUERY_LOG_PATH": "",
+    "SCRAPE_RATE_PER_HOST": "0",
+    "OPENAI_API_KEY": "tests",
+    "AWS_DEFAULT_REGION": "eu-west-1"
+})
+
+
+@pytest.fixture
+def fake_s3():
+    """
+    Every module that talks to S3 or OpenAI pointed at the benchmarks' local stand-ins.
+    """
+    from benchmarks.fakes import FakeS3, install_fakes
+
+    s3 = FakeS3()
+    install_fakes(s3)
+    return s3
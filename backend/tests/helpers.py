@@ -0,0 +1,93 @@
+from contextlib import asynccontextmanager
+from aiohttp import web
+from langchain_core.documents import Document
+import time
+import numpy as np
+
+VERDICTS = ("Falso", "Verdadeiro", "Enganador")
+
+
+def make_chunks(count, dim=32, seed=0):
+    """
+    (chunk ids, Documents, float32 vectors) of count chunks spread over 2023-2024,
+    one article per 3 chunks.
+    """
+    rng = np.random.default_rng(seed)
+    ids, docs = [], []
+    for n in range(count):
+        article = n // 3
+        aid = f"{article + 1:016x}"
+        month = 1 + article % 12
+        year = 2023 + (article // 12) % 2
+        ids.append(f"{aid}-{n % 3}")
+        docs.append(Document(
+            page_content=f"Texto do excerto {n} sobre o artigo {article}.",
+            metadata={
+                "source": f"https://poligrafo.sapo.pt/fact-checks/artigo-{article}/",
+                "title": f"Artigo {article}",
+                "verdict": VERDICTS[article % len(VERDICTS)],
+                "published": f"{year:04d}-{month:02d}-15T10:00:00",
+                "article_id": aid
+            }
+        ))
+    return ids, docs, rng.normal(size=(count, dim)).astype(np.float32)
+
+
+WORDS = ("governo", "salário", "mínimo", "inflação", "pensões", "rendas", "vacina", "orçamento", "impostos",
+         "escolas", "hospitais", "energia", "Lisboa", "Porto", "dados", "oficiais", "relatório", "euros")
+FOOTER = (
+    "Nota metodológica: o Polígrafo verifica as afirmações com base em dados oficiais e fontes primárias, "
+    "contactando os visados sempre que possível. Saiba mais sobre a nossa metodologia e sobre como pode "
+    "sugerir uma verificação através do formulário ou das redes sociais."
+)
+
+
+def make_article(n, rng, footer=True):
+    """
+    A ChunkStream input of four random paragraphs, ending in the shared FOOTER unless footer is False.
+    """
+    paragraphs = [" ".join(rng.choice(WORDS) for _ in range(60)).capitalize() + "." for _ in range(4)]
+    if footer:
+        paragraphs.append(FOOTER)
+    aid = f"{n + 1:016x}"
+    return aid, Document(page_content="\n\n".join(paragraphs), metadata={"article_id": aid}), {"url": f"u{n}"}
+
+
+ARRIVALS = web.AppKey("arrivals", list)
+
+
+@asynccontextmanager
+async def serve(handler):
+    """
+    Local server answering every path with handler(request), which sees the
+    arrival times of all requests so far in app[ARRIVALS].
+    """
+    app = web.Application()
+    app[ARRIVALS] = []
+
+    async def handle(request):
+        request.app[ARRIVALS].append((request.host, time.monotonic()))
+        return await handler(request)
+
+    app.router.add_get("/{path:.*}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield app, port
+    finally:
+        await runner.cleanup()
+
+
+def scripted(*responses):
+    """
+    Handler answering with the given responses in order, then repeating the last one.
+    """
+    queue = list(responses)
+
+    async def handler(request):
+        return queue.pop(0)() if len(queue) > 1 else queue[0]()
+
+    return handler
@@ -0,0 +1,21 @@
+import os
+import time
+
+# Job functions for tests/test_jobs.py. They run in spawned worker processes,
+# so they live in a module the workers can import.
+
+
+def wait_for_release(release, label):
+    """
+    Prints its progress and returns once the file release exists.
+    """
+    print(f"started {label}")
+    while not os.path.exists(release):
+        time.sleep(0.01)
+    print(f"released {label}")
+    return label
+
+
+def fail(message):
+    print("about to fail")
+    raise ValueError(message)
@@ -0,0 +1,135 @@
+import threading
+from api.src import article_store, build_index as build_module, chatbot
+from api.src.answer_cache import SemanticAnswerCache, QueryLog, answer_cache
+from api.src.attribute_index import SearchFilter
+from api.src.index_manager import index_manager
+from api.src.request_coalescing import LLMGate
+from benchmarks.fixtures import synthetic_record
+
+VECTOR = [1.0, 0.0, 0.0]
+OPTIONS = (None, 5, None, None, None)
+
+
+def test_same_normalized_question_hits():
+    cache = SemanticAnswerCache()
+    cache.store("Foram encerrados 60 concelhos?", VECTOR, "v1", OPTIONS, {"answer": "Falso"})
+
+    assert cache.lookup("  foram ENCERRADOS 60 concelhos? ", VECTOR, "v1", OPTIONS) == {
+        "answer": "Falso", "cached": True
+    }
+
+
+def test_similar_claims_do_not_share_answers_by_default():
+    cache = SemanticAnswerCache()
+    cache.store("Foram encerrados 60 concelhos", VECTOR, "v1", OPTIONS, {"answer": "Falso"})
+
+    # Embeddings of claims differing in a number or a negation are nearly identical
+    assert cache.lookup("Foram encerrados 70 concelhos", VECTOR, "v1", OPTIONS) is None
+    assert cache.lookup("Não foram encerrados 60 concelhos", VECTOR, "v1", OPTIONS) is None
+
+
+def test_semantic_matching_is_opt_in():
+    cache = SemanticAnswerCache(similarity=0.99)
+    cache.store("O IVA subiu", VECTOR, "v1", OPTIONS, {"answer": "Verdadeiro"})
+
+    assert cache.lookup("Subiu o IVA", [1.0, 0.01, 0.0], "v1", OPTIONS)["answer"] == "Verdadeiro"
+    assert cache.lookup("Outra pergunta", [0.0, 1.0, 0.0], "v1", OPTIONS) is None
+
+
+def test_answers_are_scoped_by_version_and_retrieval_options():
+    cache = SemanticAnswerCache()
+    cache.store("pergunta", VECTOR, "v1", OPTIONS, {"answer": "sem filtro"})
+
+    filtered = (None, 5, None, None, (("falso",), None, None, None))
+    assert cache.lookup("pergunta", VECTOR, "v1", filtered) is None
+    assert cache.lookup("pergunta", VECTOR, "v1", (0.5, 5, None, None, None)) is None
+    assert cache.lookup("pergunta", VECTOR, "v1", (None, 3, None, None, None)) is None
+    assert cache.lookup("pergunta", VECTOR, "v1", (None, 5, 16, None, None)) is None
+    assert cache.lookup("pergunta", VECTOR, "v2", OPTIONS) is None
+
+    cache.store("pergunta", VECTOR, "v1", filtered, {"answer": "com filtro"})
+    assert cache.lookup("pergunta", VECTOR, "v1", filtered)["answer"] == "com filtro"
+    assert cache.lookup("pergunta", VECTOR, "v1", OPTIONS)["answer"] == "sem filtro"
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store("a", VECTOR, "v1", OPTIONS, {"answer": "a"})
+    cache.store("b", VECTOR, "v1", OPTIONS, {"answer": "b"})
+    cache.lookup("a", VECTOR, "v1", OPTIONS)
+    cache.store("c", VECTOR, "v1", OPTIONS, {"answer": "c"})
+
+    assert cache.lookup("b", VECTOR, "v1", OPTIONS) is None
+    assert cache.lookup("a", VECTOR, "v1", OPTIONS) is not None
+    assert cache.stats()["entries"] == 2
+
+
+def test_retain_version_drops_other_versions():
+    cache = SemanticAnswerCache()
+    cache.store("a", VECTOR, "v1", OPTIONS, {"answer": "old"})
+    cache.store("a", VECTOR, "v2", OPTIONS, {"answer": "new"})
+    cache.retain_version("v2")
+
+    assert cache.lookup("a", VECTOR, "v1", OPTIONS) is None
+    assert cache.lookup("a", VECTOR, "v2", OPTIONS)["answer"] == "new"
+    assert cache.stats()["entries"] == 1
+
+
+def test_query_log_keeps_the_options_across_restarts(tmp_path):
+    path = str(tmp_path / "query_log.jsonl")
+    filtered = chatbot.answer_options(0.8, 3, None, 64, SearchFilter(verdicts=["Falso"], published_from="2024-01-01"))
+    log = QueryLog(path)
+    log.record("O IVA subiu?", filtered)
+    log.record("o iva  SUBIU?", filtered)
+    log.record("O IVA subiu?", OPTIONS)
+
+    assert QueryLog(path).most_common(5) == log.most_common(5) == [("o iva subiu?", filtered), ("o iva subiu?", OPTIONS)]
+
+
+def publish_and_load(count=9):
+    with article_store.SegmentWriter() as writer:
+        for n in range(count):
+            writer.add(synthetic_record(n, "https://poligrafo.sapo.pt/fact-checks/"))
+    build_module.build_index()
+    index_manager.refresh(force=True)
+    return index_manager.current()
+
+
+def test_warming_replays_queries_with_their_options(fake_s3, monkeypatch):
+    snapshot = publish_and_load()
+    log = QueryLog()
+    monkeypatch.setattr(chatbot, "query_log", log)
+    question = synthetic_record(4)["title"]
+    search_filter = SearchFilter(verdicts=[synthetic_record(4)["verdict"]])
+    options = chatbot.answer_options(None, 2, None, None, search_filter)
+    log.record(question, options)
+
+    assert chatbot.warm_answer_cache(snapshot, limit=5) == 1
+    # Cached in the scope the question was asked in, and only there
+    vector = snapshot.embeddings.embed_query(question)
+    assert answer_cache.lookup(question, vector, snapshot.version, options)["cached"]
+    assert answer_cache.lookup(question, vector, snapshot.version, chatbot.answer_options()) is None
+    response = chatbot.get_fact_check_response(question, k=2, search_filter=search_filter, log_query=False)
+    assert response["cached"]
+
+
+def test_warming_waits_for_a_slot_instead_of_being_rejected(fake_s3, monkeypatch):
+    snapshot = publish_and_load()
+    log = QueryLog()
+    log.record(synthetic_record(1)["title"], chatbot.answer_options())
+    monkeypatch.setattr(chatbot, "query_log", log)
+    # One slot, no queue: a user request now would get a 429
+    gate = LLMGate(concurrency=1, max_queue=0, timeout=0.1)
+    monkeypatch.setattr(chatbot, "llm_gate", gate)
+    gate.acquire()
+
+    warmed = []
+    warming = threading.Thread(target=lambda: warmed.append(chatbot.warm_answer_cache(snapshot, limit=5)))
+    warming.start()
+    warming.join(0.5)
+    assert warming.is_alive()
+
+    gate.release()
+    warming.join(10)
+    assert warmed == [1]
+
@@ -0,0 +1,57 @@
+import os
+import pytest
+from api.src.article_parser import HTML_PARSERS, DATE_CLASS, parse_article_html
+from benchmarks import fixtures
+from benchmarks.fixtures import load_recorded, synthetic_article
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), "pages")
+# Where `python -m benchmarks.fixtures --record` saves real pages
+RECORDED_DIR = os.path.join(os.path.dirname(fixtures.__file__), "fixtures")
+
+
+def saved_pages():
+    pages = [
+        (f"https://poligrafo.sapo.pt/fact-checks/{os.path.splitext(name)[0]}/", name)
+        for name in sorted(os.listdir(PAGES_DIR))
+    ]
+    return [(url, open(os.path.join(PAGES_DIR, name), encoding="utf-8").read()) for url, name in pages]
+
+
+PAGES = saved_pages() + load_recorded(RECORDED_DIR) + [synthetic_article(n) for n in range(10)]
+
+
+def parse_with_each_parser(html, url):
+    articles = [parse_article_html(html, url, parser) for parser in HTML_PARSERS]
+    if DATE_CLASS not in html:
+        # Undated articles are stamped with the time they were parsed
+        for article in articles:
+            del article["published"]
+    return articles
+
+
+@pytest.mark.parametrize("url,html", PAGES, ids=[url for url, _ in PAGES])
+def test_parsers_agree_on_fixture_pages(url, html):
+    lxml_article, soup_article = parse_with_each_parser(html, url)
+    assert lxml_article == soup_article
+    assert lxml_article["content"]
+
+
+def test_text_inside_template_is_left_out_at_any_depth():
+    html = (
+        '<div class="elementor-widget-theme-post-content"><p>Texto</p>'
+        '<template><p>Modelo <b>oculto</b></p></template></div>'
+    )
+    for article in parse_with_each_parser(html, "u"):
+        assert article["content"] == "Texto\n\n"
+
+
+@pytest.mark.parametrize("body,lxml_paragraphs,soup_paragraphs", [
+    # lxml closes the open <p> like a browser would; html.parser nests the second one in it
+    ("<p>um<p>dois</p>três", ["um", "dois"], ["umdoistrês", "dois"]),
+    ("<p>um <div>dois</div> três</p>", ["um"], ["umdoistrês"]),
+])
+def test_badly_nested_paragraphs_differ_between_parsers(body, lxml_paragraphs, soup_paragraphs):
+    html = f'<html><body><h1>T</h1><div class="elementor-widget-theme-post-content">{body}</div></body></html>'
+    lxml_article, soup_article = parse_with_each_parser(html, "u")
+    assert lxml_article["content"].split("\n\n") == lxml_paragraphs
+    assert soup_article["content"].split("\n\n") == soup_paragraphs
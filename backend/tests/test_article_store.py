@@ -0,0 +1,89 @@
+import json
+from api.src import article_store
+from api.src.article_store import SegmentWriter, compact_segments, iter_articles, iter_articles_by_url, list_segment_keys
+
+
+def article(n, content="Conteúdo original."):
+    return {
+        "url": f"https://poligrafo.sapo.pt/fact-checks/artigo-{n}/",
+        "title": f"Artigo {n}",
+        "verdict": "Falso",
+        "content": content,
+        "published": "2024-03-01T10:00:00"
+    }
+
+
+def store(*batches):
+    for batch in batches:
+        with SegmentWriter(flush_size=2) as writer:
+            for item in batch:
+                writer.add(item)
+
+
+def test_writer_skips_unchanged_copies(fake_s3):
+    store([article(1), article(2)])
+    with SegmentWriter() as writer:
+        assert writer.add(article(1)) is None
+        assert writer.add(article(2, "Conteúdo corrigido.")) == "changed"
+        assert writer.add(article(3)) == "added"
+
+    assert {item["url"]: item["content"] for item in iter_articles()} == {
+        article(1)["url"]: "Conteúdo original.",
+        article(2)["url"]: "Conteúdo corrigido.",
+        article(3)["url"]: "Conteúdo original."
+    }
+
+
+def test_compaction_keeps_only_the_latest_copy_of_each_url(fake_s3):
+    fake_s3.put_object(
+        Bucket="tests", Key=article_store.S3_LEGACY_ARTICLES_KEY,
+        Body=json.dumps([article(0), article(1, "Versão antiga.")]).encode("utf-8")
+    )
+    store(
+        [article(1), article(2), article(3)],
+        [article(2, "Segunda versão."), article(4)],
+        [article(2, "Terceira versão."), article(5)]
+    )
+    before = {item["url"]: item["content"] for item in iter_articles()}
+    assert len(list_segment_keys()) >= 3
+
+    assert compact_segments(min_segments=2, segment_size=4)
+
+    after = list(iter_articles())
+    assert {item["url"]: item["content"] for item in after} == before
+    assert len(after) == len(before) == 6
+    assert before[article(2)["url"]] == "Terceira versão."
+    assert len(list_segment_keys()) == 2
+    assert article_store.S3_LEGACY_ARTICLES_KEY not in fake_s3.objects
+    # The URL index points every article at its compacted segment
+    urls = [article(n)["url"] for n in range(6)]
+    assert sorted(item["url"] for item in iter_articles_by_url(urls)) == sorted(urls)
+
+
+def test_compaction_waits_for_enough_segments(fake_s3):
+    store([article(1)])
+    assert not compact_segments(min_segments=5)
+    assert len(list_segment_keys()) == 1
+
+
+def test_compaction_keeps_urls_rewritten_while_it_updates_the_index(fake_s3, monkeypatch):
+    store([article(1), article(2)], [article(3)])
+    load_url_index = article_store.load_url_index
+    interleaved = []
+
+    def stale_load():
+        # Another writer updates article 2 after compaction read the index, before it saves
+        loaded = load_url_index()
+        if not interleaved:
+            interleaved.append(True)
+            store([article(2, "Versão concorrente.")])
+        return loaded
+
+    monkeypatch.setattr(article_store, "load_url_index", stale_load)
+    assert compact_segments(min_segments=2, segment_size=4)
+    monkeypatch.undo()
+
+    index, _ = article_store.load_url_index()
+    assert "compacted" not in index[article(2)["url"]]["segment"]
+    assert "compacted" in index[article(1)["url"]]["segment"]
+    assert [item["content"] for item in iter_articles_by_url([article(2)["url"]])] == ["Versão concorrente."]
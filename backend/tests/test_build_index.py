@@ -0,0 +1,48 @@
+import random
+from api.src import article_store, build_index as build_module
+from api.src.index_manager import IndexManager
+from api.src.index_store import load_index_manifest, load_index_metadata
+from tests.helpers import FOOTER, make_article
+
+
+def record(n, footer=True, seed=0):
+    _, doc, _ = make_article(n, random.Random(seed * 1000 + n), footer=footer)
+    return {
+        "url": f"https://poligrafo.sapo.pt/fact-checks/artigo-{n}/",
+        "title": f"Artigo {n}",
+        "verdict": "Falso",
+        "content": doc.page_content,
+        "published": f"2024-03-{n + 1:02d}T10:00:00"
+    }
+
+
+def store(*records):
+    with article_store.SegmentWriter() as writer:
+        for item in records:
+            writer.add(item)
+
+
+def indexed_texts():
+    manager = IndexManager()
+    manager.refresh()
+    index = manager.current().index
+    return sorted(index._with_connection(lambda conn: [row[0] for row in conn.execute("SELECT page_content FROM chunks")]))
+
+
+def test_incremental_build_restores_chunks_the_changed_article_kept(fake_s3):
+    store(*(record(n) for n in range(5)))
+    build_module.build_index()
+    assert indexed_texts().count(FOOTER) == 1
+    manifest, _ = load_index_manifest()
+    indexed = load_index_metadata(manifest, "indexed_articles.json")
+    keeper = article_store.article_id(record(0)["url"])
+    assert [list(entry.get("dropped", {}).values()) for entry in indexed.values()].count([keeper]) == 4
+
+    # The article that kept the shared footer drops it: another one has to carry it now
+    store(record(0, footer=False, seed=1))
+    build_module.build_index()
+    incremental = indexed_texts()
+    assert incremental.count(FOOTER) == 1
+
+    build_module.build_index(rebuild=True)
+    assert incremental == indexed_texts()
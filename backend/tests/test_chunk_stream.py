@@ -0,0 +1,20 @@
+import random
+from api.src.chunker import ChunkStream
+from tests.helpers import make_article
+
+
+def test_parallel_stream_matches_sequential_split():
+    rng = random.Random(2)
+    articles = [make_article(n, rng, footer=n % 2 == 0) for n in range(40)]
+
+    sequential = ChunkStream(iter(articles), workers=0).collect()
+    stream = ChunkStream(iter(articles), batch_size=25, workers=2, task_articles=4)
+    batches = list(stream)
+
+    assert len(batches) > 1
+    assert [chunk_id for _, ids, _ in batches for chunk_id in ids] == sequential[1]
+    assert [chunk.page_content for chunks, _, _ in batches for chunk in chunks] == [
+        chunk.page_content for chunk in sequential[0]
+    ]
+    assert stream.processes == 2
+    assert stream.chunk_count == len(sequential[0])
@@ -0,0 +1,54 @@
+from langchain_core.documents import Document
+from api.src import context_builder
+from api.src.context_builder import build_context, count_tokens, select_chunks, trim_to_budget
+
+CLAIM = "O salário mínimo subiu 60 euros em 2024"
+ARTICLE = (
+    "O primeiro-ministro afirmou que o salário mínimo subiu 60 euros em 2024. "
+    "A afirmação é falsa. "
+    "Segundo o decreto publicado, o aumento foi de 50 euros."
+)
+
+
+def doc(text, source="https://poligrafo.sapo.pt/fact-checks/artigo/"):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_chunks_that_fit_are_sent_whole():
+    context, tokens = build_context(CLAIM, [(doc(ARTICLE), 0.2)], token_budget=500)
+
+    # The verdict sentence shares no terms with the claim but must survive
+    assert context[0][0].page_content == ARTICLE
+    assert tokens == count_tokens(ARTICLE) + context_builder.DOCUMENT_OVERHEAD_TOKENS
+
+
+def test_chunks_over_the_budget_keep_matching_sentences_first():
+    filler = " ".join(f"Frase de contexto número {n} sem relação." for n in range(200))
+    text = ARTICLE + " " + filler
+    context, tokens = build_context(CLAIM, [(doc(text), 0.2)], token_budget=80)
+
+    assert tokens <= 80
+    sent = context[0][0].page_content
+    assert sent.startswith("O primeiro-ministro afirmou")
+    assert len(sent) < len(text)
+
+
+def test_trim_fills_the_budget_best_match_first_in_original_order():
+    sentences = ("Primeira frase.", "Segunda frase sobre o IVA.", "Terceira frase.")
+    budget = count_tokens(sentences[0]) + count_tokens(sentences[1])
+    text, tokens = trim_to_budget(" ".join(sentences), {"iva"}, budget)
+
+    assert text == "Primeira frase. Segunda frase sobre o IVA."
+    assert tokens <= budget
+
+
+def test_context_never_exceeds_the_budget():
+    results = [(doc(ARTICLE * 5, source=f"s{n}"), 0.2 + n * 0.01) for n in range(5)]
+    _, tokens = build_context(CLAIM, results, token_budget=200)
+    assert tokens <= 200
+
+
+def test_select_chunks_keeps_those_close_to_the_best_score():
+    results = [(doc("a"), 0.3), (doc("b"), 0.4), (doc("c"), 0.9)]
+    assert [d.page_content for d, _ in select_chunks(results, margin=0.15)] == ["a", "b"]
+    assert select_chunks([]) == []
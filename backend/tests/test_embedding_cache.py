@@ -0,0 +1,71 @@
+import asyncio
+import unicodedata
+from api.src.embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+from benchmarks.fakes import HashingEmbeddings
+
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """
+    HashingEmbeddings that remembers every text it was asked to embed.
+    """
+
+    def __init__(self):
+        super().__init__(dimensions=16)
+        self.seen = []
+
+    def embed_documents(self, texts):
+        self.seen.extend(texts)
+        return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        self.seen.extend(texts)
+        return await super().aembed_documents(texts)
+
+
+def cached(tmp_path=None):
+    model = RecordingEmbeddings()
+    disk_path = str(tmp_path / "queries.sqlite") if tmp_path else None
+    return model, CachedQueryEmbeddings(model, QueryEmbeddingCache(max_entries=100, disk_path=disk_path))
+
+
+def test_variants_share_a_vector_embedded_from_the_original_text():
+    model, embeddings = cached()
+    first = embeddings.embed_query("O IVA subiu em 2024?")
+
+    # Case and spacing variants are hits
+    for variant in ("o iva subiu em 2024?", "  O IVA   SUBIU em 2024? ", "O IVA subiu em 2024?\n"):
+        assert embeddings.embed_query(variant) == first
+    assert asyncio.run(embeddings.aembed_query("O IVA SUBIU EM 2024?")) == first
+    assert model.seen == ["O IVA subiu em 2024?"]
+
+    # Anything else is a miss, embedded as asked
+    embeddings.embed_query("O IVA desceu em 2024?")
+    asyncio.run(embeddings.aembed_query("O IRS desceu?"))
+    assert model.seen[1:3] == ["O IVA desceu em 2024?", "O IRS desceu?"]
+    assert embeddings.cache.hits == 4
+    assert embeddings.cache.misses == 3
+
+
+def test_batches_embed_each_missing_question_once_as_first_asked():
+    model, embeddings = cached()
+    embeddings.embed_query("Vacinas causam autismo?")
+
+    vectors = embeddings.embed_queries(
+        # The third is the second with a decomposed "ç" and "ã"
+        ["VACINAS causam autismo?", "A inflação  caiu?", unicodedata.normalize("NFD", "a inflação caiu?"),
+         "O salário mínimo subiu?"]
+    )
+    assert model.seen == ["Vacinas causam autismo?", "A inflação  caiu?", "O salário mínimo subiu?"]
+    assert vectors[1] == vectors[2]
+    assert vectors[0] == embeddings.embed_query("vacinas causam autismo?")
+    assert asyncio.run(embeddings.aembed_queries(["a inflação caiu?"])) == [vectors[1]]
+    assert len(model.seen) == 3
+
+
+def test_disk_tier_serves_variants_after_a_restart(tmp_path):
+    model, embeddings = cached(tmp_path)
+    vector = embeddings.embed_query("Lisboa tem mais turistas?")
+
+    model, restarted = cached(tmp_path)
+    assert restarted.embed_query("lisboa TEM mais turistas?") == vector
+    assert model.seen == []
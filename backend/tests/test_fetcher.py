@@ -0,0 +1,120 @@
+import time
+import random
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from aiohttp import web
+import pytest
+from api.src import fetcher
+from api.src.fetcher import AsyncFetcher, parse_retry_after
+from tests.helpers import ARRIVALS, scripted, serve
+
+
+def test_parse_retry_after_accepts_seconds_and_http_dates():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=90), usegmt=True)
+    assert 80 < parse_retry_after(when) <= 90
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1), usegmt=True)
+    assert parse_retry_after(past) == 0.0
+
+
+def test_retries_with_exponential_backoff_then_succeeds(monkeypatch):
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+
+    async def run():
+        handler = scripted(
+            lambda: web.Response(status=503), lambda: web.Response(status=502), lambda: web.Response(text="ok")
+        )
+        async with serve(handler) as (app, port):
+            async with AsyncFetcher(rate_per_host=0, backoff=0.05) as client:
+                result = await client.fetch(f"http://127.0.0.1:{port}/artigo/")
+            return result, [at for _, at in app[ARRIVALS]]
+
+    result, arrivals = asyncio.run(run())
+    assert (result.status, result.text) == (200, "ok")
+    assert len(arrivals) == 3
+    # backoff * 2 ** attempt: 0.05s, then 0.1s
+    assert arrivals[1] - arrivals[0] >= 0.05
+    assert arrivals[2] - arrivals[1] >= 0.1
+
+
+def test_gives_up_after_max_retries_but_returns_other_statuses():
+    async def run():
+        async with serve(scripted(lambda: web.Response(status=500))) as (app, port):
+            async with AsyncFetcher(rate_per_host=0, max_retries=2, backoff=0.001) as client:
+                failed = await client.fetch(f"http://127.0.0.1:{port}/artigo/")
+            attempts = len(app[ARRIVALS])
+        async with serve(scripted(lambda: web.Response(status=404, text="nada"))) as (app, port):
+            async with AsyncFetcher(rate_per_host=0, backoff=0.001) as client:
+                missing = await client.fetch(f"http://127.0.0.1:{port}/artigo/")
+            return failed, attempts, missing, len(app[ARRIVALS])
+
+    failed, attempts, missing, missing_attempts = asyncio.run(run())
+    assert failed is None
+    assert attempts == 3
+    assert (missing.status, missing.text, missing_attempts) == (404, "nada", 1)
+
+
+def test_retry_after_is_honoured_and_capped(monkeypatch):
+    monkeypatch.setattr(fetcher, "SCRAPE_MAX_RETRY_AFTER", 0.2)
+    deferred = []
+
+    async def run():
+        handler = scripted(
+            lambda: web.Response(status=429, headers={"Retry-After": "0.1"}),
+            lambda: web.Response(status=503, headers={"Retry-After": "3600"}),
+            lambda: web.Response(text="ok")
+        )
+        async with serve(handler) as (app, port):
+            async with AsyncFetcher(rate_per_host=0, backoff=30) as client:
+                defer = client.rate_limiter.defer
+                client.rate_limiter.defer = lambda host, seconds: (deferred.append(seconds), defer(host, seconds))
+                started = time.monotonic()
+                result = await client.fetch(f"http://127.0.0.1:{port}/artigo/")
+                return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result.text == "ok"
+    # Waited what the server asked for (capped), not the 30s backoff
+    assert deferred == [0.1, 0.2]
+    assert 0.3 <= elapsed < 5
+
+
+def test_rate_limit_spaces_requests_per_host():
+    async def run():
+        async with serve(scripted(lambda: web.Response(text="ok"))) as (app, port):
+            async with AsyncFetcher(rate_per_host=20) as client:
+                await asyncio.gather(*(
+                    client.fetch(f"http://{host}:{port}/artigo-{n}/")
+                    for n in range(4) for host in ("127.0.0.1", "localhost")
+                ))
+            return app[ARRIVALS]
+
+    arrivals = asyncio.run(run())
+    by_host = {}
+    for host, at in arrivals:
+        by_host.setdefault(host.rsplit(":", 1)[0], []).append(at)
+    assert sorted(by_host) == ["127.0.0.1", "localhost"]
+    for times in by_host.values():
+        assert len(times) == 4
+        # 20 requests/s: starts at least 50ms apart, less a little timer slack
+        assert all(later - earlier >= 0.04 for earlier, later in zip(times, times[1:]))
+    # Each host has its own schedule: the second host isn't queued behind the first
+    assert abs(by_host["127.0.0.1"][0] - by_host["localhost"][0]) < 0.04
+
+
+@pytest.mark.parametrize("charset", ["utf-8", "x-desconhecido"])
+def test_undecodable_pages_are_kept_with_replacement_characters(charset):
+    async def run():
+        body = "Café com leite".encode("latin-1")
+        handler = scripted(lambda: web.Response(body=body, headers={"Content-Type": f"text/html; charset={charset}"}))
+        async with serve(handler) as (_, port):
+            async with AsyncFetcher(rate_per_host=0) as client:
+                return await client.fetch(f"http://127.0.0.1:{port}/artigo/")
+
+    result = asyncio.run(run())
+    assert result.status == 200
+    assert result.text == "Caf� com leite"
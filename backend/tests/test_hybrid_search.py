@@ -0,0 +1,45 @@
+import pytest
+from api.src.index_format import CompactIndex, IndexWriter, fuse_rankings
+from tests.helpers import make_chunks
+
+
+@pytest.fixture(scope="module")
+def chunks():
+    return make_chunks(300)
+
+
+@pytest.fixture(scope="module")
+def index(chunks, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("index"))
+    ids, docs, vectors = chunks
+    writer = IndexWriter.create(path, vectors.shape[1], "flat", "none")
+    writer.add(ids, docs, vectors)
+    writer.save()
+    return CompactIndex(path)
+
+
+def test_hybrid_search_holds_keyword_hits_to_the_threshold(index, chunks):
+    _, docs, vectors = chunks
+    query = vectors[10]
+    # "artigo 90" matches chunks far from the query vector
+    text = "excerto 270 artigo 90"
+    unfiltered = index.hybrid_search(text, query, 10)
+    assert any(score > 1.0 for _, score in unfiltered)
+
+    threshold = 1.0
+    results = index.hybrid_search(text, query, 10, max_distance=threshold)
+    assert results and all(score <= threshold for _, score in results)
+
+
+def test_hybrid_search_falls_back_to_the_nearest_chunk(index, chunks):
+    _, docs, vectors = chunks
+    results = index.hybrid_search("artigo 90", vectors[10], 10, max_distance=-1.0)
+    assert [doc.page_content for doc, _ in results] == [docs[10].page_content]
+
+
+def test_fuse_rankings_drops_keyword_hits_beyond_max_distance():
+    distance = {1: 0.1, 2: 0.5, 3: 2.0}
+    lexical = [(9, 12.0), (3, 10.0), (8, 7.0)]
+    fused = fuse_rankings(distance, lexical, 10, max_distance=1.0, lexical_distance={9: 0.8, 8: 3.0})
+    assert set(fused) == {1, 2, 9}
+    assert set(fuse_rankings(distance, lexical, 10)) == {1, 2, 3, 8, 9}
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from api.src import index_format
+from api.src.attribute_index import SearchFilter
+from api.src.index_format import CompactIndex, IndexWriter
+from tests.helpers import make_chunks
+
+
+@pytest.fixture(scope="module")
+def chunks():
+    return make_chunks(300)
+
+
+@pytest.fixture(scope="module")
+def index(chunks, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("index"))
+    ids, docs, vectors = chunks
+    writer = IndexWriter.create(path, vectors.shape[1], "flat", "none")
+    writer.add(ids, docs, vectors)
+    writer.save()
+    return CompactIndex(path)
+
+
+def brute_force(vectors, query, rows, k):
+    distances = ((vectors[rows] - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return [rows[i] for i in order], distances[order]
+
+
+def test_unfiltered_search_matches_brute_force(index, chunks):
+    _, docs, vectors = chunks
+    query = vectors[7] + 0.01
+    expected, distances = brute_force(vectors, query, list(range(len(vectors))), 5)
+
+    results = index.search_by_vector(query, 5)
+    assert [doc.page_content for doc, _ in results] == [docs[row].page_content for row in expected]
+    assert np.allclose([score for _, score in results], distances, rtol=1e-4)
+
+
+@pytest.mark.parametrize("exact_max", [0, 10_000])
+def test_filtered_search_matches_brute_force_over_matching_rows(index, chunks, monkeypatch, exact_max):
+    # exact_max 0 goes through the faiss selector, 10 000 through the brute force path
+    monkeypatch.setattr(index_format, "FILTER_EXACT_MAX", exact_max)
+    _, docs, vectors = chunks
+    search_filter = SearchFilter(verdicts=["Falso"], published_from="2023-03-01", published_to="2023-09-30")
+    rows = [
+        n for n, doc in enumerate(docs)
+        if doc.metadata["verdict"] == "Falso" and "2023-03" <= doc.metadata["published"][:7] <= "2023-09"
+    ]
+    queries = vectors[[0, 50, 100]]
+
+    results = index.search_by_vectors(queries, 4, search_filter=search_filter)
+    for query, found in zip(queries, results):
+        expected, distances = brute_force(vectors, query, rows, 4)
+        assert [doc.page_content for doc, _ in found] == [docs[row].page_content for row in expected]
+        assert np.allclose([score for _, score in found], distances, rtol=1e-4)
+
+
+def test_exact_search_pads_when_fewer_rows_than_k(index, chunks):
+    _, _, vectors = chunks
+    distances, labels = index._exact_search(vectors[:2], np.array([3, 4]), 5)
+    assert (labels[:, 2:] == -1).all()
+    assert np.isinf(distances[:, 2:]).all()
+    assert set(labels[0, :2]) == {3, 4}
+
+
+def test_exact_search_without_stored_vectors_returns_no_hits(index, chunks, monkeypatch):
+    _, _, vectors = chunks
+    monkeypatch.setattr(index, "_vectors", lambda row_ids: ([], None))
+    distances, labels = index._exact_search(vectors[:1], np.array([3, 4]), 3)
+    assert (labels == -1).all()
+    assert index.distances(vectors[0], [3, 4]) == {}
+
+
+def test_attribute_selector_bitmap(index):
+    selector = index.attributes.selector(np.array([0, 9, 17, 299]))
+    assert [row for row in range(310) if selector.is_member(row)] == [0, 9, 17, 299]
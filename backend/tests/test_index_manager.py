@@ -0,0 +1,72 @@
+import os
+import tempfile
+import pytest
+from langchain_community.vectorstores import FAISS
+from api.src import article_store, build_index as build_module, index_manager as manager_module
+from api.src.index_manager import IndexManager
+from api.src.chatbot import answer_question
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.fixtures import synthetic_record
+
+BASE_URL = "https://poligrafo.sapo.pt/fact-checks/"
+
+
+def publish(start, count):
+    with article_store.SegmentWriter(flush_size=1000) as writer:
+        for n in range(start, start + count):
+            writer.add(synthetic_record(n, BASE_URL))
+    return build_module.build_index()
+
+
+def test_request_keeps_its_snapshot_across_swaps(fake_s3):
+    first = publish(0, 6)
+    manager = IndexManager()
+    assert manager.refresh()
+    in_flight = manager.current()
+    assert manager.version == in_flight.version == first
+
+    # Two more versions: the local cache keeps two, so the first one is pruned from disk
+    publish(6, 6)
+    assert manager.refresh()
+    latest = publish(12, 6)
+    assert manager.refresh()
+    assert not manager.refresh()
+    assert manager.current().version == latest
+    assert in_flight.version == first
+    assert not os.path.exists(in_flight.index.path)
+
+    response = answer_question(in_flight, synthetic_record(2, BASE_URL)["title"])
+    assert response["index_version"] == first
+    assert response["sources"]
+    assert in_flight.index.ntotal < manager.current().index.ntotal
+
+
+def publish_legacy(s3, texts):
+    with tempfile.TemporaryDirectory() as local_dir:
+        FAISS.from_texts(texts, HashingEmbeddings()).save_local(local_dir)
+        for name in os.listdir(local_dir):
+            s3.upload_file(os.path.join(local_dir, name), "tests", f"{manager_module.S3_PREFIX}{name}")
+
+
+def test_legacy_load_removes_its_download_dir(fake_s3, tmp_path, monkeypatch):
+    publish_legacy(fake_s3, ["Vacinas causam autismo.", "O salário mínimo subiu."])
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    manager = IndexManager()
+    assert manager.refresh()
+    assert os.listdir(tmp_path) == []
+    # Loaded into memory, so it still answers with the download gone
+    results = manager.current().index.search_by_vector(HashingEmbeddings().embed_query("Vacinas causam autismo."), 1)
+    assert results[0][0].page_content == "Vacinas causam autismo."
+
+
+def test_failed_legacy_load_removes_its_download_dir(fake_s3, tmp_path, monkeypatch):
+    publish_legacy(fake_s3, ["Vacinas causam autismo."])
+    fake_s3.delete_object(Bucket="tests", Key=f"{manager_module.S3_PREFIX}index.pkl")
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    manager = IndexManager()
+    with pytest.raises(Exception):
+        manager.refresh()
+    assert os.listdir(tmp_path) == []
+    assert manager.version is None
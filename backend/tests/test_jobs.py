@@ -0,0 +1,97 @@
+import time
+import pytest
+from api.src.jobs import JobRunner, JobConflict
+from tests.job_targets import wait_for_release, fail
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not met in time")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def runner():
+    runner = JobRunner()
+    yield runner
+    runner.shutdown()
+
+
+def test_one_job_per_type(runner, tmp_path):
+    release = str(tmp_path / "release")
+    runner.register("reindex", wait_for_release)
+    runner.register("update-data", wait_for_release)
+
+    job = runner.submit("reindex", release=release, label="incremental")
+    assert runner.submit("reindex", release=release, label="incremental") is job
+    with pytest.raises(JobConflict) as conflict:
+        runner.submit("reindex", release=release, label="rebuild")
+    assert conflict.value.job is job
+    # Other types have their own worker
+    other = runner.submit("update-data", release=release, label="scrape")
+    assert other is not job
+
+    open(release, "w").close()
+    wait_until(lambda: not job.active and not other.active)
+    # Once finished, the next request starts a new job whatever its parameters
+    rebuild = runner.submit("reindex", release=release, label="rebuild")
+    assert rebuild is not job
+    wait_until(lambda: not rebuild.active)
+    assert [j.result for j in (job, other, rebuild)] == ["incremental", "scrape", "rebuild"]
+    assert runner.list()[0] is rebuild
+
+
+def test_status_and_progress(runner, tmp_path):
+    release = str(tmp_path / "release")
+    runner.register("reindex", wait_for_release)
+    job = runner.submit("reindex", release=release, label="incremental")
+    assert runner.get(job.id) is job
+
+    wait_until(lambda: job.to_dict()["progress"] == ["started incremental"])
+    status = job.to_dict()
+    assert (status["status"], status["finished"], status["params"]) == (
+        "running", None, {"release": release, "label": "incremental"}
+    )
+
+    open(release, "w").close()
+    wait_until(lambda: not job.active)
+    status = job.to_dict()
+    assert (status["status"], status["result"], status["error"]) == ("succeeded", "incremental", None)
+    assert status["progress"] == ["started incremental", "released incremental"]
+    assert status["finished"] >= status["started"]
+    assert job.to_dict(progress_lines=0)["progress"] == []
+
+
+def test_failed_job_reports_its_error_and_traceback(runner):
+    runner.register("reindex", fail)
+    job = runner.submit("reindex", message="sem artigos")
+    wait_until(lambda: not job.active)
+    status = job.to_dict()
+    assert (status["status"], status["error"]) == ("failed", "ValueError: sem artigos")
+    assert "ValueError: sem artigos" in status["progress"]
+
+
+def test_on_success_runs_in_the_api_process_before_success(runner, tmp_path):
+    release = str(tmp_path / "release")
+    open(release, "w").close()
+    seen = []
+
+    def load_new_index(job, result):
+        seen.append((job.status, result))
+        return {"published_version": result}
+
+    runner.register("reindex", wait_for_release, on_success=load_new_index)
+    job = runner.submit("reindex", release=release, label="v2")
+    wait_until(lambda: not job.active)
+    assert seen == [("running", "v2")]
+    assert (job.status, job.result) == ("succeeded", {"published_version": "v2"})
+
+    def broken(job, result):
+        raise RuntimeError("index not loaded")
+
+    runner.register("reindex", wait_for_release, on_success=broken)
+    job = runner.submit("reindex", release=release, label="v3")
+    wait_until(lambda: not job.active)
+    assert (job.status, job.error) == ("failed", "RuntimeError: index not loaded")
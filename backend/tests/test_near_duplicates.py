@@ -0,0 +1,55 @@
+import random
+from langchain_core.documents import Document
+from api.src.chunker import ChunkStream
+from api.src.near_duplicates import SimHashIndex, hamming, simhash, unique_chunks
+from tests.helpers import FOOTER, make_article
+
+
+def flip(fingerprint, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def test_index_finds_every_fingerprint_within_the_distance():
+    rng = random.Random(0)
+    index = SimHashIndex(max_distance=3)
+    stored = [rng.getrandbits(64) for _ in range(500)]
+    for n, fingerprint in enumerate(stored):
+        index.add(fingerprint, n)
+
+    for n, fingerprint in enumerate(stored[:100]):
+        assert index.find(flip(fingerprint, rng.randint(0, 3), rng)) == n
+    assert index.find(flip(stored[0], 12, rng)) is None
+
+
+def test_identical_text_has_identical_fingerprints():
+    assert hamming(simhash(FOOTER), simhash(" ".join(FOOTER.split()))) == 0
+    assert simhash("...") is None
+
+
+def test_unique_chunks_keeps_the_first_copy():
+    docs = [Document(page_content=text) for text in (FOOTER, "Outro parágrafo sobre rendas em Lisboa.", FOOTER)]
+    assert unique_chunks(docs) == [0, 1]
+
+
+def test_chunk_stream_drops_repeats_across_articles():
+    rng = random.Random(1)
+    articles = [make_article(n, rng) for n in range(20)]
+
+    within = ChunkStream(iter(articles), workers=0, across_articles=False)
+    chunks, _, within_entries = within.collect()
+    assert sum(chunk.page_content == FOOTER for chunk in chunks) == 20
+
+    across = ChunkStream(iter(articles), workers=0)
+    chunks, ids, entries = across.collect()
+    assert sum(chunk.page_content == FOOTER for chunk in chunks) == 1
+    assert across.cross_duplicates == 19
+    assert across.duplicates == 19
+    # Every article keeps its entry and its full piece count, plus who kept its footer
+    first = articles[0][0]
+    assert {aid: list(entry.pop("dropped").values()) for aid, entry in entries.items() if aid != first} == {
+        aid: [first] for aid, _, _ in articles[1:]
+    }
+    assert entries == within_entries
+    assert len(set(ids)) == len(ids)
@@ -0,0 +1,116 @@
+import asyncio
+from aiohttp import web
+from api.src import data_collect
+from api.src.article_parser import parse_article_html
+from api.src.article_store import SegmentWriter, iter_articles
+from api.src.fetcher import AsyncFetcher
+from api.src.page_cache import PageCache
+from benchmarks.fixtures import FixtureSite, synthetic_article, synthetic_record
+from tests.helpers import serve
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Tue, 05 Mar 2024 10:00:00 GMT"
+
+
+def test_validators_are_sent_and_304_is_served_from_the_cache(tmp_path):
+    seen = []
+
+    async def handler(request):
+        seen.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304, headers={"ETag": ETAG})
+        return web.Response(text="<p>Página</p>", headers={"ETag": ETAG, "Last-Modified": LAST_MODIFIED})
+
+    async def run(cache):
+        async with serve(handler) as (_, port):
+            async with AsyncFetcher(rate_per_host=0) as client:
+                url = f"http://127.0.0.1:{port}/artigo/"
+                return await cache.fetch(client, url), await cache.fetch(client, url)
+
+    with PageCache(str(tmp_path / "pages.sqlite")) as cache:
+        first, second = asyncio.run(run(cache))
+        assert (first.status, first.from_cache) == (200, False)
+        assert "If-None-Match" not in seen[0]
+        assert seen[1]["If-None-Match"] == ETAG
+        assert seen[1]["If-Modified-Since"] == LAST_MODIFIED
+        assert (second.status, second.text, second.from_cache) == (200, "<p>Página</p>", True)
+        assert cache.stats()["not_modified"] == 1
+        assert cache.stats()["downloaded"] == 1
+
+
+def test_changed_page_replaces_the_cached_copy(tmp_path):
+    versions = iter(["primeira", "segunda"])
+
+    async def handler(request):
+        text = next(versions)
+        return web.Response(text=text, headers={"ETag": f'"{text}"'})
+
+    async def run(cache):
+        async with serve(handler) as (_, port):
+            async with AsyncFetcher(rate_per_host=0) as client:
+                url = f"http://127.0.0.1:{port}/artigo/"
+                await cache.fetch(client, url)
+                await cache.fetch(client, url)
+                return url
+
+    with PageCache(str(tmp_path / "pages.sqlite")) as cache:
+        url = asyncio.run(run(cache))
+        stored = cache.get(url)
+        assert (stored.text, stored.etag) == ("segunda", '"segunda"')
+        assert len(cache) == 1
+
+
+def collect(writer, cache, max_pages, backfill=False):
+    return asyncio.run(data_collect.collect_articles(writer, None, max_pages, backfill=backfill, cache=cache))
+
+
+def test_incremental_run_skips_stored_urls_and_backfill_revalidates(fake_s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_collect, "parse_pool", lambda: None)
+    with FixtureSite(total=8, per_page=8) as site, PageCache(str(tmp_path / "pages.sqlite")) as cache:
+        monkeypatch.setattr(data_collect, "BASE_URL", site.base_url)
+        with SegmentWriter() as writer:
+            for n in range(3, 8):
+                writer.add(synthetic_record(n, site.base_url))
+
+        # Newest first: stops at article 3 without downloading it
+        with SegmentWriter() as writer:
+            collect(writer, cache, max_pages=1)
+        assert site.requests == 1 + 3
+        assert len(cache) == 3
+
+        # A backfill downloads the rest and re-validates the cached pages
+        with SegmentWriter() as writer:
+            collect(writer, cache, max_pages=1, backfill=True)
+        assert site.requests == 1 + 3 + 1 + 8
+        assert site.not_modified == 3
+        assert len(cache) == 8
+    assert len(list(iter_articles())) == 8
+
+
+def test_reparse_stores_what_the_current_parser_extracts(fake_s3, tmp_path, monkeypatch):
+    with PageCache(str(tmp_path / "pages.sqlite")) as cache:
+        pages = [synthetic_article(n) for n in range(5)]
+        for url, html in pages:
+            cache.put(url, html)
+
+        with SegmentWriter() as writer:
+            assert data_collect.reparse_cached_pages(writer, cache, batch_size=2) == 5
+        assert writer.saved == 5
+
+        # A parser change only rewrites the articles whose extraction changed
+        def parse_uppercase_titles(html, url):
+            article = parse_article_html(html, url)
+            if url.endswith("artigo-1/"):
+                article["title"] = article["title"].upper()
+            return article
+
+        monkeypatch.setattr(data_collect, "parse_article_html", parse_uppercase_titles)
+        with SegmentWriter() as writer:
+            data_collect.reparse_cached_pages(writer, cache)
+        assert writer.saved == 1
+
+    titles = {article["url"]: article["title"] for article in iter_articles()}
+    assert titles[pages[1][0]].isupper()
+    assert titles == {
+        url: parse_uppercase_titles(html, url)["title"] for url, html in pages
+    }
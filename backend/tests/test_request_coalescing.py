@@ -0,0 +1,189 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from api.src.request_coalescing import SingleFlight, LLMGate, Overloaded
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_single_flight_runs_identical_calls_once():
+    flights = SingleFlight()
+    calls = []
+    results = []
+
+    def answer():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    run_threads(10, lambda: results.append(flights.do("key", answer)))
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 9
+    assert all(result == "answer" for result, _ in results)
+    assert flights.in_flight() == 0
+
+
+def test_single_flight_shares_the_leaders_error():
+    flights = SingleFlight()
+    errors = []
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    def ask():
+        try:
+            flights.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    run_threads(5, ask)
+    assert len(errors) == 5
+
+
+def test_single_flight_follower_stops_waiting_on_a_hung_leader():
+    flights = SingleFlight(timeout=0.1)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("key", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.perf_counter()
+    assert flights.do("key", lambda: "own answer") == ("own answer", False)
+    assert time.perf_counter() - started < 1
+    release.set()
+    leader.join()
+
+
+def test_single_flight_follower_is_answered_when_the_leader_is_rejected():
+    flights = SingleFlight(timeout=5)
+    release = threading.Event()
+    results = []
+    errors = []
+
+    def rejected():
+        release.wait(5)
+        raise Overloaded(3)
+
+    def ask_first():
+        try:
+            flights.do("key", rejected)
+        except Overloaded as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=ask_first)
+    leader.start()
+    time.sleep(0.05)
+    follower = threading.Thread(target=lambda: results.append(flights.do("key", lambda: "answer")))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 1
+    # The follower's own call answered it: there was no result to share
+    assert results == [("answer", False)]
+    assert flights.in_flight() == 0
+
+
+def test_gate_bounds_concurrent_calls():
+    gate = LLMGate(concurrency=3, max_queue=100, timeout=5)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with gate.slot():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+    run_threads(20, call)
+    assert max(peak) == 3
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_gate_rejects_when_the_queue_is_full():
+    gate = LLMGate(concurrency=1, max_queue=1, timeout=5)
+    gate.acquire()
+    waiter = threading.Thread(target=lambda: (gate.acquire(), gate.release()))
+    waiter.start()
+    time.sleep(0.05)
+
+    with pytest.raises(Overloaded) as rejected:
+        gate.admit()
+    assert rejected.value.retry_after >= 1
+    with pytest.raises(Overloaded):
+        gate.acquire()
+
+    gate.release()
+    waiter.join()
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_gate_times_out_queued_requests():
+    gate = LLMGate(concurrency=1, max_queue=5, timeout=0.1)
+    gate.acquire()
+    with pytest.raises(Overloaded):
+        gate.acquire()
+    assert gate.waiting == 0
+    # Without reject, the request waits for its slot instead
+    threading.Timer(0.2, gate.release).start()
+    gate.acquire(reject=False)
+    gate.release()
+    assert gate.active == 0
+
+
+def test_async_waiters_hold_no_executor_threads():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+        gate = LLMGate(concurrency=1, max_queue=50, timeout=5)
+
+        async def call():
+            async with gate.async_slot():
+                await asyncio.sleep(0.01)
+
+        calls = [asyncio.create_task(call()) for _ in range(30)]
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        # Work of requests that never need the gate still gets a thread right away
+        await asyncio.to_thread(lambda: None)
+        latency = time.perf_counter() - started
+        await asyncio.gather(*calls)
+        return latency, gate
+
+    latency, gate = asyncio.run(scenario())
+    assert latency < 0.1
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    async def scenario():
+        gate = LLMGate(concurrency=1, max_queue=5, timeout=5)
+        gate.acquire()
+        waiter = asyncio.create_task(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        assert gate.waiting == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.waiting == 0
+        gate.release()
+        return gate
+
+    gate = asyncio.run(scenario())
+    assert gate.active == 0
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from api.src.attribute_index import SearchFilter
+from api.src.index_format import CompactIndex, IndexWriter
+from api.src.metrics import request_timings
+from api.src.sharded_index import ShardedIndex, ShardedIndexWriter, load_index, shard_name
+from tests.helpers import make_chunks
+
+
+@pytest.fixture(scope="module")
+def chunks():
+    return make_chunks(240)
+
+
+@pytest.fixture(scope="module")
+def indexes(chunks, tmp_path_factory):
+    ids, docs, vectors = chunks
+    single_path = str(tmp_path_factory.mktemp("single"))
+    writer = IndexWriter.create(single_path, vectors.shape[1], "flat", "none")
+    writer.add(ids, docs, vectors)
+    writer.save()
+
+    sharded_path = str(tmp_path_factory.mktemp("sharded"))
+    writer = ShardedIndexWriter(sharded_path, "month", "flat", "none")
+    # Added in two batches, as the streaming build does
+    writer.add(ids[:100], docs[:100], vectors[:100])
+    writer.add(ids[100:], docs[100:], vectors[100:])
+    writer.save()
+    return CompactIndex(single_path), load_index(sharded_path, None)
+
+
+def contents(results):
+    return [doc.page_content for doc, _ in results]
+
+
+def test_chunks_are_split_by_month(indexes):
+    _, sharded = indexes
+    assert isinstance(sharded, ShardedIndex)
+    assert len(sharded.shards) == 24
+    assert sharded.ntotal == 240
+    assert shard_name("2024-02-29T12:00:00", "month") == "2024-02"
+    assert shard_name("2024-02-29T12:00:00", "year") == "2024"
+    assert shard_name(None, "month") == "undated"
+
+
+def test_merged_vector_search_matches_a_single_index(indexes, chunks):
+    single, sharded = indexes
+    _, _, vectors = chunks
+    queries = vectors[[1, 77, 150, 239]] + 0.05
+
+    for expected, found in zip(single.search_by_vectors(queries, 8), sharded.search_by_vectors(queries, 8)):
+        assert contents(found) == contents(expected)
+        assert np.allclose([s for _, s in found], [s for _, s in expected], rtol=1e-4)
+
+
+def test_filtered_search_matches_a_single_index(indexes, chunks):
+    single, sharded = indexes
+    _, _, vectors = chunks
+    search_filter = SearchFilter(verdicts=["Verdadeiro"], published_from="2024-02-01", published_to="2024-06-30")
+
+    expected = single.search_by_vector(vectors[5], 6, search_filter=search_filter)
+    found = sharded.search_by_vector(vectors[5], 6, search_filter=search_filter)
+    assert contents(found) == contents(expected)
+    assert all("2024-02" <= doc.metadata["published"][:7] <= "2024-06" for doc, _ in found)
+
+
+def test_date_filters_only_search_overlapping_shards(indexes):
+    _, sharded = indexes
+    selected = sharded._select(SearchFilter(published_from="2023-05-01", published_to="2023-07-31"))
+    assert len(selected) == 3
+
+
+def test_merged_hybrid_search_holds_the_threshold(indexes, chunks):
+    _, sharded = indexes
+    _, _, vectors = chunks
+    results = sharded.hybrid_search("excerto 200 artigo 66", vectors[3], 10, max_distance=1.0)
+    assert results and all(score <= 1.0 for _, score in results)
+    assert contents(results)[0] == "Texto do excerto 3 sobre o artigo 1."
+
+
+def test_executor_stages_reach_the_request_timings(indexes, chunks):
+    single, sharded = indexes
+    _, _, vectors = chunks
+    sharded_stages = {"shard_search", "shard_documents", "lexical_search"}
+    for index, stages in ((single, {"lexical_search"}), (sharded, sharded_stages)):
+        timings = {}
+        token = request_timings.set(timings)
+        try:
+            index.hybrid_search_many(["excerto 3", "artigo 66"], vectors[[3, 66]], 5)
+        finally:
+            request_timings.reset(token)
+        assert set(timings) == stages
+        assert all(seconds > 0 for seconds in timings.values())
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import os
 
 hide_streamlit_style = """
@@ -13,6 +14,7 @@ hide_streamlit_style = """
 
 
 API_URL = os.getenv("API_URL") + "ask"
+STREAM_URL = API_URL + "/stream"
 
 st.set_page_config(page_title="Polígrafo Fact-Check Chatbot", page_icon="🗳️")
 
@@ -24,36 +26,71 @@ st.markdown("Ask a question and get a verified response based on real fact-check
 # Input box
 query = st.text_input("Enter your question here", placeholder="e.g. O Chega ganhou mesmo em 60 concelhos?")
 
+def iter_sse_events(response):
+    """
+    Minimal Server-Sent Events reader: yields (event, data) pairs from a streaming response.
+    """
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+def render_sources(container, sources, scores):
+    with container:
+        # Display sources
+        st.subheader("📚 Sources")
+        for src in sources:
+            if "(" in src and src.endswith(")"):
+                title, url = src.rsplit("(", 1)
+                url = url.rstrip(")")
+                st.markdown(f"- [{title.strip()}]({url})")
+            else:
+                st.markdown(f"- {src}")
+
+        # Display retrieved chunks (optional)
+        with st.expander("🔍 Show retrieved article snippets"):
+            for src, score in zip(sources, scores):
+                if "(" in src and src.endswith(")"):
+                    title, url = src.rsplit("(", 1)
+                    url = url.rstrip(")")
+                    st.markdown(f"- [{title.strip()}]({url}) — **Score:** {1 - score:.2f}")
+
 if st.button("Ask") and query:
     with st.spinner("Consulting Polígrafo..."):
         try:
-            response = requests.post(API_URL, json={"query": query, "source_threshold": 0.8})
+            response = requests.post(
+                STREAM_URL,
+                json={"query": query, "source_threshold": 0.8},
+                stream=True,
+                headers={"Accept": "text/event-stream"}
+            )
             if response.status_code == 200:
-                data = response.json()
+                response.encoding = "utf-8"
 
-                # Display answer
+                # Display answer, filled in token by token
                 st.subheader("🤖 Answer")
-                st.write(data["answer"])
-
-                # Display sources
-                st.subheader("📚 Sources")
-                for src in data["sources"]:
-                    if "(" in src and src.endswith(")"):
-                        title, url = src.rsplit("(", 1)
-                        url = url.rstrip(")")
-                        st.markdown(f"- [{title.strip()}]({url})")
-                    else:
-                        st.markdown(f"- {src}")
-
-                # Display retrieved chunks (optional)
-                with st.expander("🔍 Show retrieved article snippets"):
-                    for src, score in zip(data["sources"], data["scores"]):
-                        if "(" in src and src.endswith(")"):
-                            title, url = src.rsplit("(", 1)
-                            url = url.rstrip(")")
-                            st.markdown(f"- [{title.strip()}]({url}) — **Score:** {1 - score:.2f}")
+                answer_placeholder = st.empty()
+                sources_container = st.container()
+
+                answer = ""
+                for event, data in iter_sse_events(response):
+                    if event == "sources":
+                        render_sources(sources_container, data["sources"], data["scores"])
+                    elif event == "token":
+                        answer += data["text"]
+                        answer_placeholder.markdown(answer + "▌")
+                    elif event == "done":
+                        answer_placeholder.markdown(data["answer"])
+                    elif event == "error":
+                        st.error(f"Error from API: {data['detail']}")
 
             else:
                 st.error(f"Error from API: {response.status_code} - {response.text}")
         except Exception as e:
-            st.error(f"Request failed: {e}")
\ No newline at end of file
+            st.error(f"Request failed: {e}")